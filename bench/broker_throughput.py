@@ -0,0 +1,136 @@
+"""Measures the number of messages per second handled by a broker, with and
+without its I/O thread. Simulated workers receive empty Futures from a
+producer and send their results back through the broker, without running
+SCOOP:
+
+    python bench/broker_throughput.py --workers 8 --tasks 100000
+"""
+import argparse
+import multiprocessing
+import pickle
+import time
+
+import zmq
+
+from scoop._comm.scoopmessages import (TASK, TASKS, REPLY, REQUEST,
+                                       STATUS_READY, SHUTDOWN, TASK_HEADER,
+                                       RESULT_HEADER, FRAME_COUNT,
+                                       FLAG_SEND_RESULT_BACK, FLAG_DONE)
+
+PRODUCER = b"producer"
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description=('Measure the throughput of a broker.')
+    )
+    parser.add_argument('--workers', type = int, default = 8,
+                        help = "The number of simulated workers")
+    parser.add_argument('--tasks', type = int, default = 100000,
+                        help = "The number of Futures sent to the workers")
+    parser.add_argument('--credits', type = int, default = 16,
+                        help = "The number of Futures requested in advance "
+                               "by every worker")
+    parser.add_argument('--repeat', type = int, default = 3,
+                        help = "The number of measures of every broker mode, "
+                               "the best one is kept")
+    return parser
+
+
+def run_broker(port_queue, broker_options):
+    from scoop.broker.brokerzmq import Broker
+    broker = Broker("tcp://127.0.0.1:*", "tcp://127.0.0.1:*",
+                    **broker_options)
+    port_queue.put(broker.getPorts()[0])
+    broker.run()
+    # CPU time used by the broker, every thread included
+    port_queue.put(time.process_time())
+
+
+def connect(port, identity):
+    socket = zmq.Context.instance().socket(zmq.DEALER)
+    socket.setsockopt(zmq.IDENTITY, identity)
+    socket.setsockopt(zmq.SNDHWM, 0)
+    socket.setsockopt(zmq.RCVHWM, 0)
+    socket.connect("tcp://127.0.0.1:{0}".format(port))
+    return socket
+
+
+def run_worker(port, index, credits):
+    """Sends back the result of every Future received and asks for another
+    one, as the workers do with prefetching."""
+    socket = connect(port, "worker{0}".format(index).encode())
+    socket.send_multipart([REQUEST, pickle.dumps(credits)])
+    result = pickle.dumps((None, None, None))
+    while True:
+        msg = socket.recv_multipart()
+        if msg[0] == TASK:
+            tasks = [msg[1:]]
+        elif msg[0] == TASKS:
+            tasks = []
+            position = 2
+            for index in range(0, len(msg[1]), FRAME_COUNT.size):
+                count, = FRAME_COUNT.unpack_from(msg[1], index)
+                tasks.append(msg[position:position + count])
+                position += count
+        else:
+            break
+        for task in tasks:
+            rank = TASK_HEADER.unpack(task[0])[0]
+            task_id = pickle.dumps((task[1], rank), pickle.HIGHEST_PROTOCOL)
+            socket.send_multipart([REPLY,
+                                   RESULT_HEADER.pack(rank, FLAG_DONE),
+                                   task[1],
+                                   result,
+                                   task[1]])
+            socket.send_multipart([STATUS_READY, task_id])
+            socket.send_multipart([REQUEST, pickle.dumps(1)])
+
+
+def measure(args, broker_options):
+    """Returns the number of messages per second handled by the broker and
+    the number of messages per second of CPU time used by the broker."""
+    port_queue = multiprocessing.Queue()
+    broker = multiprocessing.Process(target=run_broker,
+                                     args=(port_queue, broker_options))
+    broker.start()
+    port = port_queue.get()
+    workers = [multiprocessing.Process(target=run_worker,
+                                       args=(port, i, args.credits))
+               for i in range(args.workers)]
+    for worker in workers:
+        worker.start()
+
+    producer = connect(port, PRODUCER)
+    frames = [PRODUCER, PRODUCER, b"func", pickle.dumps(((), {}, None))]
+    time.sleep(0.5)
+    begin_time = time.time()
+    for rank in range(args.tasks):
+        producer.send_multipart([
+            TASK,
+            pickle.dumps((PRODUCER, rank), pickle.HIGHEST_PROTOCOL),
+            TASK_HEADER.pack(rank, 0, FLAG_SEND_RESULT_BACK, 0., 0.),
+        ] + frames[1:])
+    for _ in range(args.tasks):
+        producer.recv_multipart()
+    elapsed = time.time() - begin_time
+
+    producer.send_multipart([SHUTDOWN])
+    cpu_time = port_queue.get()
+    broker.join()
+    for worker in workers:
+        worker.terminate()
+    # TASK, REQUEST, REPLY and STATUS_READY received, TASK and REPLY sent
+    messages = 6 * args.tasks
+    return messages / elapsed, messages / cpu_time
+
+
+if __name__ == "__main__":
+    args = make_parser().parse_args()
+    print("CPUs: {0}".format(multiprocessing.cpu_count()))
+    for name, broker_options in (("single thread", {}),
+                                 ("I/O thread", {'ioThread': True})):
+        rate, cpu_rate = max(measure(args, broker_options)
+                             for _ in range(args.repeat))
+        print("{0}: {1:.0f} messages per second, {2:.0f} messages per "
+              "second of broker CPU time".format(name, rate, cpu_rate))
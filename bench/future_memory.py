@@ -0,0 +1,53 @@
+"""Measures the memory used by every pending Future on the origin, such as the
+Futures spawned by a large map. Runs without launching SCOOP:
+
+    python bench/future_memory.py -n 1000000
+"""
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+
+import scoop
+scoop.worker = b"127.0.0.1:5555"
+from scoop import _control
+from scoop._types import Future
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description=('Measure the memory used by pending Futures.')
+    )
+    parser.add_argument('-n', type = int, default = 100000,
+                        help = "The number of pending Futures to create")
+    return parser
+
+
+def pending_task(value):
+    return value
+
+
+def measure(number_of_futures):
+    """Returns the memory in bytes used per pending Future, including its
+    arguments and its entries in the futureDict and its parent children."""
+    parent = Future((-1, 0), pending_task, 0)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(number_of_futures):
+        child = Future(parent.id, pending_task, i)
+        parent.children[child] = None
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return float(after - before) / number_of_futures
+
+
+if __name__ == "__main__":
+    args = make_parser().parse_args()
+    begin_time = time.time()
+    per_future = measure(args.n)
+    print("Python version {0}".format(sys.version.split()[0]))
+    print("Pending futures: {0}".format(len(_control.futureDict) - 1))
+    print("Memory per pending future: {0:.0f} bytes".format(per_future))
+    print("Total time: {0:.2f} s".format(time.time() - begin_time))
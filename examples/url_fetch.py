@@ -55,14 +55,15 @@ if __name__ == "__main__":
 
     # This will apply the getSize function on every item of the pages list
     # in parallel. The results will be treated in the same order as the
-    # pages.
-    for res in futures.map(getSize, pages):
+    # pages. As getSize mostly waits for the network, the threads of the
+    # workers can execute it when started with --threads-per-worker.
+    for res in futures.map(getSize, pages, threaded=True):
         time.sleep(0.1) # Work on the data ...
         print(res)
 
     # This will apply the getSize function on every item of the pages list
     # in parallel. The results will be treated as they are produced.
-    fut = [futures.submit(getSize, page) for page in pages]
+    fut = [futures.submit(getSize, page, threaded=True) for page in pages]
     for f in futures.as_completed(fut):
         time.sleep(0.1) # Work on the data
         print(f.result())
@@ -32,5 +32,18 @@ SHUTDOWN_REQUESTED = False
 
 TIME_BETWEEN_PARTIALDEBUG = 30
 TIME_BETWEEN_HEARTBEATS = 25
+TIME_BETWEEN_BROKER_LOADS = 0.01
+TIME_BETWEEN_PINGS = 1
 TASK_CHECK_INTERVAL = 15
 TIME_BEFORE_LOSING_WORKER = 60
+TIME_BEFORE_RESENDING_VARIABLE = 1
+CHUNK_TARGET_TIME = 0.1
+MESSAGING_OVERHEAD = 0.001
+GRANULARITY_FACTOR = 10
+ZERO_COPY_THRESHOLD = 65536
+BROKER_BATCH_SIZE = 256
+SHARED_MEMORY_THRESHOLD = 1048576
+TIME_BEFORE_FETCHING_SEGMENT = 10
+CALLABLE_SHARING_THRESHOLD = 4096
+CALLABLE_CACHE_SIZE = 128
+LAUNCH_TREE_FANOUT = 16
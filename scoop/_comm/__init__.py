@@ -18,7 +18,16 @@ from .scoopexceptions import Shutdown
 import scoop
 
 
-if scoop.CONFIGURATION.get('backend', 'ZMQ') == 'ZMQ':
-    from .scoopzmq import ZMQCommunicator as Communicator
-else:
-    from .scooptcp import TCPCommunicator as Communicator
\ No newline at end of file
+def Communicator():
+    """Create the communicator of the configured backend. It is chosen when
+    the worker starts rather than at import, the local backend workers being
+    forked from the launcher."""
+    backend = scoop.CONFIGURATION.get('backend', 'ZMQ')
+    if backend == 'local':
+        from .scooplocal import LocalCommunicator
+        return LocalCommunicator()
+    elif backend == 'TCP':
+        from .scooptcp import TCPCommunicator
+        return TCPCommunicator()
+    from .scoopzmq import ZMQCommunicator
+    return ZMQCommunicator()
@@ -0,0 +1,273 @@
+#
+#    This file is part of Scalable COncurrent Operations in Python (SCOOP).
+#
+#    SCOOP is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    SCOOP is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with SCOOP. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Communication between workers forked on a single host, without broker.
+
+The queues are created by the launcher before forking the workers. The Futures
+are sent to a queue shared by every worker, from which idle workers take them
+in order of arrival. Every worker has its own queue receiving the results of
+its Futures, and another receiving the shared variables and the shutdown
+signal. The messages are made of the same frames than the ZMQ backend."""
+import time
+import logging
+import multiprocessing
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import zmq
+
+import scoop
+from .. import shared
+from .scoopexceptions import Shutdown
+from .scoopmessages import *
+from . import serializers
+from .scoopzmq import encodeFuture, encodeResult, ZMQCommunicator
+
+# Queues of the pool and rank of this worker, set in the forked workers
+_channels = None
+_rank = None
+
+
+class LocalChannels(object):
+    """The queues shared by the workers of a local pool."""
+    def __init__(self, size):
+        self.tasks = multiprocessing.Queue()
+        self.inboxes = [multiprocessing.Queue() for _ in range(size)]
+        self.infos = [multiprocessing.Queue() for _ in range(size)]
+
+    def shutdown(self, exclude=None):
+        """Send the shutdown signal to every worker but exclude."""
+        for rank, info in enumerate(self.infos):
+            if rank != exclude:
+                info.put([SHUTDOWN])
+
+
+def workerName(rank):
+    return "local:{0}".format(rank).encode()
+
+
+def workerRank(name):
+    return int(name.split(b":")[1])
+
+
+def runWorker(channels, rank, argv):
+    """Entry point of a forked worker: bootstrap it with the given command-line
+    arguments, communicating through the channels."""
+    global _channels, _rank
+    _channels = channels
+    _rank = rank
+    from ..bootstrap.__main__ import runForked
+    runForked(argv)
+
+
+class LocalCommunicator(object):
+    """This class encapsulates the communication features toward the other
+    workers of a local pool."""
+
+    def __init__(self):
+        serializers.setSerializer(scoop.CONFIGURATION.get('serializer', 'pickle'))
+        if _channels is None:
+            raise Exception("The local backend workers must be started by the "
+                            "SCOOP launcher.")
+        self.channels = _channels
+        self.rank = _rank
+        self.inbox = self.channels.inboxes[self.rank]
+        self.info = self.channels.infos[self.rank]
+        scoop.worker = workerName(self.rank)
+        # No broker, the requests are served from the shared queue
+        self.broker_set = set([None])
+        # Number of futures requested but not yet taken from the shared queue
+        self.wanted = 0
+        # Names of the shared variables published to the other workers
+        self.sentVariables = set()
+        # Memory-mapped constants are never fetched, see sendSegment
+        self.segments = {}
+        self.closed = False
+        # The variables are published to every worker of the pool since its
+        # launch
+        shared._setElements({})
+
+        # Update the logger to display our name
+        try:
+            scoop.logger.handlers[0].setFormatter(
+                logging.Formatter(
+                    "[%(asctime)-15s] %(module)-9s ({0}) %(levelname)-7s "
+                    "%(message)s".format(scoop.worker)
+                )
+            )
+        except IndexError:
+            pass
+
+        # Set poller. The shared queue is only polled while futures are wanted
+        self.poller = zmq.Poller()
+        self.poller.register(self.inbox._reader.fileno(), zmq.POLLIN)
+        self.poller.register(self.info._reader.fileno(), zmq.POLLIN)
+
+    def _poll(self, timeout):
+        self.pumpInfoSocket()
+        return self.poller.poll(timeout)
+
+    def _messageReady(self):
+        """Tells if a message can be received without blocking."""
+        return (self.inbox._reader.poll(0)
+                or (self.wanted > 0 and self.channels.tasks._reader.poll(0)))
+
+    def watch(self, fd):
+        """Also end the polling when the file descriptor fd is readable."""
+        self.poller.register(fd, zmq.POLLIN)
+
+    def _want(self, count):
+        if count > 0 and self.wanted == 0:
+            self.poller.register(self.channels.tasks._reader.fileno(),
+                                 zmq.POLLIN)
+        elif count < 0 and self.wanted + count == 0:
+            self.poller.unregister(self.channels.tasks._reader.fileno())
+        self.wanted += count
+
+    def pumpInfoSocket(self):
+        while True:
+            try:
+                msg = self.info.get_nowait()
+            except queue.Empty:
+                return
+            if msg[0] == SHUTDOWN:
+                if scoop.IS_ORIGIN is False:
+                    raise Shutdown("Shutdown received")
+                if not scoop.SHUTDOWN_REQUESTED:
+                    scoop.logger.error(
+                        "A worker exited unexpectedly. Read the worker logs "
+                        "for more information. SCOOP pool will now shutdown."
+                    )
+                    raise Shutdown("Unexpected shutdown received")
+            elif msg[0] == VARIABLE:
+                key = serializers.loads(msg[3])
+                varValue = serializers.loads(msg[2])
+                varName = serializers.loads(msg[1])
+                shared._updateElement(key, varName, varValue)
+                self.convertVariable(key, varName, varValue)
+
+    def waitInfoSocket(self, timeout):
+        """Block until a message is published or timeout seconds elapsed, then
+        process the published messages."""
+        if timeout == float("inf"):
+            self.info._reader.poll(None)
+        else:
+            self.info._reader.poll(max(0, timeout))
+        self.pumpInfoSocket()
+
+    def convertVariable(self, key, varName, varValue):
+        """Puts the function in the globals() of the main module."""
+        ZMQCommunicator.convertVariable(self, key, varName, varValue)
+
+    def _decodeFuture(self, msg_type, frames):
+        """Rebuild a Future from the frames of a TASK or REPLY message."""
+        return ZMQCommunicator._decodeFuture(self, msg_type, frames)
+
+    def addPeer(self, peer):
+        """Every worker of the pool is reachable."""
+        pass
+
+    def recvIncoming(self):
+        """Yield the received replies, then the requested futures available in
+        the shared queue."""
+        while True:
+            try:
+                frames = self.inbox.get_nowait()
+            except queue.Empty:
+                break
+            if frames[0] == PING:
+                yield (PING, time.time() - frames[1])
+                continue
+            yield (REPLY, self._decodeFuture(REPLY, frames))
+        while self.wanted > 0:
+            try:
+                frames = self.channels.tasks.get_nowait()
+            except queue.Empty:
+                break
+            self._want(-1)
+            yield (TASK, self._decodeFuture(TASK, frames))
+
+    def sendFuture(self, future):
+        """Send a Future to be executed by the first idle worker."""
+        self.channels.tasks.put(encodeFuture(future))
+
+    def sendStolenFutures(self, destination, futures):
+        for future in futures:
+            self.sendFuture(future)
+
+    def sendStealEmpty(self, destination):
+        pass
+
+    def sendLoad(self, load):
+        pass
+
+    def sendResult(self, future):
+        """Send a terminated future back to its parent."""
+        self.channels.inboxes[workerRank(future.id[0])].put(
+            encodeResult(future)
+        )
+
+    def sendReadyStatus(self, future):
+        pass
+
+    def sendVariable(self, key, value):
+        """Publish a shared variable to the other workers."""
+        msg = [
+            VARIABLE,
+            serializers.dumps(key),
+            serializers.dumps(value),
+            serializers.dumps(scoop.worker),
+        ]
+        for rank, info in enumerate(self.channels.infos):
+            if rank != self.rank:
+                info.put(msg)
+        self.sentVariables.add(key)
+
+    def isVariableAcknowledged(self, key):
+        """True once the shared variable key was published."""
+        return key in self.sentVariables
+
+    def sendSegment(self, digest, segment):
+        """The workers share the segment directory of the launcher."""
+        pass
+
+    def sendFetch(self, digest):
+        pass
+
+    def sendPing(self):
+        """Measure the messaging overhead by a round trip through the inbox
+        queue of this worker."""
+        self.inbox.put([PING, time.time()])
+
+    def sendRequest(self, count=1):
+        """Request `count` futures from the shared queue."""
+        self._want(count)
+
+    def workerDown(self):
+        pass
+
+    def shutdown(self):
+        """Sends a shutdown message to other workers."""
+        if not self.closed:
+            self.closed = True
+            scoop.SHUTDOWN_REQUESTED = True
+            self.channels.shutdown(exclude=self.rank)
+            # Don't wait at exit for the futures that no worker will take
+            self.channels.tasks.cancel_join_thread()
+            for inbox in self.channels.inboxes:
+                inbox.cancel_join_thread()
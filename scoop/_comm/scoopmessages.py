@@ -1,3 +1,5 @@
+import struct
+
 # Worker requests
 INIT = b"I"
 REQUEST = b"RQ"
@@ -5,10 +7,18 @@ TASK = b"T"
 REPLY = b"RP"
 SHUTDOWN = b"S"
 VARIABLE = b"V"
+VARIABLE_ACK = b"VA"
+SUBSCRIBED = b"SB"
+# Content of a memory-mapped constant, kept by the brokers, and its request by
+# a worker of a host lacking it
+SEGMENT = b"SG"
+FETCH = b"FT"
 BROKER_INFO = b"B"
 STATUS_READY = b"SD"
 RESEND_FUTURE = b"RF"
 HEARTBEAT = b"HB"
+# Round trip to the broker measuring the messaging overhead
+PING = b"PG"
 REQUEST_STATUS_REQUEST = b"RSR"
 REQUEST_STATUS_ANS = b"RSA"
 REQUEST_INPROCESS = b"RI"
@@ -20,4 +30,43 @@ STATUS_GIVEN = b"G"
 STATUS_NONE = b"N"
 
 # Broker interconnection
-CONNECT = b"C"
\ No newline at end of file
+CONNECT = b"C"
+# Number of tasks a broker can send to its idle workers, advertised to its
+# fellow brokers
+BROKER_LOAD = b"BL"
+# Tasks forwarded to a fellow broker. The frame following the message type
+# holds the number of frames of every Future (see FRAME_COUNT), each Future
+# being preceded by its id.
+BROKER_TASKS = b"BT"
+# Addresses of the workers served by a broker, to route their replies
+BROKER_WORKERS = b"BW"
+
+# Work stealing
+LOAD = b"L"
+STEAL = b"ST"
+STOLEN = b"SN"
+STEAL_EMPTY = b"SE"
+
+# Internal to the broker: a message its I/O thread could not deliver
+UNDELIVERED = b"UD"
+
+# Batch of Futures sent at once to a worker. The frame following the message
+# type holds the number of frames of every Future (see FRAME_COUNT).
+TASKS = b"TS"
+
+# Fixed header of the Futures sent for execution: rank, parent rank, flags,
+# priority and deadline. Frames holding the worker addresses of the Future id
+# and parent id, the callable and the arguments follow.
+TASK_HEADER = struct.Struct("!qqBdd")
+# Fixed header of the executed Futures sent back: rank and flags. Frames
+# holding the worker address of the Future id and the result follow.
+RESULT_HEADER = struct.Struct("!qB")
+# Number of frames of a Future in a TASKS message.
+FRAME_COUNT = struct.Struct("!I")
+
+# Header flags
+FLAG_SEND_RESULT_BACK = 1
+FLAG_DEADLINE = 2
+FLAG_ROOT_PARENT = 4
+FLAG_DONE = 8
+FLAG_THREADED = 16
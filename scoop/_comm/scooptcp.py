@@ -138,14 +138,14 @@ class TCPCommunicator(object):
         ))
         scoop.CONFIGURATION.update(pickle.loads(self.socket.recv()))
         inboundVariables = pickle.loads(self.socket.recv())
-        shared.elements = dict([
+        shared._setElements(dict([
             (pickle.loads(key),
                 dict([(pickle.loads(varName),
                        pickle.loads(varValue))
                     for varName, varValue in value.items()
                 ]))
                 for key, value in inboundVariables.items()
-        ])
+        ]))
         for broker in pickle.loads(self.socket.recv()):
             # Skip already connected brokers
             if broker in self.broker_set:
@@ -246,7 +246,7 @@ class TCPCommunicator(object):
                 key = pickle.loads(msg[3])
                 varValue = pickle.loads(msg[2])
                 varName = pickle.loads(msg[1])
-                shared.elements.setdefault(key, {}).update({varName: varValue})
+                shared._updateElement(key, varName, varValue)
                 self.convertVariable(key, varName, varValue)
             elif msg[0] == b"BROKER_INFO":
                 # TODO: find out what to do here ...
@@ -271,6 +271,15 @@ class TCPCommunicator(object):
                         self._addBroker(broker_address, meta_address)
                     self.broker_set.update(new_brokers)
 
+    def waitInfoSocket(self, timeout):
+        """Block until a message is published or timeout seconds elapsed, then
+        process the published messages."""
+        if timeout == float("inf"):
+            self.infoSocket.poll()
+        else:
+            self.infoSocket.poll(max(0, int(timeout * 1000)))
+        self.pumpInfoSocket()
+
     def convertVariable(self, key, varName, varValue):
         """Puts the function in the globals() of the main module."""
         if isinstance(varValue, encapsulation.FunctionEncapsulation):
@@ -281,9 +290,7 @@ class TCPCommunicator(object):
             result.__name__ = varName
             result.__globals__.update(mainModule.__dict__)
             setattr(mainModule, varName, result)
-            shared.elements[key].update({
-                varName: result,
-            })
+            shared._updateElement(key, varName, result)
 
     def recvFuture(self):
         while self._poll(0):
@@ -363,6 +370,12 @@ class TCPCommunicator(object):
                                     pickle.dumps(scoop.worker,
                                                  pickle.HIGHEST_PROTOCOL)])
 
+    def isVariableAcknowledged(self, key):
+        """True once the shared variable key was published back by the
+        broker."""
+        self.pumpInfoSocket()
+        return key in shared.elements.get(scoop.worker, {})
+
     def taskEnd(self, groupID, askResults=False):
         self.socket.send_multipart([
             b"TASKEND",
@@ -376,8 +389,8 @@ class TCPCommunicator(object):
             ),
         ])
 
-    def sendRequest(self):
-        for _ in range(len(self.broker_set)):
+    def sendRequest(self, count=1):
+        for _ in range(len(self.broker_set) * count):
             self.socket.send(b"REQUEST")
 
     def workerDown(self):
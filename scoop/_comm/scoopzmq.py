@@ -18,7 +18,6 @@ import time
 import sys
 import random
 import socket
-import copy
 import logging
 from multiprocessing import Process
 try:
@@ -33,19 +32,114 @@ from .. import shared, encapsulation, utils
 from ..shared import SharedElementEncapsulation
 from .scoopexceptions import Shutdown, ReferenceBroken
 from .scoopmessages import *
+from . import serializers
+from .serializers import dumpsFrames, loadsFrames, framesToBytes
 
 LINGER_TIME = 1000
-
+# Milliseconds between the checks of the info socket subscription
+TIME_BETWEEN_SUBSCRIPTION_CHECKS = 100
+
+
+def encodeCallable(callable_):
+    """Serialize the callable of a Future, by reference if it was shared.
+    Large callables are shared once by their content digest and sent by
+    reference."""
+    try:
+        if shared.getConst(hash(callable_), timeout=0):
+            # Enforce name reference passing if already shared
+            callable_ = SharedElementEncapsulation(hash(callable_))
+        data = serializers.dumps(callable_)
+        if len(data) >= scoop.CALLABLE_SHARING_THRESHOLD:
+            data = serializers.dumps(shared._shareSerializedCallable(data))
+        return data
+    except (pickle.PicklingError, TypeError) as e:
+        # If element not picklable, pickle its name
+        # TODO: use its fully qualified name
+        scoop.logger.warn("Pickling Error: {0}".format(e))
+        return serializers.dumps(hash(callable_))
+
+
+def encodeFuture(future):
+    """Serialize a Future to be executed remotely into a list of frames: its
+    fixed header (see TASK_HEADER), the worker addresses of its id and parent
+    id, its callable and its arguments. The state local to the worker
+    (greenlet, children, stopwatch, ...) is not sent."""
+    flags = 0
+    if future.sendResultBack:
+        flags |= FLAG_SEND_RESULT_BACK
+    if future.deadline is not None:
+        flags |= FLAG_DEADLINE
+    if future.threaded:
+        flags |= FLAG_THREADED
+    parentWorker, parentRank = future.parentId
+    if not isinstance(parentWorker, bytes):
+        # Parent of the root Future
+        flags |= FLAG_ROOT_PARENT
+        parentWorker = b""
+    header = TASK_HEADER.pack(future.id[1], parentRank, flags,
+                              future.priority, future.deadline or 0.)
+    return [
+        header,
+        future.id[0],
+        parentWorker,
+        encodeCallable(future.callable),
+    ] + dumpsFrames((future.args, future.kargs, future._callback))
+
+
+def decodeFuture(frames):
+    """Rebuild a Future from the frames given by encodeFuture."""
+    from .._types import Future
+    rank, parentRank, flags, priority, deadline = TASK_HEADER.unpack(frames[0])
+    if flags & FLAG_ROOT_PARENT:
+        parentId = (-1, parentRank)
+    else:
+        parentId = (frames[2], parentRank)
+    args, kargs, callback = loadsFrames(frames[4:])
+    future = Future._rebuild((frames[1], rank), parentId,
+                             serializers.loads(frames[3]), args, kargs)
+    future.sendResultBack = bool(flags & FLAG_SEND_RESULT_BACK)
+    future.priority = int(priority) if priority.is_integer() else priority
+    if flags & FLAG_DEADLINE:
+        future.deadline = deadline
+    future.threaded = bool(flags & FLAG_THREADED)
+    future._callback = callback
+    return future
+
+
+def encodeResult(future):
+    """Serialize an executed Future to send it back to its parent into a list
+    of frames: its fixed header (see RESULT_HEADER), the worker address of its
+    id and its result."""
+    header = RESULT_HEADER.pack(future.id[1], FLAG_DONE if future.isDone else 0)
+    # Don't reply back the result if it isn't asked
+    result = future.resultValue if future.sendResultBack else None
+    return [header, future.id[0]] + dumpsFrames(
+        (result, future.exceptionValue, future.executor)
+    )
+
+
+def decodeResult(frames):
+    """Rebuild an executed Future from the frames given by encodeResult."""
+    from .._types import Future
+    rank, flags = RESULT_HEADER.unpack(frames[0])
+    future = Future._rebuild((frames[1], rank), None, None, (), {})
+    future.resultValue, future.exceptionValue, future.executor = \
+        loadsFrames(frames[2:])
+    future.isDone = bool(flags & FLAG_DONE)
+    return future
 
 class ZMQCommunicator(object):
     """This class encapsulates the communication features toward the broker."""
 
     def __init__(self):
+        serializers.setSerializer(scoop.CONFIGURATION.get('serializer', 'pickle'))
         self.ZMQcontext = zmq.Context()
 
-        # TODO number of broker
-        self.number_of_broker = float('inf')
         self.broker_set = set()
+        # Names of the shared variables stored by the broker
+        self.acknowledgedVariables = set()
+        # Contents of the memory-mapped constants fetched from the broker
+        self.segments = {}
 
 
         # Get the current address of the interface facing the broker
@@ -57,6 +151,7 @@ class ZMQCommunicator(object):
 
         if external_addr in utils.loopbackReferences or info[0] == socket.AF_INET6:
             external_addr = scoop.BROKER.externalHostname
+        self.external_addr = external_addr
 
         # Create an inter-worker socket
         self.direct_socket_peers = []
@@ -85,6 +180,9 @@ class ZMQCommunicator(object):
                 break
         else:
             raise Exception("Could not create direct connection socket")
+        # The workers of this host connect through IPC
+        self.ipc_path = utils.bindIPC(self.direct_socket,
+                                      self.direct_socket_port)
 
         # Update the logger to display our name
         try:
@@ -115,28 +213,27 @@ class ZMQCommunicator(object):
         self.poller.register(self.infoSocket, zmq.POLLIN)
 
         self._addBroker(scoop.BROKER)
+        self._waitSubscription()
 
         # Send an INIT to get all previously set variables and share
         # current configuration to broker
         self.socket.send_multipart([
             INIT,
-            pickle.dumps(scoop.CONFIGURATION)
+            serializers.dumps(scoop.CONFIGURATION)
         ])
-        scoop.CONFIGURATION.update(pickle.loads(self.socket.recv()))
-        inboundVariables = pickle.loads(self.socket.recv())
-        shared.elements = dict([
-            (pickle.loads(key),
-                dict([(pickle.loads(varName),
-                       pickle.loads(varValue))
+        scoop.CONFIGURATION.update(serializers.loads(self.socket.recv()))
+        inboundVariables = serializers.loads(self.socket.recv())
+        shared._setElements(dict([
+            (serializers.loads(key),
+                dict([(serializers.loads(varName),
+                       serializers.loads(varValue))
                     for varName, varValue in value.items()
                 ]))
                 for key, value in inboundVariables.items()
-        ])
-        for broker in pickle.loads(self.socket.recv()):
-            # Skip already connected brokers
-            if broker in self.broker_set:
-                continue
-            self._addBroker(broker)
+        ]))
+        # Fellow brokers: the tasks, replies and shared variables are routed
+        # through this broker which balances the load with them
+        self.socket.recv()
 
         # Putting futures status reporting in place
         self.heartbeat_thread = Process(target=ZMQCommunicator._sendHeartBeat,
@@ -175,10 +272,9 @@ class ZMQCommunicator(object):
         self.heartbeat_socket.setsockopt(zmq.IDENTITY, hb_socket_name)
 
         for brokerEntry in self.broker_set:
-            broker_address = "tcp://{hostname}:{port}".format(
-                hostname=brokerEntry.hostname,
-                port=brokerEntry.task_port,
-            )
+            broker_address = utils.endpoint(brokerEntry.hostname,
+                                            brokerEntry.task_port,
+                                            brokerEntry.task_ipc)
             # print("WORKER {} CONNECTING TO BROKER: {}".format(hb_socket_name, broker_address))
             self.heartbeat_socket.connect(broker_address)
         try:
@@ -196,7 +292,7 @@ class ZMQCommunicator(object):
                 try:
                     self.heartbeat_socket.send_multipart([
                         HEARTBEAT,
-                        pickle.dumps(time.time(), pickle.HIGHEST_PROTOCOL)
+                        serializers.dumps(time.time())
                     ], zmq.NOBLOCK)
                 except zmq.error.Again as E:
                     scoop.logger.warning("FAILED HEARTBEAT IN worker {} at time {}".format(scoop.worker, time.time()))
@@ -207,19 +303,23 @@ class ZMQCommunicator(object):
     def addPeer(self, peer):
         if peer not in self.direct_socket_peers:
             self.direct_socket_peers.append(peer)
-            new_peer = "tcp://{0}".format(peer.decode("utf-8"))
-            self.direct_socket.connect(new_peer)
+            hostname, port = peer.decode("utf-8").rsplit(":", 1)
+            # Only the workers of this pool and host bind IPC endpoints in
+            # its directory
+            local = hostname == self.external_addr
+            self.direct_socket.connect(utils.endpoint(
+                hostname, port, utils.ipcPath(port) if local else None, local
+            ))
 
     def _addBroker(self, brokerEntry):
-        # Add a broker to the socket and the infosocket.
-        broker_address = "tcp://{hostname}:{port}".format(
-            hostname=brokerEntry.hostname,
-            port=brokerEntry.task_port,
-        )
-        meta_address = "tcp://{hostname}:{port}".format(
-            hostname=brokerEntry.hostname,
-            port=brokerEntry.info_port,
-        )
+        # Add a broker to the socket and the infosocket, through the IPC
+        # endpoints it advertised if the broker is on this host.
+        broker_address = utils.endpoint(brokerEntry.hostname,
+                                        brokerEntry.task_port,
+                                        brokerEntry.task_ipc)
+        meta_address = utils.endpoint(brokerEntry.hostname,
+                                      brokerEntry.info_port,
+                                      brokerEntry.info_ipc)
         self.socket.connect(broker_address)
 
         self.infoSocket.connect(meta_address)
@@ -227,63 +327,124 @@ class ZMQCommunicator(object):
 
         self.broker_set.add(brokerEntry)
 
+    def _waitSubscription(self):
+        """Block until the broker publications reach the info socket. The
+        shared variables published afterwards are received on this socket
+        while the previous ones are given by the INIT answer."""
+        while True:
+            self.socket.send_multipart([SUBSCRIBED])
+            if self.infoSocket.poll(TIME_BETWEEN_SUBSCRIPTION_CHECKS):
+                while self.infoSocket.poll(0):
+                    msg = self.infoSocket.recv_multipart()
+                    if msg == [SUBSCRIBED, scoop.worker]:
+                        return
+
     def _poll(self, timeout):
         self.pumpInfoSocket()
         return self.poller.poll(timeout)
 
+    def _messageReady(self):
+        """Tells if a message can be received without blocking. The watched
+        file descriptors are not considered."""
+        return any(sock in (self.socket, self.direct_socket)
+                   for sock, _ in self._poll(0))
+
+    def watch(self, fd):
+        """Also end the polling when the file descriptor fd is readable."""
+        self.poller.register(fd, zmq.POLLIN)
+
     def _recv(self):
+        """Receive a message. Returns the list of its (type, content) items,
+        several Futures being received at once in a TASKS message."""
         # Prioritize answers over new tasks
         if self.direct_socket.poll(0):
-            router_msg = self.direct_socket.recv_multipart()
+            router_msg = self.direct_socket.recv_multipart(copy=False)
             # Remove the sender address
             msg = router_msg[1:] + [router_msg[0]]
         else:
-            msg = self.socket.recv_multipart()
-        
-        if msg[0] == TASK or msg[0] == REPLY:
-            try:
-                thisFuture = pickle.loads(msg[1])
-            except (AttributeError, ImportError) as e:
-                scoop.logger.error(
-                    "An instance could not find its base reference on a worker. "
-                    "Ensure that your objects have their definition available in "
-                    "the root scope of your program.\n{error}".format(
-                        error=e,
-                    )
-                )
-                raise ReferenceBroken(e)
-
-            if msg[0] == TASK:
-                # Try to connect directly to this worker to send the result
-                # afterwards if Future is from a map.
-                if thisFuture.sendResultBack:
-                    self.addPeer(thisFuture.id[0])
-
-            isCallable = callable(thisFuture.callable)
-            isDone = thisFuture._ended()
-            if not isCallable and not isDone:
-                # TODO: Also check in root module globals for fully qualified name
-                try:
-                    module_found = hasattr(sys.modules["__main__"],
-                                           thisFuture.callable)
-                except TypeError:
-                    module_found = False
-                if module_found:
-                    thisFuture.callable = getattr(sys.modules["__main__"],
-                                                  thisFuture.callable)
-                else:
-                    raise ReferenceBroken("This element could not be pickled: "
-                                          "{0}.".format(thisFuture))
-            return (msg[0], thisFuture)
+            msg = self.socket.recv_multipart(copy=False)
+        msg = framesToBytes(msg)
+
+        if msg[0] in (TASK, REPLY, STOLEN):
+            return [(msg[0], self._decodeFuture(msg[0], msg[1:]))]
+
+        elif msg[0] == TASKS:
+            received = []
+            position = 2
+            for index in range(0, len(msg[1]), FRAME_COUNT.size):
+                count, = FRAME_COUNT.unpack_from(msg[1], index)
+                received.append((TASK, self._decodeFuture(
+                    TASK, msg[position:position + count]
+                )))
+                position += count
+            return received
 
         elif msg[0] == RESEND_FUTURE:
             # TODO: This should not be here but in FuturesQueue.
-            future_id = pickle.loads(msg[1])
-            return (RESEND_FUTURE, future_id)
+            future_id = serializers.loads(msg[1])
+            return [(RESEND_FUTURE, future_id)]
+
+        elif msg[0] == STEAL:
+            # Address of the idle peer trying to steal futures
+            return [(STEAL, msg[1])]
+
+        elif msg[0] == VARIABLE_ACK:
+            self.acknowledgedVariables.add(serializers.loads(msg[1]))
+            return []
+
+        elif msg[0] == SEGMENT:
+            # Written to the segment directory by the fetching worker
+            self.segments[msg[1].decode()] = msg[2]
+            return []
+
+        elif msg[0] == PING:
+            # Round trip time to the broker
+            return [(PING, time.time() - serializers.loads(msg[1]))]
 
         else:
             assert False, "Unrecognized incoming message {}".format(msg[0])
 
+    def _decodeFuture(self, msg_type, frames):
+        """Rebuild a Future from the frames of a TASK, STOLEN or REPLY
+        message."""
+        try:
+            if msg_type == REPLY:
+                thisFuture = decodeResult(frames)
+            else:
+                thisFuture = decodeFuture(frames)
+        except (AttributeError, ImportError) as e:
+            scoop.logger.error(
+                "An instance could not find its base reference on a worker. "
+                "Ensure that your objects have their definition available in "
+                "the root scope of your program.\n{error}".format(
+                    error=e,
+                )
+            )
+            raise ReferenceBroken(e)
+
+        if msg_type in (TASK, STOLEN):
+            # Try to connect directly to this worker to send the result
+            # afterwards if Future is from a map.
+            if thisFuture.sendResultBack:
+                self.addPeer(thisFuture.id[0])
+
+        isCallable = callable(thisFuture.callable)
+        isDone = thisFuture._ended()
+        if not isCallable and not isDone:
+            # TODO: Also check in root module globals for fully qualified name
+            try:
+                module_found = hasattr(sys.modules["__main__"],
+                                       thisFuture.callable)
+            except TypeError:
+                module_found = False
+            if module_found:
+                thisFuture.callable = getattr(sys.modules["__main__"],
+                                              thisFuture.callable)
+            else:
+                raise ReferenceBroken("This element could not be pickled: "
+                                      "{0}.".format(thisFuture))
+        return thisFuture
+
     def pumpInfoSocket(self):
         try:
             while self.infoSocket.poll(0):
@@ -297,37 +458,27 @@ class ZMQCommunicator(object):
                             "for more information. SCOOP pool will now shutdown."
                         )
                         raise Shutdown("Unexpected shutdown received")
+                elif msg[0] == SUBSCRIBED:
+                    # Subscription check of another worker
+                    pass
                 elif msg[0] == VARIABLE:
-                    key = pickle.loads(msg[3])
-                    varValue = pickle.loads(msg[2])
-                    varName = pickle.loads(msg[1])
-                    shared.elements.setdefault(key, {}).update({varName: varValue})
+                    key = serializers.loads(msg[3])
+                    varValue = serializers.loads(msg[2])
+                    varName = serializers.loads(msg[1])
+                    shared._updateElement(key, varName, varValue)
                     self.convertVariable(key, varName, varValue)
-                elif msg[0] == BROKER_INFO:
-                    # TODO: find out what to do here ...
-                    if len(self.broker_set) == 0: # The first update
-                        self.broker_set.add(pickle.loads(msg[1]))
-                    if len(self.broker_set) < self.number_of_broker:
-                        brokers = pickle.loads(msg[2])
-                        needed = self.number_of_broker - len(self.broker_set)
-                        try:
-                            new_brokers = random.sample(brokers, needed)
-                        except ValueError:
-                            new_brokers = brokers
-                            self.number_of_broker = len(self.broker_set) + len(new_brokers)
-                            scoop.logger.warning(("The number of brokers could not be set"
-                                            " on worker {0}. A total of {1} worker(s)"
-                                            " were set.".format(scoop.worker,
-                                                                self.number_of_broker)))
-
-                        for broker in new_brokers:
-                            broker_address = "tcp://" + broker.hostname + broker.task_port
-                            meta_address = "tcp://" + broker.hostname + broker.info_port
-                            self._addBroker(broker_address, meta_address)
-                        self.broker_set.update(new_brokers)
         except zmq.error.ZMQError:
             pass
 
+    def waitInfoSocket(self, timeout):
+        """Block until a message is published or timeout seconds elapsed, then
+        process the published messages."""
+        if timeout == float("inf"):
+            self.infoSocket.poll()
+        else:
+            self.infoSocket.poll(max(0, int(timeout * 1000)))
+        self.pumpInfoSocket()
+
     def convertVariable(self, key, varName, varValue):
         """Puts the function in the globals() of the main module."""
         if isinstance(varValue, encapsulation.FunctionEncapsulation):
@@ -338,61 +489,58 @@ class ZMQCommunicator(object):
             result.__name__ = varName
             result.__globals__.update(mainModule.__dict__)
             setattr(mainModule, varName, result)
-            shared.elements[key].update({
-                varName: result,
-            })
+            shared._updateElement(key, varName, result)
 
     def recvIncoming(self):
         """
         This function continually reads the input from the socket, processes it
         according to _recv and returns the result
         """
-        while self._poll(0):
-            received = self._recv()
-            if received:
+        while self._messageReady():
+            for received in self._recv():
                 yield received
 
     def sendFuture(self, future):
-        """Send a Future to be executed remotely."""
-        future = copy.copy(future)
-        future.greenlet = None
-        future.children = {}
+        """Send a Future to be executed remotely. The broker orders its queue
+        from the priority and deadline of the Future header."""
+        self.socket.send_multipart([
+            TASK,
+            serializers.dumpsId(future.id),
+        ] + encodeFuture(future), copy=False)
 
-        try:
-            if shared.getConst(hash(future.callable), timeout=0):
-                # Enforce name reference passing if already shared
-                future.callable = SharedElementEncapsulation(hash(future.callable))
-            self.socket.send_multipart([
-                TASK,
-                pickle.dumps(future.id, pickle.HIGHEST_PROTOCOL),
-                pickle.dumps(future, pickle.HIGHEST_PROTOCOL),
-            ])
-        except (pickle.PicklingError, TypeError) as e:
-            # If element not picklable, pickle its name
-            # TODO: use its fully qualified name
-            scoop.logger.warn("Pickling Error: {0}".format(e))
-            future.callable = hash(future.callable)
-            self.socket.send_multipart([
-                TASK,
-                pickle.dumps(future.id, pickle.HIGHEST_PROTOCOL),
-                pickle.dumps(future, pickle.HIGHEST_PROTOCOL),
-            ])
+    def sendStolenFutures(self, destination, futures):
+        """Send Futures directly to the peer that stole them. If it doesn't
+        work, route them through the broker."""
+        self.addPeer(destination)
+        for future in futures:
+            frames = encodeFuture(future)
+            try:
+                self.direct_socket.send_multipart([
+                    destination,
+                    STOLEN,
+                ] + frames, flags=zmq.NOBLOCK, copy=False)
+            except zmq.error.ZMQError:
+                self.socket.send_multipart([
+                    STOLEN,
+                    serializers.dumpsId(future.id),
+                ] + frames + [
+                    destination,
+                ], copy=False)
+
+    def sendStealEmpty(self, destination):
+        """Tell the broker that no Future could be stolen by the given peer."""
+        self.socket.send_multipart([STEAL_EMPTY, destination])
+
+    def sendLoad(self, load):
+        """Advertise the number of queued Futures of this worker."""
+        self.socket.send_multipart([
+            LOAD,
+            serializers.dumps(load),
+        ])
 
     def sendResult(self, future):
         """Send a terminated future back to its parent."""
-        future = copy.copy(future)
-
-        # Remove the (now) extraneous elements from future class
-        future.callable = future.args = future.kargs = future.greenlet = None
-
-        if not future.sendResultBack:
-            # Don't reply back the result if it isn't asked
-            future.resultValue = None
-
-        self._sendReply(
-            future.id[0],
-            pickle.dumps(future, pickle.HIGHEST_PROTOCOL),
-        )
+        self._sendReply(future.id[0], *encodeResult(future))
 
     def _sendReply(self, destination, *args):
         """Send a REPLY directly to its destination. If it doesn't work, launch
@@ -405,7 +553,7 @@ class ZMQCommunicator(object):
                 destination,
                 REPLY,
             ] + list(args),
-                flags=zmq.NOBLOCK)
+                flags=zmq.NOBLOCK, copy=False)
         except zmq.error.ZMQError as e:
             # Fallback on Broker routing if no direct connection possible
             scoop.logger.debug(
@@ -416,25 +564,58 @@ class ZMQCommunicator(object):
                 REPLY, 
                 ] + list(args) + [
                 destination,
-            ])
+            ], copy=False)
 
     def sendReadyStatus(self, future):
         self.socket.send_multipart([
             STATUS_READY,
-            pickle.dumps(future.id)
+            serializers.dumpsId(future.id)
         ])
 
     def sendVariable(self, key, value):
         self.socket.send_multipart([
             VARIABLE,
-            pickle.dumps(key, pickle.HIGHEST_PROTOCOL),
-            pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
-            pickle.dumps(scoop.worker, pickle.HIGHEST_PROTOCOL),
+            serializers.dumps(key),
+            serializers.dumps(value),
+            serializers.dumps(scoop.worker),
         ])
 
-    def sendRequest(self):
+    def isVariableAcknowledged(self, key):
+        """True once the broker stored the shared variable key."""
+        return key in self.acknowledgedVariables
+
+    def sendSegment(self, digest, segment):
+        """Send the content of a memory-mapped constant to the broker, which
+        serves it to the workers of the other hosts."""
+        self.socket.send_multipart([
+            SEGMENT,
+            digest.encode(),
+            segment,
+        ])
+
+    def sendFetch(self, digest):
+        """Request the content of a memory-mapped constant from the broker."""
+        self.socket.send_multipart([
+            FETCH,
+            digest.encode(),
+        ])
+
+    def sendPing(self):
+        """Send a message the broker answers immediately, measuring the
+        messaging overhead without the time tasks wait in the broker queue."""
+        self.socket.send_multipart([
+            PING,
+            serializers.dumps(time.time()),
+        ])
+
+    def sendRequest(self, count=1):
+        """Request `count` futures from every broker. The count is granted as
+        credits to the broker, which sends up to that many tasks."""
         for _ in range(len(self.broker_set)):
-            self.socket.send(REQUEST)
+            self.socket.send_multipart([
+                REQUEST,
+                serializers.dumps(count),
+            ])
 
     def workerDown(self):
         self.socket.send(WORKERDOWN)
@@ -456,3 +637,4 @@ class ZMQCommunicator(object):
                 pass
 
             self.ZMQcontext.destroy()
+            utils.unlinkIPC(self.ipc_path)
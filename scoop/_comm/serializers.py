@@ -0,0 +1,226 @@
+#
+#    This file is part of Scalable COncurrent Operations in Python (SCOOP).
+#
+#    SCOOP is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    SCOOP is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with SCOOP. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Serialization of the messages exchanged between workers and brokers.
+
+The data produced by every serializer is self-describing: pickles are
+recognized by their protocol opcode and the other codecs prefix their data
+with a tag byte. Any message can thus be read by :func:`loads` whatever the
+serializer selected with ``--serializer``."""
+import marshal
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import scoop
+
+
+# Pickle protocol 5 (Python 3.8+) serializes large buffers out-of-band
+PICKLE_BUFFERS = pickle.HIGHEST_PROTOCOL >= 5
+
+# Pickles of protocol 2 and higher begin with the PROTO opcode
+PICKLE_TAG = b"\x80"
+MARSHAL_TAG = b"M"
+MSGPACK_TAG = b"K"
+# Version 2 of the marshal format doesn't use references, so equal values
+# always give the same bytes (future ids are compared in their serialized form)
+MARSHAL_VERSION = 2
+
+# Types serialized by the marshal and msgpack fast paths
+PRIMITIVE_TYPES = (type(None), bool, int, float, str, bytes, tuple)
+
+
+def isPrimitive(obj):
+    """True if obj only holds None, booleans, numbers, strings, tuples and
+    dictionaries keyed by strings, such as the arguments of most tasks."""
+    if type(obj) is tuple:
+        return all(isPrimitive(item) for item in obj)
+    if type(obj) is dict:
+        return all(type(key) in (str, bytes) and isPrimitive(value)
+                   for key, value in obj.items())
+    return type(obj) in PRIMITIVE_TYPES
+
+
+class PickleSerializer(object):
+    """Serializes every object with pickle."""
+    name = 'pickle'
+    module = pickle
+
+    def dumps(self, obj):
+        """Serialize an object into bytes."""
+        return self.module.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+    def dumpsFrames(self, obj):
+        """Serialize an object into a list of frames. Large contiguous buffers
+        supporting pickle protocol 5 (NumPy arrays, pickle.PickleBuffer, ...)
+        are appended as separate frames instead of being copied in the
+        pickle."""
+        if not PICKLE_BUFFERS:
+            return [self.dumps(obj)]
+        buffers = []
+
+        def bufferCallback(picklebuffer):
+            # Returning True serializes the buffer in-band
+            try:
+                raw = picklebuffer.raw()
+            except BufferError:
+                return True
+            if raw.nbytes < scoop.ZERO_COPY_THRESHOLD:
+                return True
+            buffers.append(raw)
+
+        data = self.module.dumps(obj, pickle.HIGHEST_PROTOCOL,
+                                 buffer_callback=bufferCallback)
+        return [data] + buffers
+
+
+class CloudpickleSerializer(PickleSerializer):
+    """Serializes with cloudpickle, which also handles lambdas, closures and
+    interactively defined functions. Its output is read by pickle."""
+    name = 'cloudpickle'
+
+    def __init__(self):
+        import cloudpickle
+        self.module = cloudpickle
+
+
+class MarshalSerializer(PickleSerializer):
+    """Serializes builtin types with marshal and falls back on pickle for
+    other objects."""
+    name = 'marshal'
+
+    def dumps(self, obj):
+        if type(obj) in PRIMITIVE_TYPES:
+            try:
+                return MARSHAL_TAG + marshal.dumps(obj, MARSHAL_VERSION)
+            except ValueError:
+                # Contains an object marshal doesn't support
+                pass
+        return PickleSerializer.dumps(self, obj)
+
+    def dumpsFrames(self, obj):
+        if type(obj) in PRIMITIVE_TYPES:
+            return [self.dumps(obj)]
+        return PickleSerializer.dumpsFrames(self, obj)
+
+
+class MsgpackSerializer(PickleSerializer):
+    """Serializes None, booleans, numbers, strings, and tuples and dictionaries
+    of those with msgpack and falls back on pickle for other objects."""
+    name = 'msgpack'
+
+    def __init__(self):
+        import msgpack
+        self.msgpack = msgpack
+
+    def dumps(self, obj):
+        if isPrimitive(obj):
+            try:
+                return MSGPACK_TAG + self.msgpack.packb(obj, use_bin_type=True)
+            except OverflowError:
+                # Integer out of the 64 bits range of msgpack
+                pass
+        return PickleSerializer.dumps(self, obj)
+
+    def dumpsFrames(self, obj):
+        if isPrimitive(obj):
+            return [self.dumps(obj)]
+        return PickleSerializer.dumpsFrames(self, obj)
+
+
+SERIALIZERS = {
+    PickleSerializer.name: PickleSerializer,
+    CloudpickleSerializer.name: CloudpickleSerializer,
+    MarshalSerializer.name: MarshalSerializer,
+    MsgpackSerializer.name: MsgpackSerializer,
+}
+
+_serializer = PickleSerializer()
+
+
+def register(serializerClass):
+    """Make a serializer class available under its name. Its data must either
+    be a pickle or begin with a tag byte handled by :func:`loads`."""
+    SERIALIZERS[serializerClass.name] = serializerClass
+
+
+def setSerializer(name):
+    """Select the serializer used to send the messages of this process."""
+    global _serializer
+    try:
+        serializerClass = SERIALIZERS[name]
+    except KeyError:
+        raise ValueError("Unknown serializer {0}, available serializers are: "
+                         "{1}".format(name, ", ".join(sorted(SERIALIZERS))))
+    _serializer = serializerClass()
+
+
+def dumps(obj):
+    """Serialize an object into bytes with the selected serializer."""
+    return _serializer.dumps(obj)
+
+
+def dumpsId(futureId):
+    """Serialize a Future id. The brokers compare the ids in their serialized
+    form, so they are serialized with marshal whatever the selected
+    serializer."""
+    return MARSHAL_TAG + marshal.dumps(futureId, MARSHAL_VERSION)
+
+
+def dumpsFrames(obj):
+    """Serialize an object into a list of frames with the selected
+    serializer."""
+    return _serializer.dumpsFrames(obj)
+
+
+def loads(data):
+    """Deserialize the data produced by any serializer."""
+    tag = data[:1]
+    if tag == MARSHAL_TAG:
+        return marshal.loads(data[1:])
+    elif tag == MSGPACK_TAG:
+        import msgpack
+        return msgpack.unpackb(data[1:], raw=False, use_list=False)
+    return pickle.loads(data)
+
+
+def loadsFrames(frames, copy=True):
+    """Deserialize an object from the frames given by dumpsFrames. The
+    out-of-band buffers are wrapped in PickleBuffers to remain serializable.
+    The read-only frames, such as the received messages, are copied so the
+    objects are rebuilt as writable as they were sent, unless copy is False.
+    Trailing frames not used by the pickle are ignored."""
+    if not PICKLE_BUFFERS or frames[0][:1] != PICKLE_TAG:
+        return loads(frames[0])
+    return pickle.loads(frames[0], buffers=(pickle.PickleBuffer(
+        _writable(frame) if copy else frame
+    ) for frame in frames[1:]))
+
+
+def _writable(frame):
+    """Returns frame, or a writable copy of it if it is read-only."""
+    view = memoryview(frame)
+    if view.readonly:
+        return bytearray(view)
+    return view
+
+
+def framesToBytes(frames):
+    """Convert the frames received with copy=False to bytes, except the large
+    ones which are kept as memoryviews over the received frames."""
+    return [frame.bytes if len(frame) < scoop.ZERO_COPY_THRESHOLD
+            else frame.buffer for frame in frames]
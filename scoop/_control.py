@@ -25,7 +25,8 @@ import traceback
 
 import greenlet
 
-from ._types import Future, FutureQueue, CallbackType, UnrecognizedFuture
+from ._types import (Future, FutureQueue, CallbackType, UnrecognizedFuture,
+                     StopWatch)
 import scoop
 
 # Backporting collection features
@@ -138,21 +139,23 @@ def delFuture(afuture):
                 .format(afuture.id, scoop.worker))
 
 
-def runFuture(future):
-    """Callable greenlet in charge of running tasks."""
-    global debug_stats
-    global QueueLength
+def startFuture(future):
+    """Prepare the execution of a future."""
     if scoop.DEBUG:
         init_debug()  # in case _control is imported before scoop.DEBUG was set
         debug_stats[future.id]['start_time'].append(time.time())
-    future.waitTime = future.stopWatch.get()
-    future.stopWatch.reset()
+    future.waitTime = time.time() - future.creationTime
+    future.stopWatch = StopWatch()
     # Get callback Group ID and assign the broker-wide unique executor ID
     try:
-        uniqueReference = [cb.groupID for cb in future.callback][0]
-    except IndexError:
+        uniqueReference = [cb.groupID for cb in future._callback][0]
+    except (IndexError, TypeError):
         uniqueReference = None
     future.executor = (scoop.worker, uniqueReference)
+
+
+def callFuture(future):
+    """Call the callable of a future, storing its result or exception."""
     try:
         future.resultValue = future.callable(*future.args, **future.kargs)
     except BaseException as err:
@@ -163,6 +166,11 @@ def runFuture(future):
             err,
             traceback.format_exc(),
         )
+
+
+def endFuture(future):
+    """Terminate the execution of a future: update the statistics and run its
+    universal callbacks."""
     future.executionTime = future.stopWatch.get()
     future.isDone = True
 
@@ -191,6 +199,13 @@ def runFuture(future):
     return future
 
 
+def runFuture(future):
+    """Callable greenlet in charge of running tasks."""
+    startFuture(future)
+    callFuture(future)
+    return endFuture(future)
+
+
 def runController(callable_, *args, **kargs):
     """Callable greenlet implementing controller logic."""
     global execQueue
@@ -296,8 +311,14 @@ def runController(callable_, *args, **kargs):
             # This checks for the case of a not-yet-started-execution future that is
             # returned from the queue, (This can only happen if execQueue.pop is called)
             # and starts the execution
-            future.greenlet = greenlet.greenlet(runFuture)
-            future = future._switch(future)
+            if future.threaded and execQueue.threadPool is not None:
+                # The thread pool executes it while the next future is popped,
+                # execQueue.pop returns it once it has ended
+                startFuture(future)
+                execQueue.runThreaded(future)
+            else:
+                future.greenlet = greenlet.greenlet(runFuture)
+                future = future._switch(future)
 
     # Special case of removing the root future from the futureDict
     scoop._control.delFuture(future)
@@ -310,6 +331,18 @@ def runController(callable_, *args, **kargs):
 
 
 execStats = defaultdict(_stat)
+# Round trip time of the pings to the broker
+overheadStats = _stat()
+
+
+def messagingOverhead():
+    """Returns the median overhead, in seconds, of executing a Future remotely.
+    It is measured by the round trip time of pings to the broker. Until
+    enough pings were measured, scoop.MESSAGING_OVERHEAD is assumed."""
+    median = overheadStats.median()
+    if median == float("inf"):
+        return scoop.MESSAGING_OVERHEAD
+    return median
 
 debug_stats = None
 QueueLength = None
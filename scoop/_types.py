@@ -14,9 +14,12 @@
 #    You should have received a copy of the GNU Lesser General Public
 #    License along with SCOOP. If not, see <http://www.gnu.org/licenses/>.
 #
-from collections import namedtuple, deque
+from collections import namedtuple, deque, OrderedDict
+import heapq
 import itertools
+import os
 import time
+import math
 import sys
 import greenlet
 import scoop
@@ -41,6 +44,7 @@ class CallbackType:
 
 # This class encapsulates a stopwatch that returns elapse time in seconds.
 class StopWatch(object):
+    __slots__ = ('totalTime', 'startTime', 'halted')
     # initialize stopwatch.
     def __init__(self):
         self.totalTime = 0
@@ -85,33 +89,90 @@ class Future(object):
     """This class encapsulates an independent future that can be executed in parallel.
     A future can spawn other parallel futures which themselves can recursively spawn
     other futures."""
+    # Futures stay in the futureDict for their whole lifetime, avoid a dict
+    # per instance. Other attributes can still be set in __dict__, created on
+    # demand.
+    __slots__ = ('id', 'executor', 'parentId', 'index', 'callable', 'args',
+                 'kargs', 'creationTime', 'stopWatch', 'greenlet',
+                 'resultValue', 'exceptionValue', 'exceptionTraceback',
+                 'sendResultBack', 'isDone', 'isReady', '_callback',
+                 '_children', 'priority', 'deadline', 'waitTime',
+                 'executionTime', 'threaded', '__dict__')
     rank = itertools.count()
     def __init__(self, parentId, callable, *args, **kargs):
         """Initialize a new Future."""
-        self.id = (scoop.worker, next(Future.rank))
+        self._setAttributes((scoop.worker, next(Future.rank)), parentId,
+                            callable, args, kargs)
+        # insert future into global dictionary
+        scoop._control.futureDict[self.id] = self
+
+    @classmethod
+    def _rebuild(cls, id, parentId, callable, args, kargs):
+        """Recreate a Future received from another worker. It is not inserted
+        in the global dictionary."""
+        future = cls.__new__(cls)
+        future._setAttributes(id, parentId, callable, args, kargs)
+        return future
+
+    def _setAttributes(self, id, parentId, callable, args, kargs):
+        """Set the attributes of a new Future."""
+        self.id = id
         self.executor = None  # id of executor
         self.parentId = parentId  # id of parent
         self.index = None  # parent index for result
         self.callable = callable  # callable object
         self.args = args  # arguments of callable
         self.kargs = kargs  # key arguments of callable
-        self.creationTime = time.ctime()  # future creation time
-        self.stopWatch = StopWatch()  # stop watch for measuring time
+        self.creationTime = time.time()  # future creation time
+        self.stopWatch = None  # stop watch for measuring time, set on execution
         self.greenlet = None  # cooperative thread for running future
         self.resultValue = None  # future result
         self.exceptionValue = None  # exception raised by callable
+        self.exceptionTraceback = None  # formatted traceback of the exception
         self.sendResultBack = True
         self.isDone = False
         self.isReady = False  # Once this is true, the future is out of our hands
-        self.callback = []  # set callback
-        self.children = {}  # set children list of the callable (dict for speedier delete)
-        # insert future into global dictionary
-        scoop._control.futureDict[self.id] = self
+        self._callback = None  # set callback, created on demand
+        self._children = None  # set children of the callable, created on demand
+        self.priority = 0  # futures of higher priority are executed first
+        self.deadline = None  # time before which the future should start
+        self.threaded = False  # executed by the thread pool of the worker
+        self.waitTime = None  # time between creation and execution
+        self.executionTime = None  # duration of the execution
+
+    @property
+    def callback(self):
+        """List of the callbacks of the future."""
+        if self._callback is None:
+            self._callback = []
+        return self._callback
+
+    @callback.setter
+    def callback(self, value):
+        self._callback = value
+
+    @property
+    def children(self):
+        """Children futures spawned by the callable (dict for speedier
+        delete)."""
+        if self._children is None:
+            self._children = {}
+        return self._children
+
+    @children.setter
+    def children(self, value):
+        self._children = value
 
     def __lt__(self, other):
         """Order futures by creation time."""
         return self.creationTime < other.creationTime
 
+    def _scheduleKey(self):
+        """Order of execution of queued futures: decreasing priority, then
+        earliest deadline."""
+        return (-self.priority,
+                self.deadline if self.deadline is not None else float("inf"))
+
     def __eq__(self, other):
         # This uses he fact that id's are unique
         return self.id == other.id
@@ -152,7 +213,7 @@ class Future(object):
            return True."""
         if self in scoop._control.execQueue.movable:
             self.exceptionValue = CancelledError()
-            for child in self.children:
+            for child in self._children or ():
                 child.exceptionValue = CancelledError()
             scoop._control.delFuture(self)
             scoop._control.execQueue.remove(self)
@@ -250,7 +311,7 @@ class Future(object):
             self.callback[-1].func(self)
 
     def _execute_callbacks(self, callbackType=CallbackType.standard):
-        for callback in self.callback:
+        for callback in self._callback or ():
             isUniRun = (self.parentId[0] == scoop.worker 
                         and callbackType == CallbackType.universal)
             if isUniRun or callback.callbackType == callbackType:
@@ -260,24 +321,167 @@ class Future(object):
                     pass
 
 
+class MovableQueue(object):
+    """Futures which have not begun execution, in order of arrival. Once a
+    future with a priority or a deadline is queued, and until the queue drains,
+    they are also kept in a heap ordered by decreasing priority, then by
+    earliest deadline, then by arrival (or by most recent arrival in work
+    stealing mode). Removed futures are discarded from the heap when popped.
+    The expected time to execute the queued futures is kept as a running
+    total; futures of unknown execution time are expected to last
+    indefinitely."""
+    def __init__(self, lifo=False):
+        # Arrival order of every queued future
+        self.futures = OrderedDict()
+        # Expected execution time of every queued future, their finite sum
+        # and how many are expected to last indefinitely
+        self.durations = {}
+        self.knownTime = 0.
+        self.unknownCount = 0
+        self.heap = []
+        self.arrival = itertools.count()
+        self.lifo = lifo
+        self.prioritized = False
+
+    def _push(self, future, order):
+        heapq.heappush(self.heap, future._scheduleKey()
+                       + (-order if self.lifo else order, order, future))
+
+    def _drained(self):
+        """Go back to the arrival order once the queue is empty."""
+        if not self.futures:
+            self.heap = []
+            self.prioritized = False
+            self.knownTime = 0.
+
+    def _discard(self, future):
+        duration = self.durations.pop(future)
+        if duration == float("inf"):
+            self.unknownCount -= 1
+        else:
+            self.knownTime -= duration
+
+    def expectedTime(self):
+        """Expected time to execute every queued future."""
+        if self.unknownCount:
+            return float("inf")
+        return self.knownTime
+
+    def append(self, future):
+        order = next(self.arrival)
+        self.futures[future] = order
+        stats = scoop._control.execStats.get(hash(future.callable))
+        duration = stats.median() if stats is not None else float("inf")
+        self.durations[future] = duration
+        if duration == float("inf"):
+            self.unknownCount += 1
+        else:
+            self.knownTime += duration
+        if self.prioritized:
+            self._push(future, order)
+        elif future.priority or future.deadline is not None:
+            self.prioritized = True
+            for queued, queuedOrder in self.futures.items():
+                self._push(queued, queuedOrder)
+
+    def popNext(self):
+        """Remove and return the next future to execute."""
+        if not self.prioritized:
+            future, _ = self.futures.popitem(last=self.lifo)
+            self._discard(future)
+            self._drained()
+            return future
+        while True:
+            entry = heapq.heappop(self.heap)
+            future, order = entry[-1], entry[-2]
+            if self.futures.get(future) == order:
+                del self.futures[future]
+                self._discard(future)
+                self._drained()
+                return future
+
+    def popleft(self):
+        """Remove and return the oldest future."""
+        future, _ = self.futures.popitem(last=False)
+        self._discard(future)
+        self._drained()
+        return future
+
+    def remove(self, future):
+        try:
+            del self.futures[future]
+        except KeyError:
+            raise ValueError("The future {0} is not queued.".format(future.id))
+        self._discard(future)
+        self._drained()
+
+    def clear(self):
+        self.futures.clear()
+        self.durations.clear()
+        self.unknownCount = 0
+        self._drained()
+
+    def __contains__(self, future):
+        return future in self.futures
+
+    def __iter__(self):
+        return iter(self.futures)
+
+    def __len__(self):
+        return len(self.futures)
+
+
 class FutureQueue(object):
     """This class encapsulates a queue of futures that are pending execution.
     Within this class lies the entry points for future communications."""
     def __init__(self):
         """Initialize queue to empty elements and create a communication
         object."""
-        self.movable = deque()
+        # In work stealing mode, spawned futures stay in the local queue until
+        # idle workers steal them
+        self.workStealing = scoop.CONFIGURATION.get('scheduler') == 'steal'
+        # In work stealing mode, the most recently spawned future is executed
+        # first, thieves take the oldest ones
+        self.movable = MovableQueue(lifo=self.workStealing)
         self.ready = deque()
         self.inprogress = set()
         self.socket = Communicator()
-        self.request_in_process = False
+        # Number of futures requested to the broker(s) but not yet received
+        self.requested = 0
+        # Number of futures to keep queued locally to overlap communication
+        # with computation
+        self.prefetch = max(1, scoop.CONFIGURATION.get('prefetch', 1))
+        self.reportedLoad = 0
+        # Measure of the messaging overhead in flight, and time it was sent
+        self.pinging = False
+        self.lastPing = 0
         if scoop.SIZE == 1 and not scoop.CONFIGURATION.get('headless', False):
             self.lowwatermark = float("inf")
             self.highwatermark = float("inf")
         else:
-            # TODO: Make it dependent on the network latency
-            self.lowwatermark = 0.01
-            self.highwatermark = 0.01
+            self.updateWatermarks()
+        # Set when the local queue went over the high watermark, until it drains
+        # under the low watermark
+        self.overflowing = False
+        # Threads executing the threaded futures. The futures they ended are
+        # returned by pop to be finalized.
+        self.threadPool = None
+        self.threadCount = 0
+        self.threadsRunning = 0
+        self.threadDone = deque()
+        self.threadEnded = deque()
+        threads = scoop.CONFIGURATION.get('threads_per_worker', 0)
+        if threads > 0:
+            self.startThreads(threads)
+
+    def updateWatermarks(self):
+        """Keep locally the spawned futures as long as the expected execution
+        time of the local queue doesn't exceed GRANULARITY_FACTOR times the
+        overhead of a remote execution. Longer futures are distributed
+        eagerly."""
+        watermark = scoop.GRANULARITY_FACTOR * scoop._control.messagingOverhead()
+        self.lowwatermark = watermark
+        self.highwatermark = watermark
 
     def __del__(self):
         """Destructor. Ensures Communicator is correctly discarted."""
@@ -297,6 +501,17 @@ class FutureQueue(object):
         times = Counter(hash(f.callable) for f in queue_)
         return sum(stats[f].median() * occur for f, occur in times.items())
 
+    def isLocalQueueAvailable(self):
+        """Tells if a newly spawned future can be executed locally, based on
+        the expected execution time of the movable futures. Futures of unknown
+        execution time are expected to last indefinitely."""
+        queueTime = self.movable.expectedTime()
+        if self.overflowing:
+            self.overflowing = queueTime > self.lowwatermark
+        else:
+            self.overflowing = queueTime > self.highwatermark
+        return not self.overflowing
+
     def append_ready(self, future):
         """
         This appends a ready future to the queue.
@@ -316,11 +531,19 @@ class FutureQueue(object):
         """
         This appends a movable future to the queue FOR THE FIRST TIME.
 
-        NOTE: This is different from append_movable in that all the futures
-        are not actually appended but are sent to the broker.
+        NOTE: This is different from append_movable in that the futures are
+        only kept in the local queue while its expected execution time is
+        under the watermarks. Other futures are sent to the broker.
         """
         if future.greenlet is None and not future.isDone and future.id[0] == scoop.worker:
-            self.socket.sendFuture(future)
+            if self.workStealing:
+                self.movable.append(future)
+                self.reportLoad()
+            elif self.isLocalQueueAvailable():
+                self.movable.append(future)
+            else:
+                self.socket.sendFuture(future)
+                self.ping()
         else:
             raise ValueError((
                 "The future id {} being added to queue initially is not "
@@ -338,7 +561,6 @@ class FutureQueue(object):
         """
         if future.greenlet is None and not future.isDone:
             self.movable.append(future)
-            assert len(self.movable) == 1, "movable size isnt adding up"
         else:
             raise ValueError((
                 "The future id {} being added to movable queue is not "
@@ -354,8 +576,13 @@ class FutureQueue(object):
         going to be executed and hence will be added to the inprogress set of
         execQueue."""
 
+        # In work stealing mode, serve the steal requests of idle peers even
+        # when local futures are available
+        if self.workStealing:
+            self.updateQueue()
+
         # Check if queue is empty
-        while len(self) == 0:
+        while len(self) == 0 and not self.threadEnded:
             # If so, Block until message arrives. Only send future request once (to
             # ensure FCFS). This has the following potential issue. If a node
             # disconnects and reconnects and is considered by the broker to be lost,
@@ -365,16 +592,65 @@ class FutureQueue(object):
             # NEVER happen and therefore we leave it be. Currently, I have added
             # some code that can be used to protect against this (see
             # FutureQueue.checkRequestStatus, REQUEST_STATUS_REQUEST and related)
-            if not self.request_in_process:
-                self.requestFuture()
+            if self.requested == 0 and not self.threadsBusy():
+                self.requestFuture(self.prefetch)
 
             self.socket._poll(POLLING_TIME)
             self.updateQueue()
+        if self.threadEnded:
+            return self.threadEnded.popleft()
         if len(self.ready) != 0:
             return self.ready.popleft()
         elif len(self.movable) != 0:
-            self.inprogress.add(self.movable[0])
-            return self.movable.popleft()
+            future = self.movable.popNext()
+            if self.workStealing:
+                self.reportLoad()
+            self.inprogress.add(future)
+            # Top up the prefetch window before executing this future
+            missing = self.prefetch - len(self.movable) - self.requested
+            if self.prefetch > 1 and missing > 0:
+                self.requestFuture(missing)
+            return future
+
+    def startThreads(self, count):
+        """Start the pool of count threads executing the threaded futures."""
+        from concurrent.futures import ThreadPoolExecutor
+        self.threadCount = count
+        self.threadPool = ThreadPoolExecutor(count)
+        # Written by the threads to wake the polling up
+        self.wakeup = os.pipe()
+        os.set_blocking(self.wakeup[0], False)
+        self.socket.watch(self.wakeup[0])
+
+    def threadsBusy(self):
+        """Tells if every thread is executing a threaded future. No future is
+        requested to the broker meanwhile."""
+        return (self.threadPool is not None
+                and self.threadsRunning >= self.threadCount)
+
+    def runThreaded(self, future):
+        """Execute a started future in the thread pool."""
+        self.threadsRunning += 1
+        self.threadPool.submit(self._callThreaded, future)
+
+    def _callThreaded(self, future):
+        """Executed by the threads of the pool."""
+        scoop._control.callFuture(future)
+        self.threadDone.append(future)
+        os.write(self.wakeup[1], b"\0")
+
+    def collectThreaded(self):
+        """Terminate the futures executed by the thread pool."""
+        try:
+            os.read(self.wakeup[0], 4096)
+        except OSError:
+            # Nothing was written
+            pass
+        while self.threadDone:
+            future = self.threadDone.popleft()
+            self.threadsRunning -= 1
+            scoop._control.endFuture(future)
+            self.threadEnded.append(future)
 
     def flush(self):
         """Empty the local queue and send its elements to be executed remotely.
@@ -386,10 +662,48 @@ class FutureQueue(object):
         self.ready.clear()
         self.movable.clear()
 
-    def requestFuture(self):
+    def requestFuture(self, count=1):
         """Request futures from the broker"""
-        self.socket.sendRequest()
-        self.request_in_process = True
+        self.socket.sendRequest(count)
+        self.requested += count * len(self.socket.broker_set)
+        self.ping()
+
+    def ping(self):
+        """Measure the messaging overhead. Once enough samples were taken,
+        or while a ping is in flight, it is measured at most every
+        TIME_BETWEEN_PINGS seconds."""
+        stats = scoop._control.overheadStats
+        now = time.time()
+        if (now - self.lastPing < scoop.TIME_BETWEEN_PINGS
+                and (self.pinging or len(stats) == stats.maxlen)):
+            return
+        self.pinging = True
+        self.lastPing = now
+        self.socket.sendPing()
+
+    def reportLoad(self, force=False):
+        """Advertise the local queue length to the broker in work stealing
+        mode. To limit the traffic, the length is only reported when its order
+        of magnitude changes."""
+        load = len(self.movable)
+        magnitude = int(math.log(load, 2)) + 1 if load else 0
+        if force or magnitude != self.reportedLoad:
+            self.reportedLoad = magnitude
+            self.socket.sendLoad(load)
+
+    def giveStolenFutures(self, thief):
+        """Send the oldest half of the local queue to an idle peer."""
+        stolen = [self.movable.popleft()
+                  for _ in range((len(self.movable) + 1) // 2)]
+        if not stolen:
+            self.socket.sendStealEmpty(thief)
+            self.reportLoad(force=True)
+            return
+        for future in stolen:
+            if future.id[0] != scoop.worker:
+                scoop._control.delFuture(future)
+        self.socket.sendStolenFutures(thief, stolen)
+        self.reportLoad()
 
     def updateQueue(self):
         """Process inbound communication buffer.
@@ -397,6 +711,8 @@ class FutureQueue(object):
 
         Note that the broker only sends either non-executed (movable)
         futures, or completed futures"""
+        if self.threadPool is not None:
+            self.collectThreaded()
         for incoming_msg in self.socket.recvIncoming():
             incoming_msg_categ = incoming_msg[0]
             incoming_msg_value = incoming_msg[1]
@@ -416,7 +732,7 @@ class FutureQueue(object):
                 thisFuture.executor = future.executor
                 thisFuture.isDone = future.isDone
                 self.finalizeReturnedFuture(thisFuture)
-            elif incoming_msg_categ == TASK:
+            elif incoming_msg_categ in (TASK, STOLEN):
                 future = incoming_msg_value
                 if future.id not in scoop._control.futureDict:
                     # This is the case where the worker is executing a remotely
@@ -427,10 +743,12 @@ class FutureQueue(object):
                     # This is the case where the worker is executing a locally
                     # generated future
                     self.append_movable(scoop._control.futureDict[future.id])
-                if len(self.movable) > 0:
-                    # This means that a future has been returned corresponding to the
-                    # future request
-                    self.request_in_process = False
+                # This future has been returned corresponding to a future
+                # request. Stolen futures fulfill the whole request.
+                if incoming_msg_categ == STOLEN:
+                    self.requested = 0
+                else:
+                    self.requested = max(0, self.requested - 1)
             elif incoming_msg_categ == RESEND_FUTURE:
                 future_id = incoming_msg_value
                 try:
@@ -446,9 +764,22 @@ class FutureQueue(object):
                         " (likely received and processed in the meanwhile)"
                         "".format(future_id)
                     )
+            elif incoming_msg_categ == STEAL:
+                self.giveStolenFutures(incoming_msg_value)
+            elif incoming_msg_categ == PING:
+                self.measureOverhead(incoming_msg_value)
             else:
                 assert False, "Unrecognized incoming message"
 
+    def measureOverhead(self, roundTrip):
+        """Record the round trip time of a ping as the overhead of a remote
+        execution. Unlike the round trip of the futures, it doesn't include
+        the time they wait in the broker queue for an idle worker."""
+        self.pinging = False
+        scoop._control.overheadStats.appendleft(max(roundTrip, 1e-6))
+        if self.highwatermark != float("inf"):
+            self.updateWatermarks()
+
     def finalizeReturnedFuture(self, future):
         """Finalize a future that was generated here and executed remotely.
         """
@@ -507,6 +838,11 @@ class FutureQueue(object):
     def shutdown(self):
         """Shutdown the ressources used by the queue"""
         self.socket.shutdown()
+        if getattr(self, 'threadPool', None) is not None:
+            self.threadPool.shutdown(wait=False)
+            os.close(self.wakeup[0])
+            os.close(self.wakeup[1])
+            self.threadPool = None
 
         if scoop:
             if scoop.DEBUG:
@@ -0,0 +1,169 @@
+#
+#    This file is part of Scalable COncurrent Operations in Python (SCOOP).
+#
+#    SCOOP is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as
+#    published by the Free Software Foundation, either version 3 of
+#    the License, or (at your option) any later version.
+#
+#    SCOOP is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with SCOOP. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Asyncio interface to SCOOP Futures.
+
+The functions of this module are called from coroutines running in an asyncio
+event loop of the root Future. The Futures they submit are always sent to the
+broker to be executed by the other workers, the worker running the event loop
+only orchestrates them. Their results are received by a task of the event loop
+polling the worker sockets, so awaiting them never blocks the loop."""
+import asyncio
+from collections import deque
+
+import zmq.asyncio
+
+import scoop
+from . import futures
+from . import _control as control
+from ._types import POLLING_TIME
+from .fallbacks import ensureScoopStartedProperly
+
+# asyncio futures awaiting the result of the submitted Futures
+_pending = {}
+# Submitted Futures which ended, appended by their callback
+_ended = deque()
+# Event loop task receiving the results
+_receiver = None
+
+
+def _resolve():
+    """Hand the results of the ended Futures over to their asyncio futures."""
+    while _ended:
+        future = _ended.popleft()
+        waiter = _pending.pop(future, None)
+        if waiter is None:
+            continue
+        # The future is processed here rather than by the controller
+        try:
+            control.execQueue.ready.remove(future)
+        except ValueError:
+            pass
+        control.execQueue.sendReadyStatus(future)
+        if waiter.cancelled():
+            continue
+        if future.exceptionValue is not None:
+            waiter.set_exception(future.exceptionValue)
+        else:
+            waiter.set_result(future.resultValue)
+
+
+def _sendBack():
+    """Send the Futures received for execution back to the broker: the worker
+    running the event loop doesn't execute Futures."""
+    queue = control.execQueue
+    while queue.movable:
+        future = queue.movable.popleft()
+        if future.id[0] != scoop.worker:
+            control.delFuture(future)
+        queue.socket.sendFuture(future)
+
+
+async def _receive():
+    """Update the Futures queue whenever a message reaches the worker, until
+    every submitted Future is resolved."""
+    poller = zmq.asyncio.Poller()
+    for socket, flags in control.execQueue.socket.poller.sockets:
+        poller.register(socket, flags)
+    try:
+        while _pending:
+            await poller.poll(POLLING_TIME)
+            control.execQueue.updateQueue()
+            _sendBack()
+            _resolve()
+    except asyncio.CancelledError:
+        for waiter in _pending.values():
+            waiter.cancel()
+        _pending.clear()
+        _ended.clear()
+        raise
+    except Exception as err:
+        # Such as a shutdown of the worker
+        for waiter in _pending.values():
+            if not waiter.done():
+                waiter.set_exception(err)
+        _pending.clear()
+        _ended.clear()
+        raise
+
+
+def _ensureReceiver(loop):
+    """Start the task receiving the results in the given event loop."""
+    global _receiver
+    if (_receiver is None or _receiver.done()
+            or _receiver.get_loop() is not loop):
+        _receiver = loop.create_task(_receive())
+
+
+@ensureScoopStartedProperly
+def submit(func, *args, **kwargs):
+    """Submit an independent Future that will be executed remotely as
+    `func(*args)`. Must be called from a coroutine.
+
+    :param func: Any picklable callable object (function or class object with
+        *__call__* method); this object will be called to execute the Future.
+    :param args: A tuple of positional arguments that will be passed to the
+        func object.
+    :param kwargs: A dictionary of additional arguments that will be passed to
+        the func object. The priority, deadline and threaded keywords of
+        :meth:`~scoop.futures.submit` are supported.
+
+    :returns: An asyncio future holding the result of the Future.
+
+    If no other worker is available to execute it, the Future is executed
+    serially before returning."""
+    loop = asyncio.get_running_loop()
+    waiter = loop.create_future()
+    if scoop.SIZE == 1:
+        kwargs.pop('priority', None)
+        kwargs.pop('deadline', None)
+        kwargs.pop('threaded', None)
+        try:
+            waiter.set_result(func(*args, **kwargs))
+        except Exception as err:
+            waiter.set_exception(err)
+        return waiter
+
+    future = futures.submit(func, *args, **kwargs)
+    # The worker running the event loop doesn't execute Futures
+    try:
+        control.execQueue.remove(future)
+        control.execQueue.socket.sendFuture(future)
+    except ValueError:
+        pass
+    _pending[future] = waiter
+    future.add_done_callback(_ended.append)
+    _ensureReceiver(loop)
+    return waiter
+
+
+def map(func, *iterables, **kwargs):
+    """Similar to :meth:`~scoop.futures.map`, but awaitable. Every iteration
+    is submitted using :meth:`~scoop.aio.submit`. Must be called from a
+    coroutine.
+
+    :param func: Any picklable callable object (function or class object with
+        *__call__* method); this object will be called to execute the Futures.
+    :param iterables: Iterable objects; each will be zipped to form an iterable
+        of arguments tuples that will be passed to the callable object as a
+        separate Future.
+    :param kwargs: The priority, deadline and threaded keywords of the Futures
+        (see :meth:`~scoop.futures.submit`).
+
+    :returns: An awaitable returning the list of map results, ordered as the
+        iterables."""
+    return asyncio.gather(*[submit(func, *args, **kwargs)
+                            for args in zip(*iterables)])
@@ -64,7 +64,8 @@ class Bootstrap(object):
         if self.args.workingDirectory:
             os.chdir(self.args.workingDirectory)
 
-        if not self.args.brokerHostname:
+        # The workers of the local backend don't use a broker
+        if not self.args.brokerHostname and self.args.backend != 'local':
             self.log.info("Discovering SCOOP Brokers on network...")
             pools = discovery.Seek()
             if not pools:
@@ -115,6 +116,12 @@ class Bootstrap(object):
         self.parser.add_argument('--metaPort',
                                  help="The port of the broker meta socket",
                                  type=int)
+        self.parser.add_argument('--taskIPC',
+                                 help="The IPC endpoint of the broker task "
+                                      "socket, on the host of the broker")
+        self.parser.add_argument('--metaIPC',
+                                 help="The IPC endpoint of the broker meta "
+                                      "socket, on the host of the broker")
         self.parser.add_argument('--size',
                                  help="The size of the worker pool",
                                  type=int,
@@ -135,8 +142,26 @@ class Bootstrap(object):
                                  default=os.path.expanduser("~"))
         self.parser.add_argument('--backend',
                                  help="Choice of communication backend",
-                                 choices=['ZMQ', 'TCP'],
+                                 choices=['ZMQ', 'TCP', 'local'],
                                  default='ZMQ')
+        self.parser.add_argument('--prefetch',
+                                 help="Number of tasks to keep queued locally",
+                                 type=int,
+                                 default=1)
+        self.parser.add_argument('--scheduler',
+                                 help="Task scheduling policy",
+                                 choices=['fifo', 'steal', 'locality'],
+                                 default='fifo')
+        self.parser.add_argument('--serializer',
+                                 help="Serializer of the messages",
+                                 choices=['pickle', 'cloudpickle', 'marshal',
+                                          'msgpack'],
+                                 default='pickle')
+        self.parser.add_argument('--threadsPerWorker',
+                                 help="Number of threads executing the "
+                                      "threaded Futures",
+                                 type=int,
+                                 default=0)
         self.parser.add_argument('executable',
                                  nargs='?',
                                  help='The executable to start with scoop')
@@ -149,11 +174,12 @@ class Bootstrap(object):
                                       "(-vv for more)"),
                                  default=0)
 
-    def parse(self):
-        """Generate a argparse parser and parse the command-line arguments"""
+    def parse(self, args=None):
+        """Generate a argparse parser and parse the command-line arguments, or
+        the given list of arguments"""
         if self.parser is None:
             self.makeParser()
-        self.args = self.parser.parse_args()
+        self.args = self.parser.parse_args(args)
         self.verbose = self.args.verbose
 
     def setScoop(self):
@@ -167,6 +193,8 @@ class Bootstrap(object):
             self.args.externalBrokerHostname
                 if self.args.externalBrokerHostname
                 else self.args.brokerHostname,
+            self.args.taskIPC,
+            self.args.metaIPC,
         )
         scoop.SIZE = self.args.size
         scoop.DEBUG = self.args.debug
@@ -174,6 +202,10 @@ class Bootstrap(object):
         scoop.CONFIGURATION = {
           'headless': not bool(self.args.executable),
           'backend': self.args.backend,
+          'prefetch': self.args.prefetch,
+          'scheduler': self.args.scheduler,
+          'serializer': self.args.serializer,
+          'threads_per_worker': self.args.threadsPerWorker,
         }
         scoop.WORKING_DIRECTORY = self.args.workingDirectory
         scoop.logger = self.log
@@ -208,7 +240,8 @@ class Bootstrap(object):
                 _ = open(scoop.MAIN_MODULE, 'r')
                 user_module = None
             else:
-                user_module = importFunction(
+                # Already imported if forked from a fork server
+                user_module = sys.modules.get("SCOOP_WORKER") or importFunction(
                     "SCOOP_WORKER",
                     scoop.MAIN_MODULE,
                 )
@@ -293,6 +326,17 @@ class Bootstrap(object):
                     scoop._control.execQueue.shutdown()
 
 
+def runForked(args):
+    """Bootstrap a worker forked from a process which already imported SCOOP,
+    with the given command-line arguments."""
+    # As if started by python -m scoop.bootstrap, the main module holds the
+    # user module definitions
+    sys.modules["__main__"] = sys.modules[__name__]
+    b = Bootstrap()
+    b.parse(args)
+    b.main()
+
+
 if __name__ == "__main__":
     b = Bootstrap()
     b.main()
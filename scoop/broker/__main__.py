@@ -51,6 +51,10 @@ if __name__ == "__main__":
     parser.add_argument('--headless',
                         help="Enforce headless (cloud-style) operation",
                         action='store_true')
+    parser.add_argument('--io-thread',
+                        help="Relay the messages in a thread separate from "
+                             "the scheduling of the tasks",
+                        action='store_true')
     parser.add_argument('--echoGroup',
                         help="Echo the process Group ID before launch",
                         action='store_true')
@@ -73,8 +77,10 @@ if __name__ == "__main__":
             sys.stderr.write('Could not chdir in {0}.'.format(args.path))
             sys.stderr.flush()
 
+    brokerOptions = {}
     if args.backend == 'ZMQ':
         from ..broker.brokerzmq import Broker
+        brokerOptions['ioThread'] = args.io_thread
     else:
         from ..broker.brokertcp import Broker
 
@@ -82,6 +88,7 @@ if __name__ == "__main__":
                         "tcp://*:" + args.mPort,
                         debug=args.debug,
                         headless=args.headless,
+                        **brokerOptions
                         )
 
     signal(SIGTERM,
@@ -100,9 +107,11 @@ if __name__ == "__main__":
     if args.echoPorts:
         import os
         import sys
-        sys.stdout.write("{0},{1}\n".format(
+        # Followed by the paths of the IPC endpoints, empty if not bound
+        sys.stdout.write("{0},{1},{2},{3}\n".format(
             thisBroker.t_sock_port,
             thisBroker.info_sock_port,
+            *(path or "" for path in thisBroker.getIPCPaths())
         ))
         sys.stdout.flush()
 
@@ -295,6 +295,9 @@ class Broker(object):
     def getPorts(self):
         return (self.tSockPort, self.infoSockPort)
 
+    def getIPCPaths(self):
+        return (None, None)
+
     def getName(self):
         import sys
         if sys.version < '3':
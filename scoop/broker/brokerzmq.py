@@ -15,7 +15,8 @@
 #    You should have received a copy of the GNU Lesser General Public
 #    License along with SCOOP. If not, see <http://www.gnu.org/licenses/>.
 #
-from collections import deque, defaultdict
+from collections import defaultdict
+import threading
 import time
 import zmq
 import sys
@@ -27,10 +28,13 @@ except ImportError:
     import pickle
 
 import scoop
-from scoop import TIME_BETWEEN_PARTIALDEBUG, TASK_CHECK_INTERVAL
+from scoop import (TIME_BETWEEN_PARTIALDEBUG, TASK_CHECK_INTERVAL,
+                   ZERO_COPY_THRESHOLD, BROKER_BATCH_SIZE,
+                   TIME_BETWEEN_BROKER_LOADS)
 from .. import discovery, utils
-from .structs import BrokerInfo
+from .structs import BrokerInfo, TaskQueue
 from .._comm.scoopmessages import *
+from .._comm import serializers
 
 
 class LaunchingError(Exception): pass
@@ -38,13 +42,16 @@ class LaunchingError(Exception): pass
 
 class Broker(object):
     def __init__(self, tSock="tcp://*:*", mSock="tcp://*:*", debug=False,
-                 headless=False, hostname="127.0.0.1"):
+                 headless=False, hostname="127.0.0.1", ioThread=False):
         """This function initializes a broker.
 
         :param tSock: Task Socket Address.
         Must contain protocol, address  and port information.
         :param mSock: Meta Socket Address.
         Must contain protocol, address and port information.
+        :param ioThread: If True, the sockets are handled by a thread relaying
+        the replies and shared variables while the scheduling of the tasks
+        runs in another thread.
         """
         # Initialize zmq
         self.context = zmq.Context(1)
@@ -63,7 +70,8 @@ class Broker(object):
         else:
             self.task_socket.bind(tSock)
             self.t_sock_port = tSock.split(":")[-1]
-
+        # The workers of this host connect through IPC
+        self.ipc_paths = [utils.bindIPC(self.task_socket, self.t_sock_port)]
 
         # Create identifier for this broker
         self.name = "{0}:{1}".format(hostname, self.t_sock_port)
@@ -87,24 +95,49 @@ class Broker(object):
         else:
             self.info_socket.bind(mSock)
             self.info_sock_port = mSock.split(":")[-1]
+        self.ipc_paths.append(utils.bindIPC(self.info_socket,
+                                            self.info_sock_port))
 
         self.task_socket.setsockopt(zmq.SNDHWM, 0)
         self.task_socket.setsockopt(zmq.RCVHWM, 0)
         self.info_socket.setsockopt(zmq.SNDHWM, 0)
         self.info_socket.setsockopt(zmq.RCVHWM, 0)
 
-        # Init connection to fellow brokers
-        self.cluster_socket = self.context.socket(zmq.DEALER)
-        self.cluster_socket.setsockopt(zmq.IPV4ONLY, 0)
-        self.cluster_socket.setsockopt_string(zmq.IDENTITY, self.getName())
-            
-        self.cluster_socket.setsockopt(zmq.RCVHWM, 0)
-        self.cluster_socket.setsockopt(zmq.SNDHWM, 0)
-        self.cluster_socket.setsockopt(zmq.IMMEDIATE, 1)
+        # Fellow brokers, each one reached through its own socket and known
+        # by its name. The fellow brokers advertise the number of tasks their
+        # idle workers can receive, the queued tasks are forwarded to them.
+        self.federation_name = self.getName().encode()
+        self.peer_sockets = {}
+        self.peer_demand = {}
+        self.advertised_demand = 0
+        self.last_load_time = 0.
+        # Workers served by this broker and by the fellow brokers, to route
+        # the replies between them
+        self.local_workers = set()
+        self.worker_brokers = {}
+        # With an I/O thread, guards the state written by relay() and read by
+        # the scheduling thread: the fellow brokers, the routing of the
+        # replies, the configuration and the memory-mapped constants requests
+        self.state_lock = threading.Lock()
 
         self.cluster = []
         self.cluster_available = set()
 
+        # Pair of sockets between the I/O and the scheduling threads. The
+        # scheduling thread sends its messages for the workers through
+        # scheduler_socket, prefixed by a tag returned if undelivered.
+        self.scheduler_socket = None
+        self.io_socket = None
+        if ioThread:
+            address = "inproc://scheduling-{0}".format(id(self))
+            self.scheduler_socket = self.context.socket(zmq.PAIR)
+            self.io_socket = self.context.socket(zmq.PAIR)
+            for socket in (self.scheduler_socket, self.io_socket):
+                socket.setsockopt(zmq.SNDHWM, 0)
+                socket.setsockopt(zmq.RCVHWM, 0)
+            self.scheduler_socket.bind(address)
+            self.io_socket.connect(address)
+
         # Init statistics
         if self.debug:
             self.stats = []
@@ -118,14 +151,30 @@ class Broker(object):
 
         # Initializing the queue of workers and tasks
         # The busy workers variable will contain a dict (map) of workers: task
+        # Available workers are the ones holding request credits, that is the
+        # number of tasks they asked for and haven't received yet
         self.available_workers = set()
-        self.unassigned_tasks = deque()
+        # Available workers of every host, for the locality scheduler
+        self.host_workers = defaultdict(set)
+        self.worker_credits = defaultdict(int)
+        # Queued futures advertised by the workers in work stealing mode
+        self.worker_loads = {}
+        # Request credits of the idle workers sent to steal futures
+        self.thieves = {}
+        self.unassigned_tasks = TaskQueue()
         self.assigned_tasks = defaultdict(set)
+        # Tasks assigned while handling the received messages, sent at once
+        # to every worker by flushTasks: {address: [(id, task, schedule),]}
+        self.outgoing_tasks = defaultdict(list)
         self.heartbeat_times = {}
         self.init_time = time.time()
         self.last_task_check_time = time.time()
         # Shared variables containing {workerID:{varName:varVal},}
         self.shared_variables = defaultdict(dict)
+        # Contents of the memory-mapped constants {digest: segment} and the
+        # workers waiting for them {digest: {address,}}
+        self.segments = {}
+        self.segment_requests = defaultdict(set)
 
         # Start a worker-like communication if needed
         self.execQueue = None
@@ -135,26 +184,46 @@ class Broker(object):
         self.config = defaultdict(bool)
         self.processConfig({'headless': headless})
 
+    @staticmethod
+    def brokerName(aBrokerInfo):
+        """Returns the name of a broker among its fellow brokers."""
+        return "{0}:{1}".format(aBrokerInfo.hostname,
+                                aBrokerInfo.task_port).encode()
+
     def addBrokerList(self, aBrokerInfoList):
         """Add a broker to the broker cluster available list.
         Connects to the added broker if needed."""
         self.cluster_available.update(set(aBrokerInfoList))
 
-        # If we need another connection to a fellow broker
-        # TODO: only connect to a given number
         for aBrokerInfo in aBrokerInfoList:
-            self.cluster_socket.connect(
-                "tcp://{hostname}:{port}".format(
-                    hostname=aBrokerInfo.hostname,
-                    port=aBrokerInfo.task_port,
-                )
-            )
+            name = self.brokerName(aBrokerInfo)
+            if name in self.peer_sockets:
+                continue
+            socket = self.context.socket(zmq.DEALER)
+            socket.setsockopt(zmq.IPV4ONLY, 0)
+            socket.setsockopt(zmq.IDENTITY, self.federation_name)
+            socket.setsockopt(zmq.RCVHWM, 0)
+            socket.setsockopt(zmq.SNDHWM, 0)
+            socket.setsockopt(zmq.LINGER, 1000)
+            socket.connect(utils.endpoint(aBrokerInfo.hostname,
+                                          aBrokerInfo.task_port,
+                                          aBrokerInfo.task_ipc))
+            self.peer_sockets[name] = socket
             self.cluster.append(aBrokerInfo)
+            # Route the replies toward the workers already served here
+            if self.local_workers:
+                socket.send_multipart([
+                    BROKER_WORKERS,
+                    pickle.dumps(list(self.local_workers),
+                                 pickle.HIGHEST_PROTOCOL),
+                ])
 
     def processConfig(self, worker_config):
         """Update the pool configuration with a worker configuration.
         """
         self.config['headless'] |= worker_config.get("headless", False)
+        if worker_config.get("scheduler"):
+            self.config['scheduler'] = worker_config["scheduler"]
         if self.config['headless']:
             # Launch discovery process
             if not self.discovery_thread:
@@ -162,137 +231,617 @@ class Broker(object):
                     port=",".join(str(a) for a in self.getPorts()),
                 )
 
-    def safeTaskSend(self, worker_address, task_id_pickled, task_pickled):
+    def schedulerMode(self):
+        """Returns the scheduler requested by the workers."""
+        with self.state_lock:
+            return self.config['scheduler']
+
+    @staticmethod
+    def workerHost(address):
+        """Returns the host of a worker address (host:port)."""
+        return address.rpartition(b":")[0]
+
+    def addAvailable(self, address):
+        """Mark a worker as available to receive tasks."""
+        self.available_workers.add(address)
+        self.host_workers[self.workerHost(address)].add(address)
+
+    def discardAvailable(self, address):
+        """Mark a worker as unable to receive tasks."""
+        self.available_workers.discard(address)
+        host = self.workerHost(address)
+        workers = self.host_workers.get(host)
+        if workers is not None:
+            workers.discard(address)
+            if not workers:
+                del self.host_workers[host]
+
+    def chooseWorker(self, task_pickled):
+        """Returns the available worker to which a task is sent, or None if
+        no worker is available. The locality scheduler prefers the workers on
+        the host of the worker which submitted the task."""
+        if self.schedulerMode() == 'locality':
+            # Frame holding the worker address of the Future id
+            workers = self.host_workers.get(self.workerHost(task_pickled[1]))
+            if workers:
+                return next(iter(workers))
+        try:
+            address = self.available_workers.pop()
+        except KeyError:
+            return None
+        # Remains available until useCredit takes its last credit
+        self.available_workers.add(address)
+        return address
+
+    def assignTask(self, task_id_pickled, task_pickled, schedule=None):
+        """Send a task to an available worker, or queue it if none is
+        available. schedule is the (priority, deadline) tuple of the task."""
+        address = self.chooseWorker(task_pickled)
+        if address is None:
+            self.unassigned_tasks.append((task_id_pickled, task_pickled),
+                                         schedule)
+        else:
+            self.useCredit(address)
+            self.safeTaskSend(address, task_id_pickled, task_pickled,
+                              schedule=schedule)
+
+    def useCredit(self, address):
+        """Consume a request credit of a worker, keeping it available while it
+        still holds credits."""
+        self.worker_credits[address] -= 1
+        if self.worker_credits[address] <= 0:
+            self.discardAvailable(address)
+            del self.worker_credits[address]
+
+    def getBusiestWorker(self, address):
+        """Returns the worker advertising the most queued futures, excluding
+        the given address, or None if no worker has queued futures."""
+        loads = ((load, worker) for worker, load in self.worker_loads.items()
+                 if load > 0 and worker != address)
+        try:
+            load, worker = max(loads)
+        except ValueError:
+            return None
+        # Thieves take half of the queue, avoid sending every idle worker there
+        self.worker_loads[worker] = load // 2
+        return worker
+
+    def forwardSteal(self, thief):
+        """Ask the busiest worker to give some of its queued futures to an idle
+        worker. Returns False if no worker has queued futures."""
+        victim = self.getBusiestWorker(thief)
+        if victim is None:
+            return False
+        try:
+            self.sendToWorker([victim, STEAL, thief])
+        except zmq.ZMQError:
+            scoop.logger.warning("Failed to forward a steal from worker {0} to "
+                                 "worker {1}".format(thief, victim))
+            return False
+        # The thief is not available anymore until the steal fails
+        self.thieves[thief] = self.worker_credits.pop(thief, 1)
+        self.discardAvailable(thief)
+        return True
+
+    def addCredits(self, address, credits):
+        """Grant request credits to a worker and send it the unassigned tasks
+        it can receive. In work stealing mode, a worker remaining idle is sent
+        to steal futures from a busy peer."""
+        self.worker_credits[address] += credits
+        self.addAvailable(address)
+        while self.unassigned_tasks and address in self.available_workers:
+            (task_id, task), schedule = self.unassigned_tasks.popleft()
+            self.useCredit(address)
+            self.safeTaskSend(address, task_id, task, schedule=schedule)
+        if address in self.available_workers and self.schedulerMode() == 'steal':
+            self.forwardSteal(address)
+
+    def sendToWorker(self, frames, tag=b""):
+        """Send frames, beginning by the address of a worker, to this worker.
+        Raises zmq.ZMQError if the worker is unreachable. With an I/O thread,
+        the frames are sent through it and returned in an UNDELIVERED message
+        with tag if the worker is unreachable."""
+        if self.scheduler_socket is None:
+            self.deliver(frames)
+        else:
+            self.scheduler_socket.send_multipart([tag] + frames, copy=False)
+
+    def deliver(self, frames):
+        """Send frames beginning by the address of a worker or the name of a
+        fellow broker to its destination."""
+        peer_socket = self.peer_sockets.get(frames[0])
+        if peer_socket is None:
+            self.task_socket.send_multipart(frames, copy=False)
+        else:
+            peer_socket.send_multipart(frames[1:], copy=False)
+
+    def requeueTask(self, worker_address, task_id_pickled, task_pickled,
+                    schedule=None):
+        """Queue back a task which couldn't be delivered to a worker."""
+        scoop.logger.warning("Failed to deliver task {0} to address {1}".format(serializers.loads(task_id_pickled), worker_address))
+        self.assigned_tasks[worker_address].discard(task_id_pickled)
+        self.unassigned_tasks.append((task_id_pickled, task_pickled),
+                                     schedule)
+
+    def safeTaskSend(self, worker_address, task_id_pickled, task_pickled,
+                     msg_type=TASK, schedule=None):
+        """Send a task to a worker, or queue it back if it fails. task_pickled
+        is the list of frames of the pickled Future, forwarded untouched.
+        Tasks are held until flushTasks sends them to their worker at once."""
+        if msg_type == TASK:
+            self.outgoing_tasks[worker_address].append(
+                (task_id_pickled, task_pickled, schedule)
+            )
+        else:
+            self.sendTask(worker_address, task_id_pickled, task_pickled,
+                          msg_type, schedule)
+
+    def sendTask(self, worker_address, task_id_pickled, task_pickled,
+                 msg_type=TASK, schedule=None):
+        """Send a task to a worker right away, or queue it back if it
+        fails."""
         try:
-            self.task_socket.send_multipart([worker_address, TASK, task_pickled])
+            self.sendToWorker([worker_address, msg_type] + task_pickled,
+                              task_id_pickled)
         except zmq.ZMQError as E:
-            scoop.logger.warning("Failed to deliver task {0} to address {1}".format(pickle.loads(task_id_pickled), worker_address))
-            self.unassigned_tasks.append((task_id_pickled, task_pickled))
+            self.requeueTask(worker_address, task_id_pickled, task_pickled,
+                             schedule)
         else:
-            self.logger.debug("Sent {0} to worker {1}".format(pickle.loads(task_id_pickled), worker_address))
+            if self.debug:
+                self.logger.debug("Sent {0} to worker {1}".format(serializers.loads(task_id_pickled), worker_address))
             self.assigned_tasks[worker_address].add(task_id_pickled)
 
+    def flushTasks(self):
+        """Send the tasks held by safeTaskSend, in a single TASKS message per
+        worker receiving more than one of them."""
+        outgoing_tasks, self.outgoing_tasks = self.outgoing_tasks, defaultdict(list)
+        for address, tasks in outgoing_tasks.items():
+            if len(tasks) == 1:
+                task_id, task, schedule = tasks[0]
+                self.sendTask(address, task_id, task, TASK, schedule)
+                continue
+            counts = b"".join(FRAME_COUNT.pack(len(task))
+                              for _, task, _ in tasks)
+            frames = [address, TASKS, counts]
+            for _, task, _ in tasks:
+                frames.extend(task)
+            tag = b""
+            if self.scheduler_socket is not None:
+                # The ids are returned in an UNDELIVERED message
+                tag = pickle.dumps([task_id for task_id, _, _ in tasks],
+                                   pickle.HIGHEST_PROTOCOL)
+            try:
+                self.sendToWorker(frames, tag)
+            except zmq.ZMQError:
+                for task_id, task, schedule in tasks:
+                    self.requeueTask(address, task_id, task, schedule)
+            else:
+                if self.debug:
+                    self.logger.debug("Sent {0} tasks to worker {1}".format(len(tasks), address))
+                self.assigned_tasks[address].update(
+                    task_id for task_id, _, _ in tasks
+                )
+
+    @staticmethod
+    def receive(socket, flags=0):
+        """Receive a message. Futures and their out-of-band buffers are
+        forwarded without copy."""
+        return [frame.bytes if len(frame) < ZERO_COPY_THRESHOLD
+                else frame.buffer
+                for frame in socket.recv_multipart(flags, copy=False)]
+
+    @staticmethod
+    def receivePending(socket):
+        """Receive the messages waiting on a socket, up to BROKER_BATCH_SIZE
+        of them, without blocking."""
+        for _ in range(BROKER_BATCH_SIZE):
+            try:
+                yield Broker.receive(socket, zmq.NOBLOCK)
+            except zmq.Again:
+                return
+
+    @staticmethod
+    def taskSchedule(header):
+        """Returns the (priority, deadline) ordering a task in the queue from
+        its header, or None for the default ordering."""
+        _, _, flags, priority, deadline = TASK_HEADER.unpack(header)
+        if flags & FLAG_DEADLINE:
+            return (priority, deadline)
+        elif priority:
+            return (priority, None)
+        return None
+
     def run(self):
         """Redirects messages until a shutdown message is received."""
+        if self.io_socket is not None:
+            return self.runThreaded()
         while True:
             if not self.task_socket.poll(-1):
                 continue
 
-            msg = self.task_socket.recv_multipart()
-            msg_type = msg[1]
-
-            # Checking if things are fine with servers and futures
-            if time.time() - self.last_task_check_time > TASK_CHECK_INTERVAL:
-                self.last_task_check_time = time.time()
-                self.checkAssignedTasks()
+            for msg in self.receivePending(self.task_socket):
+                if msg[1] == SHUTDOWN:
+                    self.logger.debug("SHUTDOWN command received.")
+                    self.forwardShutdown(msg[0])
+                    self.shutdown()
+                    return
+                if self.debug:
+                    self.recordStats(msg[1])
+                if not self.relay(msg):
+                    self.schedule(msg)
+            self.flushTasks()
+            self.balanceLoad()
+            self.checkState()
+
+    def runThreaded(self):
+        """Relays the replies and shared variables while a separate thread
+        schedules the tasks, until a shutdown message is received."""
+        scheduling_thread = threading.Thread(target=self.runScheduling)
+        scheduling_thread.daemon = True
+        scheduling_thread.start()
+
+        poller = zmq.Poller()
+        poller.register(self.task_socket, zmq.POLLIN)
+        poller.register(self.io_socket, zmq.POLLIN)
+        while True:
+            for socket, _ in poller.poll(-1):
+                if socket is self.io_socket:
+                    # Messages of the scheduling thread for the workers
+                    for frames in self.receivePending(self.io_socket):
+                        try:
+                            self.deliver(frames[1:])
+                        except zmq.ZMQError:
+                            self.io_socket.send_multipart(
+                                [b"", UNDELIVERED] + frames, copy=False)
+                    continue
 
+                for msg in self.receivePending(self.task_socket):
+                    if msg[1] == SHUTDOWN:
+                        self.logger.debug("SHUTDOWN command received.")
+                        self.forwardShutdown(msg[0])
+                        self.io_socket.send_multipart([b"", SHUTDOWN])
+                        scheduling_thread.join()
+                        self.shutdown()
+                        return
+                    with self.state_lock:
+                        relayed = self.relay(msg)
+                    if not relayed:
+                        self.io_socket.send_multipart(msg, copy=False)
+
+    def runScheduling(self):
+        """Schedules the tasks received from the I/O thread until it forwards
+        a shutdown message."""
+        while True:
+            try:
+                self.scheduler_socket.poll(-1)
+                for msg in self.receivePending(self.scheduler_socket):
+                    if msg[1] == SHUTDOWN:
+                        return
+                    if self.debug:
+                        self.recordStats(msg[1])
+                    self.schedule(msg)
+            except zmq.ZMQError:
+                # The broker was shut down by a signal
+                break
+            self.flushTasks()
+            self.balanceLoad()
+            self.checkState()
+
+    def forwardShutdown(self, origin):
+        """Shuts down the fellow brokers, unless the shutdown comes from one of
+        them."""
+        if origin in self.peer_sockets:
+            return
+        for peer_socket in self.peer_sockets.values():
+            peer_socket.send(SHUTDOWN)
+
+    def balanceLoad(self):
+        """Advertises to the fellow brokers the number of tasks the idle
+        workers of this broker can receive, and forwards the queued tasks to
+        the fellow brokers advertising idle workers."""
+        with self.state_lock:
+            peers = list(self.peer_sockets)
+        if not peers:
+            return
+        demand = 0
+        if not self.unassigned_tasks:
+            demand = sum(self.worker_credits.values())
+        # Becoming idle or busy is advertised at once, other changes at most
+        # every TIME_BETWEEN_BROKER_LOADS
+        now = time.time()
+        if demand != self.advertised_demand and (
+                not demand or not self.advertised_demand or
+                now - self.last_load_time > TIME_BETWEEN_BROKER_LOADS):
+            load = pickle.dumps(demand, pickle.HIGHEST_PROTOCOL)
+            for peer in peers:
+                self.sendToWorker([peer, BROKER_LOAD, load])
+            self.advertised_demand = demand
+            self.last_load_time = now
+
+        for peer, peer_demand in self.peer_demand.items():
+            if not self.unassigned_tasks:
+                break
+            if peer_demand <= 0:
+                continue
+            count = min(peer_demand, len(self.unassigned_tasks))
+            tasks = [self.unassigned_tasks.popleft()[0] for _ in range(count)]
+            frames = [peer, BROKER_TASKS, b"".join(FRAME_COUNT.pack(len(task))
+                                                   for _, task in tasks)]
+            for task_id, task in tasks:
+                frames.append(task_id)
+                frames.extend(task)
+            self.sendToWorker(frames)
+            # Until the fellow broker advertises its load again
+            self.peer_demand[peer] = peer_demand - count
             if self.debug:
-                self.stats.append((time.time(),
-                                   msg_type,
-                                   len(self.unassigned_tasks),
-                                   len(self.available_workers)))
-                if time.time() - self.lastDebugTs > TIME_BETWEEN_PARTIALDEBUG:
-                    self.writeDebug("debug/partial-{0}".format(
-                        round(time.time(), -1)
-                    ))
-                    self.lastDebugTs = time.time()
-
-            # New task inbound
-            if msg_type == TASK:
-                task_id = msg[2]
-                task = msg[3]
-                self.logger.debug("Received task {0}".format(task_id))
-                try:
-                    address = self.available_workers.pop()
-                except KeyError:
-                    self.unassigned_tasks.append((task_id, task))
+                self.logger.debug("Forwarded {0} tasks to broker {1}".format(count, peer))
+
+    def recordStats(self, msg_type):
+        """Records the debug statistics of a received message."""
+        self.stats.append((time.time(),
+                           msg_type,
+                           len(self.unassigned_tasks),
+                           len(self.available_workers)))
+
+    def checkState(self):
+        """Periodically checks the workers and writes the debug statistics.
+        Called once per batch of received messages."""
+        now = time.time()
+        # Checking if things are fine with servers and futures
+        if now - self.last_task_check_time > TASK_CHECK_INTERVAL:
+            self.last_task_check_time = now
+            self.checkAssignedTasks()
+
+        if self.debug and now - self.lastDebugTs > TIME_BETWEEN_PARTIALDEBUG:
+            self.writeDebug("debug/partial-{0}".format(round(now, -1)))
+            self.lastDebugTs = now
+
+    def relay(self, msg):
+        """Handles the messages which don't involve the scheduling of tasks:
+        replies, shared variables and configuration. Returns False if msg is
+        not one of them."""
+        msg_type = msg[1]
+        from_peer = msg[0] in self.peer_sockets
+
+        # Answer needing delivery
+        if msg_type == REPLY:
+            if self.debug:
+                self.logger.debug("Relaying")
+            destination = msg[-1]
+            origin = msg[0]
+            try:
+                self.task_socket.send_multipart(
+                    [destination] + msg[1:] + [origin], copy=False
+                )
+            except zmq.ZMQError:
+                # The destination may be served by a fellow broker
+                peer = self.worker_brokers.get(destination)
+                if from_peer or peer is None:
+                    scoop.logger.warning("Failed to relay a reply to address "
+                                         "{0}".format(destination))
                 else:
-                    self.safeTaskSend(address, task_id, task)
-
-            # Request for task
-            elif msg_type == REQUEST:
-                address = msg[0]
-                if address in self.available_workers:
-                    scoop.logger.warning("Future request received from worker"
-                                         " {0} when there already exists an"
-                                         " existing request".format(address))
-                try:
-                    task_id, task = self.unassigned_tasks.popleft()
-                except IndexError:
-                    self.available_workers.add(address)
+                    self.deliver([peer] + msg[1:])
+
+        # Shared variable to distribute
+        elif msg_type == VARIABLE:
+            address = msg[4]
+            # Shared variables are kept, don't hold on the received frame
+            value = bytes(msg[3])
+            key = msg[2]
+            self.shared_variables[address].update(
+                {key: value},
+            )
+            self.info_socket.send_multipart([VARIABLE,
+                                            key,
+                                            value,
+                                            address])
+            if not from_peer:
+                # The variable is now available to every worker
+                self.task_socket.send_multipart([msg[0], VARIABLE_ACK, key])
+                # Share it with the workers of the fellow brokers
+                for peer_socket in self.peer_sockets.values():
+                    peer_socket.send_multipart([VARIABLE, key, value, address])
+
+        # Content of a memory-mapped constant
+        elif msg_type == SEGMENT:
+            digest = msg[2]
+            if digest not in self.segments:
+                segment = self.segments[digest] = bytes(msg[3])
+                for address in self.segment_requests.pop(digest, ()):
+                    self.task_socket.send_multipart([address, SEGMENT,
+                                                     digest, segment])
+                if not from_peer:
+                    for peer_socket in self.peer_sockets.values():
+                        peer_socket.send_multipart([SEGMENT, digest, segment])
+
+        # Worker of a host lacking a memory-mapped constant
+        elif msg_type == FETCH:
+            digest = msg[2]
+            segment = self.segments.get(digest)
+            if segment is not None:
+                if from_peer:
+                    self.peer_sockets[msg[0]].send_multipart(
+                        [SEGMENT, digest, segment]
+                    )
                 else:
-                    self.safeTaskSend(address, task_id, task)
-
-            # A task status set (task ready) is received
-            elif msg_type == STATUS_READY:
-                address = msg[0]
-                task_id = msg[2]
+                    self.task_socket.send_multipart([msg[0], SEGMENT,
+                                                     digest, segment])
+            elif not from_peer:
+                # Sent once it is received, maybe from a fellow broker
+                self.segment_requests[digest].add(msg[0])
+                for peer_socket in self.peer_sockets.values():
+                    peer_socket.send_multipart([FETCH, digest])
+
+        # Measure of the messaging overhead by a worker
+        elif msg_type == PING:
+            self.task_socket.send_multipart([msg[0], PING, msg[2]])
+
+        # Show a new worker that it receives the publications
+        elif msg_type == SUBSCRIBED:
+            self.info_socket.send_multipart([SUBSCRIBED, msg[0]])
+
+        # Initialize the variables of a new worker
+        elif msg_type == INIT:
+            address = msg[0]
+            try:
+                self.processConfig(serializers.loads(msg[2]))
+            except pickle.PickleError:
+                return True
+            self.task_socket.send_multipart([
+                address,
+                pickle.dumps(self.config,
+                             pickle.HIGHEST_PROTOCOL),
+                pickle.dumps(self.shared_variables,
+                             pickle.HIGHEST_PROTOCOL),
+            ])
+
+            self.task_socket.send_multipart([
+                address,
+                pickle.dumps(self.cluster_available,
+                             pickle.HIGHEST_PROTOCOL),
+            ])
+
+            # Route the replies of the fellow brokers toward this worker
+            if address not in self.local_workers:
+                self.local_workers.add(address)
+                for peer_socket in self.peer_sockets.values():
+                    peer_socket.send_multipart([
+                        BROKER_WORKERS,
+                        pickle.dumps([address], pickle.HIGHEST_PROTOCOL),
+                    ])
 
-                try:
-                    self.assigned_tasks[address].discard(task_id)
-                except KeyError:
-                    pass
+        # Workers served by a fellow broker
+        elif msg_type == BROKER_WORKERS:
+            for address in pickle.loads(msg[2]):
+                self.worker_brokers[address] = msg[0]
 
-            elif msg_type == HEARTBEAT:
-                address = msg[0][3:]
-                self.heartbeat_times[address] = time.time()
+        # Future of a worker served here, lost by a fellow broker
+        elif msg_type == RESEND_FUTURE:
+            task_id = serializers.loads(msg[2])
+            try:
+                self.task_socket.send_multipart([task_id[0],
+                                                 RESEND_FUTURE,
+                                                 msg[2]])
+            except zmq.ZMQError:
+                scoop.logger.warning('Could not ask worker {0} to resend '
+                                     'future id {1}'.format(task_id[0],
+                                                            task_id))
 
-            # Answer needing delivery
-            elif msg_type == REPLY:
-                self.logger.debug("Relaying")
-                destination = msg[-1]
-                origin = msg[0]
-                self.task_socket.send_multipart([destination] + msg[1:] + [origin])
-
-            # Shared variable to distribute
-            elif msg_type == VARIABLE:
-                address = msg[4]
-                value = msg[3]
-                key = msg[2]
-                self.shared_variables[address].update(
-                    {key: value},
-                )
-                self.info_socket.send_multipart([VARIABLE,
-                                                key,
-                                                value,
-                                                address])
-
-            # Initialize the variables of a new worker
-            elif msg_type == INIT:
-                address = msg[0]
-                try:
-                    self.processConfig(pickle.loads(msg[2]))
-                except pickle.PickleError:
-                    continue
-                self.task_socket.send_multipart([
-                    address,
-                    pickle.dumps(self.config,
-                                 pickle.HIGHEST_PROTOCOL),
-                    pickle.dumps(self.shared_variables,
-                                 pickle.HIGHEST_PROTOCOL),
-                ])
+        # Add a given broker to its fellow list
+        elif msg_type == CONNECT:
+            try:
+                connect_brokers = serializers.loads(msg[2])
+                if len(msg) > 3:
+                    # Name of this broker known by its fellow brokers
+                    self.federation_name = self.brokerName(
+                        serializers.loads(msg[3])
+                    )
+            except pickle.PickleError:
+                self.logger.error("Could not understand CONNECT message.")
+                return True
+            self.logger.info("Connecting to other brokers...")
+            self.addBrokerList(connect_brokers)
 
-                self.task_socket.send_multipart([
-                    address,
-                    pickle.dumps(self.cluster_available,
-                                 pickle.HIGHEST_PROTOCOL),
-                ])
+        else:
+            return False
+        return True
+
+    def schedule(self, msg):
+        """Handles the messages involving the tasks and the workers."""
+        msg_type = msg[1]
+
+        # New task inbound
+        if msg_type == TASK:
+            task_id = msg[2]
+            task = msg[3:]
+            # Order the queue from the priority and deadline of the header
+            schedule = self.taskSchedule(task[0])
+            if self.debug:
+                self.logger.debug("Received task {0}".format(task_id))
+            self.assignTask(task_id, task, schedule)
 
-            # Add a given broker to its fellow list
-            elif msg_type == CONNECT:
-                try:
-                    connect_brokers = pickle.loads(msg[2])
-                except pickle.PickleError:
-                    self.logger.error("Could not understand CONNECT message.")
-                    continue
-                self.logger.info("Connecting to other brokers...")
-                self.addBrokerList(connect_brokers)
+        # Request for task(s)
+        elif msg_type == REQUEST:
+            address = msg[0]
+            try:
+                credits = serializers.loads(msg[2])
+            except IndexError:
+                # Request without credits count asks for a single task
+                credits = 1
+            self.addCredits(address, credits)
+
+        # Queue length advertised by a worker in work stealing mode
+        elif msg_type == LOAD:
+            address = msg[0]
+            self.worker_loads[address] = serializers.loads(msg[2])
+            # Send idle workers to steal from busy ones
+            for idle in list(self.available_workers):
+                if not self.forwardSteal(idle):
+                    break
+
+        # Stolen futures that could not be sent directly to the thief
+        elif msg_type == STOLEN:
+            thief = msg[-1]
+            self.thieves.pop(thief, None)
+            self.safeTaskSend(thief, msg[2], msg[3:-1], STOLEN)
+
+        # A worker had no future to be stolen
+        elif msg_type == STEAL_EMPTY:
+            self.worker_loads[msg[0]] = 0
+            thief = msg[2]
+            self.addCredits(thief, self.thieves.pop(thief, 1))
+
+        # A task status set (task ready) is received
+        elif msg_type == STATUS_READY:
+            address = msg[0]
+            task_id = msg[2]
 
-            # Shutdown of this broker was requested
-            elif msg_type == SHUTDOWN:
-                self.logger.debug("SHUTDOWN command received.")
-                self.shutdown()
-                break
+            try:
+                self.assigned_tasks[address].discard(task_id)
+            except KeyError:
+                pass
+
+        # Number of tasks the idle workers of a fellow broker can receive
+        elif msg_type == BROKER_LOAD:
+            self.peer_demand[msg[0]] = pickle.loads(msg[2])
+
+        # Tasks forwarded by a fellow broker
+        elif msg_type == BROKER_TASKS:
+            position = 3
+            for index in range(0, len(msg[2]), FRAME_COUNT.size):
+                count, = FRAME_COUNT.unpack_from(msg[2], index)
+                task = msg[position + 1:position + 1 + count]
+                self.assignTask(msg[position], task, self.taskSchedule(task[0]))
+                position += count + 1
+
+        elif msg_type == HEARTBEAT:
+            address = msg[0][3:]
+            self.heartbeat_times[address] = time.time()
+
+        # Message of the scheduling thread the I/O thread couldn't deliver
+        elif msg_type == UNDELIVERED:
+            tag, address, undelivered_type = msg[2:5]
+            if undelivered_type in (TASK, STOLEN):
+                self.requeueTask(address, tag, msg[5:],
+                                 self.taskSchedule(msg[5]))
+            elif undelivered_type == TASKS:
+                position = 6
+                for index, task_id in enumerate(serializers.loads(tag)):
+                    count, = FRAME_COUNT.unpack_from(
+                        msg[5], index * FRAME_COUNT.size
+                    )
+                    task = msg[position:position + count]
+                    self.requeueTask(address, task_id, task,
+                                     self.taskSchedule(task[0]))
+                    position += count
+            elif undelivered_type == STEAL:
+                # Give back its request credits to the thief
+                self.worker_loads.pop(address, None)
+                thief = msg[5]
+                self.addCredits(thief, self.thieves.pop(thief, 1))
+            else:
+                scoop.logger.warning("Failed to deliver a message to address "
+                                     "{0}".format(address))
 
     def checkAssignedTasks(self):
         """
@@ -317,24 +866,35 @@ class Broker(object):
         for address in to_remove:
             # Request resend of the currently lost futures
             for tid_pickled in self.assigned_tasks[address]:
-                task_id = pickle.loads(tid_pickled)
+                task_id = serializers.loads(tid_pickled)
                 try:
-                    self.task_socket.send_multipart([
+                    self.sendToWorker([
                         task_id[0],
                         RESEND_FUTURE,
                         tid_pickled
                     ])
                 except zmq.ZMQError:
+                    # The future may come from a worker of a fellow broker
+                    with self.state_lock:
+                        peer = self.worker_brokers.get(task_id[0])
+                    if peer is not None:
+                        self.sendToWorker([peer, RESEND_FUTURE, tid_pickled])
+                        continue
                     scoop.logger.warning('Could not ask worker {0} to resend future id {1}'
                                          ''.format(task_id[0], task_id))
             self.assigned_tasks.pop(address)
+            self.discardAvailable(address)
+            self.worker_credits.pop(address, None)
+            self.worker_loads.pop(address, None)
+            self.thieves.pop(address, None)
             # Remove all futures generated by the said worker. Because otherwise, these
             # entries will never be cleared as the remote executor does not issue the
             # STATUS_READY signal
             for exec_addr, task_id_pickled_set in self.assigned_tasks.items():
-                task_id_set = set(pickle.loads(task_id) for task_id in task_id_pickled_set)
-                lost_task_ids = set(task_id for task_id in task_id_set if task_id[0] == address)
-                lost_task_ids_pickled = set(pickle.dumps(task_id, protocol=pickle.HIGHEST_PROTOCOL) for task_id in lost_task_ids)
+                lost_task_ids_pickled = set(
+                    task_id for task_id in task_id_pickled_set
+                    if serializers.loads(task_id)[0] == address
+                )
                 task_id_pickled_set.difference_update(lost_task_ids_pickled)
 
         # if to_remove:
@@ -347,6 +907,11 @@ class Broker(object):
     def getPorts(self):
         return (self.t_sock_port, self.info_sock_port)
 
+    def getIPCPaths(self):
+        """Returns the paths of the IPC endpoints of the task and info sockets,
+        None if they aren't bound."""
+        return tuple(self.ipc_paths)
+
     def getName(self):
         import sys
         if sys.version < '3':
@@ -366,6 +931,8 @@ class Broker(object):
         time.sleep(0.1)
 
         self.context.destroy(1000)
+        for path in self.ipc_paths:
+            utils.unlinkIPC(path)
 
         # Write down statistics about this run if asked
         if self.debug:
@@ -15,8 +15,44 @@
 #    License along with SCOOP. If not, see <http://www.gnu.org/licenses/>.
 #
 from collections import namedtuple
+import heapq
+import itertools
 
+# The IPC endpoints of the broker sockets are reached by the processes of its
+# host, see utils.bindIPC
 BrokerInfo = namedtuple('BrokerInfo', ['hostname',
                                        'task_port',
                                        'info_port',
-                                       'externalHostname'])
\ No newline at end of file
+                                       'externalHostname',
+                                       'task_ipc',
+                                       'info_ipc'])
+BrokerInfo.__new__.__defaults__ = (None, None)
+
+
+class TaskQueue(object):
+    """Tasks waiting for a worker. Tasks are ordered by decreasing priority,
+    then by earliest deadline, then by arrival order."""
+    def __init__(self):
+        self.heap = []
+        self.arrival = itertools.count()
+
+    def append(self, task, schedule=None):
+        """Queue a (task_id_pickled, task_pickled) tuple. schedule is the
+        (priority, deadline) tuple of the task, if any."""
+        priority, deadline = schedule or (0, None)
+        if deadline is None:
+            deadline = float("inf")
+        heapq.heappush(self.heap, (-priority, deadline, next(self.arrival),
+                                   task, schedule))
+
+    def popleft(self):
+        """Remove and return the next (task, schedule) tuple to assign."""
+        entry = heapq.heappop(self.heap)
+        return entry[3], entry[4]
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __bool__(self):
+        return bool(self.heap)
+    __nonzero__ = __bool__
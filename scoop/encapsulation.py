@@ -14,8 +14,13 @@
 #    You should have received a copy of the GNU Lesser General Public
 #    License along with SCOOP. If not, see <http://www.gnu.org/licenses/>.
 #
+import errno
+import hashlib
 import marshal
+import mmap
+import struct
 import tempfile
+import time
 import types
 import os
 from inspect import ismodule
@@ -36,6 +41,7 @@ except ImportError:
     from types import FileType as FileType
 
 import scoop
+from . import utils
 
 
 def functionFactory(in_code, name, defaults, globals_, imports):
@@ -83,16 +89,186 @@ class FunctionEncapsulation(object):
     def __name__(self):
         return self.name
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_function', None)
+        return state
+
     def getFunction(self):
         """Called by remote workers. Useful to populate main module globals()
-        for interactive shells. Retrieves the serialized function."""
-        return functionFactory(
+        for interactive shells. Retrieves the serialized function, which is
+        only rebuilt on the first call."""
+        try:
+            return self._function
+        except AttributeError:
+            pass
+        self._function = functionFactory(
             self.code,
             self.name,
             self.defaults,
             self.globals,
             self.imports,
         )
+        return self._function
+
+
+class CallableEncapsulation(object):
+    """Encapsulates a serialized callable object.
+
+    This is used by the communicators to send large callables (callable
+    objects and functions closing over heavy data) once to every worker as a
+    shared constant named by their digest. Futures then only hold a reference
+    to this constant. The callable is deserialized on demand."""
+    def __init__(self, data):
+        self.data = data
+
+    def getCallable(self):
+        from scoop._comm import serializers
+        return serializers.loads(self.data)
+
+
+# Layout of the memory-mapped segments: the number of frames, then the offset
+# and length of every frame. Frames are aligned for the arrays using them.
+SEGMENT_COUNT = struct.Struct("!Q")
+SEGMENT_FRAME = struct.Struct("!QQ")
+SEGMENT_ALIGNMENT = 64
+# Milliseconds between the checks of a segment being fetched
+SEGMENT_POLLING_TIME = 10
+
+
+def segmentDirectory():
+    """Returns the directory holding the memory-mapped segments of the pool on
+    this host."""
+    return utils.runDirectory()
+
+
+def _writeSegment(path, chunks):
+    """Atomically writes the chunks to the segment file path."""
+    temporaryPath = "{0}.{1}".format(path, os.getpid())
+    with open(temporaryPath, "wb") as fhdl:
+        for chunk in chunks:
+            fhdl.write(chunk)
+    os.rename(temporaryPath, path)
+
+
+class MappedEncapsulation(object):
+    """Encapsulates a large object in a file mapped in memory by the workers.
+
+    This is used by the sharing module (setConst) for objects whose
+    serialization exceeds scoop.SHARED_MEMORY_THRESHOLD. The file is written
+    in the segment directory of the host of the worker which set the
+    constant, and only its digest is published to the other workers. Its
+    content is sent once to the broker, from which a single worker of every
+    other host fetches it on first access. Every worker of a host maps the
+    file read-only: buffers serialized out-of-band (NumPy arrays,
+    pickle.PickleBuffer, ...) are used from the mapping without copy."""
+    def __init__(self, frames):
+        """Writes the frames given by serializers.dumpsFrames to a segment"""
+        frames = [memoryview(frame).cast("B") for frame in frames]
+        digest = hashlib.sha1()
+        for frame in frames:
+            digest.update(frame)
+        self.digest = digest.hexdigest()
+        self._mapping = None
+        if not os.path.exists(self.path):
+            _writeSegment(self.path, self._layout(frames))
+
+    @staticmethod
+    def _layout(frames):
+        """Generates the chunks of the segment holding frames."""
+        offset = SEGMENT_COUNT.size + SEGMENT_FRAME.size * len(frames)
+        entries, paddings = [], []
+        for frame in frames:
+            padding = -offset % SEGMENT_ALIGNMENT
+            paddings.append(b"\0" * padding)
+            entries.append(SEGMENT_FRAME.pack(offset + padding, frame.nbytes))
+            offset += padding + frame.nbytes
+        yield SEGMENT_COUNT.pack(len(frames))
+        for entry in entries:
+            yield entry
+        for padding, frame in zip(paddings, frames):
+            yield padding
+            yield frame
+
+    @property
+    def path(self):
+        return os.path.join(segmentDirectory(), self.digest)
+
+    def _map(self):
+        if self._mapping is None:
+            if not os.path.exists(self.path):
+                self._fetch()
+            with open(self.path, "rb") as fhdl:
+                self._mapping = mmap.mmap(fhdl.fileno(), 0,
+                                          access=mmap.ACCESS_READ)
+        return self._mapping
+
+    def _fetch(self):
+        """Writes the segment fetched from the broker. A single worker of the
+        host fetches it, the others wait for its file, unless it doesn't
+        appear within TIME_BEFORE_FETCHING_SEGMENT seconds."""
+        from scoop import _control
+        socket = _control.execQueue.socket
+        try:
+            os.close(os.open(self.path + ".lock",
+                             os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            # Fetched by another worker of this host
+            fetchTime = time.time() + scoop.TIME_BEFORE_FETCHING_SEGMENT
+        else:
+            fetchTime = time.time()
+        while not os.path.exists(self.path):
+            segment = socket.segments.pop(self.digest, None)
+            if segment is not None:
+                _writeSegment(self.path, [segment])
+                break
+            if fetchTime is not None and time.time() >= fetchTime:
+                socket.sendFetch(self.digest)
+                fetchTime = None
+            socket._poll(SEGMENT_POLLING_TIME)
+            _control.execQueue.updateQueue()
+
+    def getSegment(self):
+        """Returns the content of the segment, sent to the broker."""
+        return self._map()
+
+    def __getstate__(self):
+        # The content is fetched from the broker by the other hosts
+        return {'digest': self.digest}
+
+    def __setstate__(self, state):
+        self.digest = state['digest']
+        self._mapping = None
+
+    def getObject(self):
+        """Deserializes the object from the read-only mapping of its
+        segment."""
+        # Not relative: convertVariable updates the globals of this module
+        from scoop._comm import serializers
+        view = memoryview(self._map())
+        count, = SEGMENT_COUNT.unpack_from(view, 0)
+        frames = []
+        for index in range(count):
+            offset, length = SEGMENT_FRAME.unpack_from(
+                view, SEGMENT_COUNT.size + SEGMENT_FRAME.size * index
+            )
+            frames.append(view[offset:offset + length])
+        return serializers.loadsFrames(frames, copy=False)
+
+
+def mapIfLarge(obj):
+    """Returns a MappedEncapsulation of obj if its serialization exceeds
+    scoop.SHARED_MEMORY_THRESHOLD, obj otherwise."""
+    from scoop._comm import serializers
+    threshold = scoop.SHARED_MEMORY_THRESHOLD
+    if threshold is None:
+        return obj
+    frames = serializers.dumpsFrames(obj)
+    if sum(memoryview(frame).nbytes for frame in frames) < threshold:
+        return obj
+    return MappedEncapsulation(frames)
 
 
 class ExternalEncapsulation(object):
@@ -46,7 +46,8 @@ def ensureScoopStartedProperlyMapFallback(func):
                     RuntimeWarning
                 )
                 ensureScoopStartedProperlyMapFallback.already = True
-            return map(*args, **kwargs)
+            # The builtin map() does not support SCOOP's keyword arguments
+            return map(*args)
         return func(*args, **kwargs)
     return wrapper
 
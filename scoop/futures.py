@@ -16,12 +16,17 @@
 #
 import os
 import sys
+import math
 from inspect import ismethod
-from collections import namedtuple, Iterable
+from collections import namedtuple, deque, Iterable
 from functools import reduce
 import itertools
 import copy
 import time
+try:
+    from itertools import izip
+except ImportError:
+    izip = zip
 
 import scoop
 from ._types import Future, CallbackType
@@ -69,7 +74,7 @@ def _startup(rootFuture, *args, **kargs):
     return result
 
 
-def _mapFuture(callable_, *iterables):
+def _mapFuture(callable_, *iterables, **kwargs):
     """Similar to the built-in map function, but each of its
     iteration will spawn a separate independent parallel Future that will run
     either locally or remotely as `callable(*args)`.
@@ -79,6 +84,7 @@ def _mapFuture(callable_, *iterables):
     :param iterables: A tuple of iterable objects; each will be zipped
         to form an iterable of arguments tuples that will be passed to the
         callable object as a separate Future.
+    :param kwargs: The reserved keywords of submit given to every Future.
 
     :returns: A list of Future objects, each corresponding to an iteration of
         map.
@@ -89,17 +95,163 @@ def _mapFuture(callable_, *iterables):
     either wait for or join with the spawned Futures. See functions waitAny,
     waitAll, or joinAll. Alternatively, You may also use functions mapWait or
     mapJoin that will wait or join before returning."""
+    callable_ = _shareMapCallable(callable_)
     childrenList = []
     for args in zip(*iterables):
-        childrenList.append(submit(callable_, *args))
+        childrenList.append(submit(callable_, *args, **kwargs))
     return childrenList
 
+
+def _mapChunk(callable_, chunk):
+    """Executes `callable(*args)` for every arguments tuple of a chunk and
+    returns the list of results. Used as the callable of chunked map Futures.
+
+    The mean execution time per element is recorded in the execution statistics
+    of the mapped callable so the automatic chunk size can adapt to it."""
+    startTime = time.time()
+    results = [callable_(*args) for args in chunk]
+    if chunk and hasattr(callable_, '__name__'):
+        control.execStats[hash(callable_)].appendleft(
+            (time.time() - startTime) / len(chunk)
+        )
+    return results
+
+
+def _getChunksize(callable_, chunksize, length):
+    """Returns the number of arguments tuples to pack in a single Future.
+
+    :param callable_: The mapped callable object.
+    :param chunksize: The requested chunk size. If None, it is computed from
+        the size of the worker pool, the execution statistics of callable_ and
+        the measured overhead of a remote execution.
+    :param length: The total number of arguments tuples to map.
+
+    Chunks of short iterations are made long enough for the overhead to stay
+    under 1/GRANULARITY_FACTOR of their execution time, while iterations
+    lasting longer than that are distributed one per Future."""
+    if chunksize is not None:
+        return max(1, int(chunksize))
+    # Without statistics, give a few chunks to every worker of the pool
+    chunksize = length / (4. * max(scoop.SIZE, 1))
+    stats = control.execStats.get(hash(callable_))
+    if stats is not None:
+        median = stats.median()
+        if 0 < median < float("inf"):
+            chunksize = min(chunksize,
+                            int(scoop.CHUNK_TARGET_TIME / median))
+            overhead = scoop.GRANULARITY_FACTOR * control.messagingOverhead()
+            chunksize = max(chunksize, overhead / median)
+    if chunksize == float("inf"):
+        # Unknown length (lazy map) without statistics
+        return 1
+    return max(1, int(math.ceil(chunksize)))
+
+
+def _isInlined(callable_, chunksize, length):
+    """Tells if the automatic chunk size of callable_ would pack the whole map
+    in a single Future, in which case it is cheaper to execute it serially in
+    the calling Future."""
+    if chunksize is not None or length == 0:
+        return False
+    stats = control.execStats.get(hash(callable_))
+    return (stats is not None
+            and stats.median() < float("inf")
+            and _getChunksize(callable_, None, length) >= length)
+
+
+def _mapInlineGenerator(callable_, argsList):
+    """Generator function executing a whole map serially in the calling
+    Future."""
+    for result in _mapChunk(callable_, argsList):
+        yield result
+
+
+def _mapChunkedFuture(callable_, chunksize, *iterables, **kwargs):
+    """Similar to _mapFuture, but the arguments tuples are packed by groups of
+    `chunksize` elements, each group being executed by a single Future.
+
+    :param callable_: Any callable object (function or class object with
+        *__call__* method); this object will be called on every element of the
+        chunks.
+    :param chunksize: The number of arguments tuples per Future. If None, it
+        is determined automatically (see _getChunksize).
+    :param iterables: A tuple of iterable objects; each will be zipped
+        to form an iterable of arguments tuples.
+    :param kwargs: The reserved keywords of submit given to every Future.
+
+    :returns: A list of Future objects, each returning a list of results."""
+    argsList = list(zip(*iterables))
+    chunksize = _getChunksize(callable_, chunksize, len(argsList))
+    callable_ = _shareMapCallable(callable_)
+    childrenList = []
+    for index in range(0, len(argsList), chunksize):
+        childrenList.append(submit(_mapChunk,
+                                   callable_,
+                                   argsList[index:index + chunksize],
+                                   **kwargs))
+    return childrenList
+
+
+def _mapWindowGenerator(callable_, window, chunksize, ordered, *iterables,
+                        **kwargs):
+    """Generator function lazily mapping callable_ over the iterables while
+    keeping at most `window` Futures in flight.
+
+    Arguments tuples are pulled from the iterables only when a result is
+    drained, so the iterables may be infinite or larger than memory. A
+    completed Future is forgotten as soon as its results are yielded.
+
+    :param window: The maximum number of Futures pending at once.
+    :param chunksize: The number of iterations executed by each Future. If
+        None, it is determined from the execution statistics of callable_.
+    :param ordered: If True, results are yielded in the order of the
+        iterables, otherwise as soon as they are available.
+    :param kwargs: The reserved keywords of submit given to every Future."""
+    argsIterator = izip(*iterables)
+    if chunksize != 1:
+        chunksize = _getChunksize(callable_, chunksize, float("inf"))
+    callable_ = _shareMapCallable(callable_)
+    if chunksize == 1:
+        tasks = (submit(callable_, *args, **kwargs) for args in argsIterator)
+    else:
+        chunks = iter(lambda: list(itertools.islice(argsIterator, chunksize)),
+                      [])
+        tasks = (submit(_mapChunk, callable_, chunk, **kwargs)
+                 for chunk in chunks)
+
+    pending = deque(itertools.islice(tasks, max(1, int(window))))
+    while pending:
+        if ordered:
+            future = pending.popleft()
+            next(_waitAny(future))
+        else:
+            future = next(_waitAny(*pending))
+            pending.remove(future)
+        # Refill the window before handing the results to the caller
+        pending.extend(itertools.islice(tasks, 1))
+        results = future.resultValue
+        del future
+        if chunksize == 1:
+            yield results
+        else:
+            for result in results:
+                yield result
+
+
 def _mapGenerator(futures):
     """Generator function that iterates through the results in-order."""
     for future in _waitAll(*futures):
         yield future.resultValue
 
 
+def _mapChunkedGenerator(futures):
+    """Generator function that iterates through the results of chunked
+    Futures in-order."""
+    for future in _waitAll(*futures):
+        for result in future.resultValue:
+            yield result
+
+
 @ensureScoopStartedProperlyMapFallback
 def map(func, *iterables, **kwargs):
     """map(func, *iterables)
@@ -122,12 +274,34 @@ def map(func, *iterables, **kwargs):
         separate Future.
     :param timeout: The maximum number of seconds to wait. If None, then there
         is no limit on the wait time.
+    :param chunksize: The number of iterations executed by each Future.
+        Packing many small iterations together lowers the communication
+        overhead. If None, a chunk size is determined automatically from the
+        pool size and the execution statistics of func. Defaults to 1.
+    :param window: If given, the map is lazy: at most this number of Futures
+        are in flight at once and the iterables are consumed only as results
+        are retrieved. Defaults to None, submitting every Future at once.
+    :param threaded: If True, the Futures are executed by the threads of the
+        workers. See :meth:`~scoop.futures.submit`. Defaults to False.
 
     :returns: A generator of map results, each corresponding to one map
         iteration."""
     # TODO: Handle timeout
-    futures = _mapFuture(func, *iterables)
-    return _mapGenerator(futures)
+    chunksize = kwargs.get('chunksize', 1)
+    window = kwargs.get('window')
+    options = {'threaded': kwargs.get('threaded', False)}
+    if window is not None:
+        return _mapWindowGenerator(func, window, chunksize, True, *iterables,
+                                   **options)
+    if chunksize is None:
+        argsList = list(zip(*iterables))
+        if _isInlined(func, chunksize, len(argsList)):
+            return _mapInlineGenerator(func, argsList)
+        iterables = zip(*argsList)
+    if chunksize == 1:
+        return _mapGenerator(_mapFuture(func, *iterables, **options))
+    return _mapChunkedGenerator(_mapChunkedFuture(func, chunksize, *iterables,
+                                                  **options))
 
 
 def map_as_completed(func, *iterables, **kwargs):
@@ -143,16 +317,57 @@ def map_as_completed(func, *iterables, **kwargs):
         separate Future.
     :param timeout: The maximum number of seconds to wait. If None, then there
         is no limit on the wait time.
+    :param chunksize: The number of iterations executed by each Future. See
+        :meth:`~scoop.futures.map`. Results of a chunk are yielded together, in
+        their order within the chunk.
+    :param window: The maximum number of Futures in flight, pulling the
+        iterables lazily. See :meth:`~scoop.futures.map`.
+    :param threaded: If True, the Futures are executed by the threads of the
+        workers. See :meth:`~scoop.futures.submit`.
 
     :returns: A generator of map results, each corresponding to one map
         iteration."""
     # TODO: Handle timeout
-    for future in as_completed(_mapFuture(func, *iterables)):
-        yield future.resultValue
+    chunksize = kwargs.get('chunksize', 1)
+    window = kwargs.get('window')
+    options = {'threaded': kwargs.get('threaded', False)}
+    if chunksize is None and window is None:
+        argsList = list(zip(*iterables))
+        if _isInlined(func, chunksize, len(argsList)):
+            for result in _mapInlineGenerator(func, argsList):
+                yield result
+            return
+        iterables = zip(*argsList)
+    if window is not None:
+        for result in _mapWindowGenerator(func, window, chunksize, False,
+                                          *iterables, **options):
+            yield result
+    elif chunksize == 1:
+        for future in as_completed(_mapFuture(func, *iterables, **options)):
+            yield future.resultValue
+    else:
+        chunks = _mapChunkedFuture(func, chunksize, *iterables, **options)
+        for future in as_completed(chunks):
+            for result in future.resultValue:
+                yield result
+
+
+def _reduceChunk(mapFunc, reductionFunc, scan, *iterables):
+    """Maps and reduces a leaf of the reduction tree serially. Returns the
+    single mapped value if the leaf contains only one element."""
+    results = [mapFunc(*args) for args in zip(*iterables)]
+    if len(results) == 1:
+        return results[0]
+    if scan:
+        for index in range(1, len(results)):
+            results[index] = reductionFunc(results[index - 1], results[index])
+        return results
+    return reduce(reductionFunc, results)
 
 
-def _recursiveReduce(mapFunc, reductionFunc, scan, *iterables):
-    """Generates the recursive reduction tree. Used by mapReduce."""
+def _recursiveReduce(mapFunc, reductionFunc, scan, chunksize, *iterables):
+    """Generates the recursive reduction tree. Used by mapReduce.
+    Leaves containing at most `chunksize` elements are computed serially."""
     if iterables:
         half = min(len(x) // 2 for x in iterables)
         data_left = [list(x)[:half] for x in iterables]
@@ -164,15 +379,21 @@ def _recursiveReduce(mapFunc, reductionFunc, scan, *iterables):
     out_futures = [None, None]
     out_results = [None, None]
     for index, data in enumerate([data_left, data_right]):
-        if any(len(x) <= 1 for x in data):
-            out_results[index] = mapFunc(*list(zip(*data))[0])
+        if any(len(x) <= chunksize for x in data):
+            out_results[index] = _reduceChunk(mapFunc,
+                                              reductionFunc,
+                                              scan,
+                                              *data)
         else:
+            # Deeper subtrees go first to complete the pending reductions
             out_futures[index] = submit(
                 _recursiveReduce,
                 mapFunc,
                 reductionFunc,
                 scan,
-                *data
+                chunksize,
+                *data,
+                priority=control.current.priority + 1
             )
 
     # Wait for the results
@@ -196,6 +417,26 @@ def _recursiveReduce(mapFunc, reductionFunc, scan, *iterables):
     return reductionFunc(*out_results)
 
 
+def _submitReduction(mapFunc, reductionFunc, scan, chunksize, *iterables):
+    """Submits the root of the reduction tree and waits for its result. Used by
+    mapReduce and mapScan."""
+    iterables = [list(x) for x in iterables]
+    if chunksize != 1:
+        length = min(len(x) for x in iterables) if iterables else 0
+        if _isInlined(mapFunc, chunksize, length):
+            result = _reduceChunk(mapFunc, reductionFunc, scan, *iterables)
+            return [result] if scan and length == 1 else result
+        chunksize = _getChunksize(mapFunc, chunksize, length)
+    return submit(
+        _recursiveReduce,
+        _shareMapCallable(mapFunc),
+        _shareMapCallable(reductionFunc),
+        scan,
+        chunksize,
+        *iterables
+    ).result()
+
+
 @ensureScoopStartedProperly
 def mapScan(mapFunc, reductionFunc, *iterables, **kwargs):
     """Exectues the :meth:`~scoop.futures.map` function and then applies a
@@ -214,16 +455,14 @@ def mapScan(mapFunc, reductionFunc, *iterables, **kwargs):
         separate Future.
     :param timeout: The maximum number of seconds to wait. If None, then there
         is no limit on the wait time.
+    :param chunksize: The number of elements mapped and reduced serially by
+        each leaf of the reduction tree. If None, it is determined
+        automatically (see :meth:`~scoop.futures.map`). Defaults to 1.
 
     :returns: Every return value of the reduction function applied to every
               mapped data sequentially ordered."""
-    return submit(
-        _recursiveReduce,
-        mapFunc,
-        reductionFunc,
-        True,
-        *iterables
-    ).result()
+    return _submitReduction(mapFunc, reductionFunc, True,
+                            kwargs.get('chunksize', 1), *iterables)
 
 
 @ensureScoopStartedProperly
@@ -245,26 +484,17 @@ def mapReduce(mapFunc, reductionFunc, *iterables, **kwargs):
         separate Future.
     :param timeout: The maximum number of seconds to wait. If None, then there
         is no limit on the wait time.
+    :param chunksize: The number of elements mapped and reduced serially by
+        each leaf of the reduction tree. If None, it is determined
+        automatically (see :meth:`~scoop.futures.map`). Defaults to 1.
 
     :returns: A single value."""
-    return submit(
-        _recursiveReduce,
-        mapFunc,
-        reductionFunc,
-        False,
-        *iterables
-    ).result()
-
-
-def _createFuture(func, *args, **kwargs):
-    """Helper function to create a future."""
-    assert callable(func), (
-        "The provided func parameter is not a callable."
-    )
+    return _submitReduction(mapFunc, reductionFunc, False,
+                            kwargs.get('chunksize', 1), *iterables)
 
-    if scoop.IS_ORIGIN and "SCOOP_WORKER" not in sys.modules:
-        sys.modules["SCOOP_WORKER"] = sys.modules["__main__"]
 
+def _shareCallable(func):
+    """Helper function returning a picklable reference to func."""
     # If function is a lambda or class method, share it (or its parent object)
     # beforehand
     lambdaType = type(lambda: None)
@@ -275,6 +505,28 @@ def _createFuture(func, *args, **kwargs):
     if funcIsLambda or funcIsMethod:
         from .shared import SharedElementEncapsulation
         func = SharedElementEncapsulation(func)
+    return func
+
+
+def _shareMapCallable(func):
+    """Helper function returning a picklable reference to func, used by every
+    Future of a map. A large callable (callable object, function closing over
+    heavy data) is serialized once here and shared with the workers instead
+    of being serialized with every Future."""
+    from .shared import _shareLargeCallable
+    return _shareLargeCallable(_shareCallable(func))
+
+
+def _createFuture(func, *args, **kwargs):
+    """Helper function to create a future."""
+    assert callable(func), (
+        "The provided func parameter is not a callable."
+    )
+
+    if scoop.IS_ORIGIN and "SCOOP_WORKER" not in sys.modules:
+        sys.modules["SCOOP_WORKER"] = sys.modules["__main__"]
+
+    func = _shareCallable(func)
 
     return Future(control.current.id, func, *args, **kwargs)
 
@@ -289,7 +541,17 @@ def submit(func, *args, **kwargs):
     :param args: A tuple of positional arguments that will be passed to the
         func object.
     :param kwargs: A dictionary of additional arguments that will be passed to
-        the func object.
+        the func object, except for the following reserved keywords.
+    :param priority: Queued Futures of higher priority are executed first.
+        Defaults to the priority of the calling Future (0 for the root Future).
+    :param deadline: Number of seconds after which the Future should have
+        started. Among Futures of equal priority, the earliest deadline is
+        executed first. Defaults to the deadline of the calling Future, if any.
+    :param threaded: If True, the Future is executed by a thread of the worker
+        when workers are started with ``--threads-per-worker``, letting the
+        worker execute other Futures meanwhile. Meant for I/O-bound callables
+        or calls releasing the GIL, which must not spawn Futures themselves.
+        Defaults to False.
 
     :returns: A future object for retrieving the Future result.
 
@@ -298,9 +560,19 @@ def submit(func, *args, **kwargs):
     may carry on with any further computations while the Future completes.
     Result retrieval is made via the :meth:`~scoop._types.Future.result`
     function on the Future."""
+    parent = control.futureDict[control.current.id]
+    priority = kwargs.pop('priority', parent.priority)
+    deadline = kwargs.pop('deadline', None)
+    threaded = kwargs.pop('threaded', False)
     child = _createFuture(func, *args, **kwargs)
+    child.priority = priority
+    child.threaded = threaded
+    if deadline is not None:
+        child.deadline = time.time() + deadline
+    else:
+        child.deadline = parent.deadline
 
-    control.futureDict[control.current.id].children[child] = None
+    parent.children[child] = None
     control.execQueue.append_init(child)
     return child
 
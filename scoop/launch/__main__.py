@@ -19,25 +19,40 @@
 workers using the scoop.bootstrap module. It can detect the number of cores on
 the machine and simplify the SSH command.
 
+With --forkServer, SCOOP (and with --forkServer=module, the user module) is
+imported once and the workers are forked from this process instead of starting
+a new interpreter each. With --tree, the hosts encoded in its value are
+launched from this host, each one launching in turn a part of them. With
+--reportAs, a line tells the launcher once the workers are started.
+
 Usage:
-python -m scoop.launch [nb_to_launch] [arguments to the bootstrap module]"""
+python -m scoop.launch [nb_to_launch] [verbosity] [--forkServer=scoop|module]
+[--tree=hosts] [--reportAs=hostname] [arguments to the bootstrap module]"""
 
 import sys
 import os
-from subprocess import Popen
+import signal
+import multiprocessing
+from subprocess import Popen, PIPE
 
-from scoop.utils import getCPUcount
+from scoop.utils import (getCPUcount, RUN_DIRECTORY_ENV, createRunDirectory,
+                         removeRunDirectory)
+from scoop.launch.constants import LAUNCHED_MARKER
+from scoop.launch.workerLaunch import decodeTree, splitTree, treeCommand
 
 import atexit
 
 
 BOOTSTRAP_MODULE = 'scoop.bootstrap.__main__'
+# Options of this module, given before the arguments of the bootstrap module
+LAUNCH_OPTIONS = ('forkServer', 'tree', 'reportAs')
 
 
 def getArgs():
     """Gets the arguments of the program.
     Returns a tuple containting:
-    (qty to launch, arguments to pass to the bootstrap module)."""
+    (qty to launch, verbosity, dictionary of the LAUNCH_OPTIONS given,
+    arguments to pass to the bootstrap module)."""
     try:
         nb_to_launch = int(sys.argv[1])
     except:
@@ -51,22 +66,89 @@ def getArgs():
     except:
         verbosity = 3
 
-    return nb_to_launch, verbosity, sys.argv[3:]
+    args = sys.argv[3:]
+    options = {}
+    while args and args[0].startswith("--") and \
+            args[0][2:].split("=", 1)[0] in LAUNCH_OPTIONS:
+        name, value = args.pop(0)[2:].split("=", 1)
+        options[name] = value
+
+    return nb_to_launch, verbosity, options, args
+
+
+def launchTree(tree):
+    """Launch by ssh the hosts encoded in tree, each one launching in turn its
+    own descendants."""
+    ssh, fanout, hosts = decodeTree(tree)
+    for entry, descendants in splitTree(hosts, fanout):
+        sshProcesses.append(Popen(
+            ssh + [entry[0], treeCommand(entry, ssh, fanout, descendants)],
+            stdin=PIPE,
+        ))
+
+
+def preloadModules(args, userModule):
+    """Import once the modules of the workers, forked afterwards from this
+    process. The user module is imported if userModule."""
+    from scoop.bootstrap.__main__ import Bootstrap, importFunction
+    # Imports zmq and greenlet
+    from scoop import futures, _control
+
+    if not userModule:
+        return
+    bootstrap = Bootstrap()
+    bootstrap.parse(args)
+    if not bootstrap.args.executable:
+        return
+    if bootstrap.args.workingDirectory:
+        os.chdir(bootstrap.args.workingDirectory)
+    sys.path.append(os.path.dirname(os.path.abspath(
+        bootstrap.args.executable
+    )))
+    argv = sys.argv
+    sys.argv = sys.argv[:1] + bootstrap.args.args
+    try:
+        importFunction("SCOOP_WORKER", bootstrap.args.executable)
+    except Exception as e:
+        # Every worker imports it and reports the error
+        sys.stderr.write("Could not preload {0}: {1}\n".format(
+            bootstrap.args.executable, e,
+        ))
+        sys.modules.pop("SCOOP_WORKER", None)
+    finally:
+        sys.argv = argv
 
 
 def cleanupBootstraps():
-    """Perform a cleanup (terminate) of the children processes."""
-    for p in processes:
+    """Perform a cleanup (terminate) of the children processes and remove the
+    files of the pool on this host."""
+    for p in processes + sshProcesses:
         try:
             p.terminate()
         except OSError:
             pass
+    if runDirectory is not None:
+        removeRunDirectory(runDirectory)
+
+
+def terminate(signum, frame):
+    """Run the cleanup when the launcher terminates this process."""
+    sys.exit(128 + signum)
+
+
+def wait(process):
+    """Wait for a worker subprocess or forked process to terminate."""
+    if isinstance(process, Popen):
+        process.wait()
+    else:
+        process.join()
 
 
 def launchBootstraps():
     """Launch the bootstrap instances in separate subprocesses"""
-    global processes
-    worker_amount, verbosity, args = getArgs()
+    global processes, runDirectory
+    worker_amount, verbosity, options, args = getArgs()
+    forkServer = options.get('forkServer')
     was_origin = False
 
     if verbosity >= 1:
@@ -78,12 +160,30 @@ def launchBootstraps():
         sys.stderr.flush()
 
     processes = []
+    # Files of the workers of this host, see utils.runDirectory
+    runDirectory = createRunDirectory()
+    os.environ[RUN_DIRECTORY_ENV] = runDirectory
+    # Spread the launch to the descendant hosts first
+    if 'tree' in options:
+        launchTree(options['tree'])
+    if forkServer:
+        preloadModules(args, forkServer == "module")
+        from scoop.bootstrap.__main__ import runForked
+        context = multiprocessing.get_context("fork")
     for _ in range(worker_amount):
-        command = [sys.executable, "-m", BOOTSTRAP_MODULE] + args
-        if verbosity >= 3:
-            sys.stderr.write("Executing '{0}'...\n".format(command))
-            sys.stderr.flush()
-        processes.append(Popen(command))
+        if forkServer:
+            if verbosity >= 3:
+                sys.stderr.write("Forking '{0}'...\n".format(args))
+                sys.stderr.flush()
+            worker = context.Process(target=runForked, args=(args[:],))
+            worker.start()
+            processes.append(worker)
+        else:
+            command = [sys.executable, "-m", BOOTSTRAP_MODULE] + args
+            if verbosity >= 3:
+                sys.stderr.write("Executing '{0}'...\n".format(command))
+                sys.stderr.flush()
+            processes.append(Popen(command))
 
         # Only have a single origin
         try:
@@ -93,20 +193,29 @@ def launchBootstraps():
         else:
             was_origin = True
 
+    signal.signal(signal.SIGTERM, terminate)
+
+    if 'reportAs' in options:
+        sys.stdout.write("{0}{1}\n".format(LAUNCHED_MARKER,
+                                           options['reportAs']))
+        sys.stdout.flush()
+
     if was_origin:
         # Only wait on the origin, this will return and notify the launcher
         # the the job has finished and start the cleanup phase
         try:
-            processes[0].wait()
+            wait(processes[0])
         except KeyboardInterrupt:
             pass
     else:
         for p in processes:
-            p.wait()
+            wait(p)
 
 
 if __name__ == "__main__":
     processes = []
+    sshProcesses = []
+    runDirectory = None
     try:
         launchBootstraps()
     finally:
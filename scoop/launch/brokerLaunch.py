@@ -27,24 +27,29 @@ except ImportError:
 
 import scoop
 from .constants import BASE_SSH, BASE_RSH
+from .._comm.scoopmessages import CONNECT
 try:
     import psutil
 except ImportError:
     psutil = None
 
-def createBrokerAndRun(BrokerClass, connection_namespace, connection_event, debug):
-    localBroker = BrokerClass(debug=debug)
+def createBrokerAndRun(BrokerClass, connection_namespace, connection_event,
+                       debug, brokerOptions):
+    localBroker = BrokerClass(debug=debug, **brokerOptions)
     connection_namespace.brokerPort, \
         connection_namespace.infoPort = localBroker.getPorts()
+    connection_namespace.ipcPaths = localBroker.getIPCPaths()
     connection_event.set()
     localBroker.run()
 
 class localBroker(object):
-    def __init__(self, debug, nice=0, backend='ZMQ'):
+    def __init__(self, debug, nice=0, backend='ZMQ', ioThread=False):
         """Starts a broker on random unoccupied ports"""
         self.backend = backend
+        brokerOptions = {}
         if backend == 'ZMQ':
             from ..broker.brokerzmq import Broker
+            brokerOptions['ioThread'] = ioThread
         else:
             from ..broker.brokertcp import Broker
         if nice:
@@ -62,7 +67,8 @@ class localBroker(object):
                                               args=(Broker,
                                                     self.connection_namespace,
                                                     self.connection_event,
-                                                    debug))
+                                                    debug,
+                                                    brokerOptions))
         self.broker.daemon = True
         self.broker.start()
 
@@ -70,12 +76,14 @@ class localBroker(object):
 
         self.brokerPort = self.connection_namespace.brokerPort
         self.infoPort = self.connection_namespace.infoPort
+        self.ipcPaths = self.connection_namespace.ipcPaths
         scoop.logger.debug("Local broker launched on ports {0}, {1}"
                           ".".format(self.brokerPort, self.infoPort))
 
-    def sendConnect(self, data):
+    def sendConnect(self, data, info=None):
         """Send a CONNECT command to the broker
-            :param data: List of other broker main socket URL"""
+            :param data: List of other broker main socket URL
+            :param info: Information of this broker known by the others"""
         # Imported dynamically - Not used if only one broker
         if self.backend == 'ZMQ':
             import zmq
@@ -87,9 +95,10 @@ class localBroker(object):
                     port=self.brokerPort,
                 )
             )
-            self.socket.send_multipart([b"CONNECT",
-                                        pickle.dumps(data,
-                                                     pickle.HIGHEST_PROTOCOL)])
+            frames = [CONNECT, pickle.dumps(data, pickle.HIGHEST_PROTOCOL)]
+            if info is not None:
+                frames.append(pickle.dumps(info, pickle.HIGHEST_PROTOCOL))
+            self.socket.send_multipart(frames)
         else:
             # TODO
             pass
@@ -100,13 +109,17 @@ class localBroker(object):
     def getPorts(self):
         return (self.brokerPort, self.infoPort)
 
+    def getIPCPaths(self):
+        return self.ipcPaths
+
     def close(self):
         scoop.logger.debug('Closing local broker.')
 
 
 class remoteBroker(object):
     def __init__(self, hostname, pythonExecutable, debug=False, nice=0,
-                 backend='ZMQ', rsh=False, ssh_executable='ssh'):
+                 backend='ZMQ', rsh=False, ssh_executable='ssh',
+                 ioThread=False):
         """Starts a broker on the specified hostname on unoccupied ports"""
         self.backend = backend
         brokerString = ("{pythonExec} -m scoop.broker.__main__ "
@@ -119,6 +132,8 @@ class remoteBroker(object):
                         )
         if nice:
             brokerString += "--nice {nice} ".format(nice=nice)
+        if ioThread:
+            brokerString += "--io-thread "
         if debug:
             brokerString += "--debug --path {path} ".format(
                 path=os.getcwd()
@@ -150,7 +165,10 @@ class remoteBroker(object):
         receivedLine = self.shell.stdout.readline()
         try:
             ports = receivedLine.decode().strip().split(",")
-            self.brokerPort, self.infoPort = ports
+            self.brokerPort, self.infoPort = ports[:2]
+            # Paths of the IPC endpoints, reached by the workers of its host
+            self.ipcPaths = tuple(path or None for path in ports[2:4]) \
+                or (None, None)
         except ValueError:
             # Following line for Python 2.6 compatibility (instead of [as e])
             e = sys.exc_info()[1]
@@ -173,9 +191,10 @@ class remoteBroker(object):
                                  )
                       )
 
-    def sendConnect(self, data):
+    def sendConnect(self, data, info=None):
         """Send a CONNECT command to the broker
-            :param data: List of other broker main socket URL"""
+            :param data: List of other broker main socket URL
+            :param info: Information of this broker known by the others"""
         # Imported dynamically - Not used if only one broker
         if self.backend == 'ZMQ':
             import zmq
@@ -191,9 +210,10 @@ class remoteBroker(object):
                     hostname = self.hostname
                 )
             )
-            self.socket.send_multipart([b"CONNECT",
-                                        pickle.dumps(data,
-                                                     pickle.HIGHEST_PROTOCOL)])
+            frames = [CONNECT, pickle.dumps(data, pickle.HIGHEST_PROTOCOL)]
+            if info is not None:
+                frames.append(pickle.dumps(info, pickle.HIGHEST_PROTOCOL))
+            self.socket.send_multipart(frames)
         else:
             # TODO
             pass
@@ -205,6 +225,9 @@ class remoteBroker(object):
     def getPorts(self):
         return (self.brokerPort, self.infoPort)
 
+    def getIPCPaths(self):
+        return self.ipcPaths
+
     def isLocal(self):
         """Is the current broker on the localhost?"""
         # This exists for further fusion with localBroker
@@ -36,3 +36,6 @@ BASE_SSH = [
 BASE_RSH = [
     'rsh',
 ]
+
+# Line written by the launch module of a host once its workers are started
+LAUNCHED_MARKER = 'SCOOP host launched: '
@@ -16,16 +16,52 @@
 #
 # Global imports
 from collections import namedtuple
+import base64
+import json
 import logging
 import os
 import sys
 import subprocess
-from threading import Thread
+import zlib
+from threading import Thread, Event
 
 # Local
 import scoop
 from scoop import utils
-from .constants import BASE_SSH, BASE_RSH
+from .constants import BASE_SSH, BASE_RSH, LAUNCHED_MARKER
+
+
+def splitTree(hosts, fanout):
+    """Divide the hosts into at most fanout subtrees of consecutive hosts.
+    Returns the (root, descendants) pairs of the subtrees."""
+    if not hosts:
+        return []
+    size = -(-len(hosts) // fanout)
+    return [(hosts[index], hosts[index + 1:index + size])
+            for index in range(0, len(hosts), size)]
+
+
+def encodeTree(ssh, fanout, hosts):
+    """Encode the ssh command, the fan-out and the tree entries of the hosts
+    to launch into a string passed on the command line."""
+    data = json.dumps([ssh, fanout, hosts]).encode()
+    return base64.urlsafe_b64encode(zlib.compress(data)).decode()
+
+
+def decodeTree(string):
+    """Rebuild the (ssh command, fan-out, hosts) given to encodeTree."""
+    data = zlib.decompress(base64.urlsafe_b64decode(string.encode()))
+    return json.loads(data.decode())
+
+
+def treeCommand(entry, ssh, fanout, descendants):
+    """Returns the shell command launching the host of a tree entry (see
+    Host.getTreeEntry), which launches in turn its descendants."""
+    hostname, head, tail = entry
+    c = list(head)
+    if descendants:
+        c.append('--tree={0}'.format(encodeTree(ssh, fanout, descendants)))
+    return " ".join(c + tail)
 
 
 class Host(object):
@@ -35,8 +71,10 @@ class Host(object):
         'launchingArguments',
         [
             'pythonPath', 'path', 'nice', 'pythonExecutable', 'size', 'origin',
-            'brokerHostname', 'brokerPorts', 'debug', 'profiling', 'executable',
-            'verbose', 'args', 'prolog', 'backend'
+            'brokerHostname', 'brokerPorts', 'brokerIPCPaths', 'debug',
+            'profiling', 'executable', 'verbose', 'args', 'prolog', 'backend',
+            'prefetch', 'scheduler', 'serializer', 'threadsPerWorker',
+            'forkServer'
         ]
     )
 
@@ -47,6 +85,11 @@ class Host(object):
         self.workerAmount = 0
         self.rsh = rsh
         self.ssh_executable = ssh_executable
+        # Called with the name of every host launched through this one once
+        # its workers are started
+        self.reportLaunch = None
+        # Set once the workers of this host are started
+        self.launched = Event()
 
     def __repr__(self):
         return "{0} ({1} workers)".format(
@@ -107,13 +150,20 @@ class Host(object):
 
     def _WorkerCommand_launcher(self):
         """Return list commands to start the bootstrap process"""
-        return [
+        c = [
             self.workersArguments.pythonExecutable,
             '-m',
             'scoop.launch.__main__',
             str(self.workerAmount),
             str(self.workersArguments.verbose),
         ]
+        if self.workersArguments.forkServer:
+            c.append('--forkServer={0}'.format(
+                self.workersArguments.forkServer
+            ))
+        if self.reportLaunch and not self.isLocal():
+            c.append('--reportAs={0}'.format(self.hostname))
+        return c
 
     def _WorkerCommand_options(self):
         """Return list of options for bootstrap"""
@@ -137,6 +187,12 @@ class Host(object):
         c.extend(['--externalBrokerHostname', worker.brokerHostname])
         c.extend(['--taskPort', str(worker.brokerPorts[0])])
         c.extend(['--metaPort', str(worker.brokerPorts[1])])
+        # The IPC endpoints are only reached on the host of the broker
+        if broker == "127.0.0.1":
+            for option, path in zip(('--taskIPC', '--metaIPC'),
+                                    worker.brokerIPCPaths or ()):
+                if path:
+                    c.extend([option, path])
         if worker.origin and worker.executable:
             c.append('--origin')
         if worker.debug:
@@ -145,6 +201,14 @@ class Host(object):
             c.append('--profile')
         if worker.backend:
             c.append('--backend={0}'.format(worker.backend))
+        if worker.prefetch > 1:
+            c.extend(['--prefetch', str(worker.prefetch)])
+        if worker.scheduler:
+            c.append('--scheduler={0}'.format(worker.scheduler))
+        if worker.serializer:
+            c.append('--serializer={0}'.format(worker.serializer))
+        if worker.threadsPerWorker > 0:
+            c.extend(['--threadsPerWorker', str(worker.threadsPerWorker)])
         if worker.verbose >= 1:
             c.append('-' + 'v' * worker.verbose)
         return c
@@ -187,32 +251,78 @@ class Host(object):
         """Retrieves the shell command to launch the workers on this host."""
         return " ".join(self._getWorkerCommandList())
 
-    def launch(self, tunnelPorts=None):
-        """Launch every worker assigned on this host."""
+    def getTreeEntry(self):
+        """Returns the hostname and the parts of the command launching the
+        workers on this host, before and after the launch module options, to
+        be launched by another host (see treeCommand)."""
+        return [
+            self.hostname,
+            self._WorkerCommand_environment() + self._WorkerCommand_launcher(),
+            self._WorkerCommand_options() + self._WorkerCommand_executable(),
+        ]
+
+    def getSshCommand(self):
+        """Returns the command opening a shell on a remote host."""
+        if self.rsh:
+            return list(BASE_RSH)
+        return [self.ssh_executable] + BASE_SSH[1:]
+
+    def launch(self, tunnelPorts=None, descendants=None, fanout=0):
+        """Launch every worker assigned on this host. The hosts given as tree
+        entries in descendants are launched in turn from this host, which
+        launches itself at most fanout of them."""
         if self.isLocal():
             # Launching local workers
             c = self._getWorkerCommandList()
             self.subprocesses.append(subprocess.Popen(c))
+            self.launched.set()
+            if self.reportLaunch:
+                self.reportLaunch(self.hostname)
         else:
             # Launching remotely
-            BASE_SSH[0] = self.ssh_executable
-            sshCmd = BASE_SSH if not self.rsh else BASE_RSH
+            sshCmd = self.getSshCommand()
+            command = self.getCommand()
+            if descendants:
+                command = treeCommand(self.getTreeEntry(), sshCmd, fanout,
+                                      descendants)
             if tunnelPorts is not None:
                 sshCmd += [
                     '-R {0}:127.0.0.1:{0}'.format(tunnelPorts[0]),
                     '-R {0}:127.0.0.1:{0}'.format(tunnelPorts[1]),
                 ]
             self.subprocesses.append(
-                subprocess.Popen(sshCmd + [self.hostname, self.getCommand()],
+                subprocess.Popen(sshCmd + [self.hostname, command],
                                  bufsize=-1,
-                                 stdout=None,
+                                 stdout=subprocess.PIPE,
                                  stderr=None,
                                  stdin=subprocess.PIPE
                 )
             )
+            relay = Thread(target=self._relayOutput,
+                           args=(self.subprocesses[-1].stdout,))
+            relay.daemon = True
+            relay.start()
 
         return self.subprocesses
 
+    def _relayOutput(self, stream):
+        """Forward the output of the remote workers, reporting the hosts
+        announcing that their workers are started."""
+        marker = LAUNCHED_MARKER.encode()
+        out = getattr(sys.stdout, 'buffer', sys.stdout)
+        for line in iter(stream.readline, b''):
+            if line.startswith(marker):
+                hostname = line[len(marker):].strip().decode()
+                if hostname == self.hostname:
+                    self.launched.set()
+                if self.reportLaunch:
+                    self.reportLaunch(hostname)
+            else:
+                out.write(line)
+                out.flush()
+        # The connection ended
+        self.launched.set()
+
     def close(self):
         """Connection(s) cleanup."""
         # Ensure everything is cleaned up on exit
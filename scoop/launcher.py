@@ -24,11 +24,13 @@ import time
 import logging
 import traceback
 import signal
-from threading import Thread
+import multiprocessing
+from threading import Thread, Lock
 
 # Local imports
 from scoop import utils
 from scoop.launch import Host
+from scoop.launch.workerLaunch import splitTree
 from scoop.launch.brokerLaunch import localBroker, remoteBroker
 from .broker.structs import BrokerInfo
 import scoop
@@ -48,10 +50,14 @@ class ScoopApp(object):
     def __init__(self, hosts, n, b, verbose, python_executable,
             externalHostname, executable, arguments, tunnel, path, debug,
             nice, env, profile, pythonPath, prolog, backend, rsh,
-            ssh_executable):
+            ssh_executable, prefetch=1, scheduler='fifo',
+            serializer='pickle', brokerIOThread=False, threadsPerWorker=0,
+            forkServer=None, launchFanout=0, launchTree=False):
         # Assure setup sanity
         assert type(hosts) == list and hosts, (
             "You should at least specify one host.")
+        assert not (tunnel and launchTree), (
+            "The tree launch can't be used with ssh tunnels.")
         self.workersLeft = n if n > 0 else len(hosts)
         self.createdSubprocesses = []
 
@@ -72,6 +78,14 @@ class ScoopApp(object):
         self.profile = profile
         self.backend = backend
         self.rsh = rsh
+        self.prefetch = prefetch
+        self.scheduler = scheduler
+        self.serializer = serializer
+        self.brokerIOThread = brokerIOThread
+        self.threadsPerWorker = threadsPerWorker
+        self.forkServer = forkServer
+        self.launchFanout = launchFanout
+        self.launchTree = launchTree
         self.errors = None
 
         # Logging configuration
@@ -134,6 +148,14 @@ class ScoopApp(object):
 
         self.workers = []
         self.brokers = []
+        # Launch latency of every host, reported as their workers start
+        self.launchLatencies = {}
+        self.launchLock = Lock()
+        self.launchStart = time.time()
+        # Forked workers of the local backend and their queues
+        self.localWorkers = []
+        self.channels = None
+        self.runDirectory = None
 
     def initLogging(self):
         """Configures the logger."""
@@ -196,7 +218,7 @@ class ScoopApp(object):
                 )
             )
 
-    def _setWorker_args(self, origin):
+    def _setWorker_args(self, origin, broker=None):
         """Create the arguments to pass to the addWorker call.
             The returned args and kwargs must ordered/named according to the namedtuple
             in LAUNCH_HOST_CLASS.LAUNCHING_ARGUMENTS .
@@ -204,6 +226,16 @@ class ScoopApp(object):
             both args and kwargs are supported for full flexibilty,
             but usage of kwargs only is strongly advised.
         """
+        if self.backend == 'local':
+            # The workers communicate without broker
+            brokerHostname, brokerPorts = "127.0.0.1", (0, 0)
+            brokerIPCPaths = (None, None)
+        else:
+            if broker is None:
+                broker = self.brokers[0]
+            brokerHostname = self.getBrokerHostname(broker)
+            brokerPorts = (broker.brokerPort, broker.infoPort)
+            brokerIPCPaths = broker.getIPCPaths()
         args = []
         kwargs = {
             'pythonPath': self.pythonpath,
@@ -213,19 +245,43 @@ class ScoopApp(object):
             'pythonExecutable': self.python_executable,
             'size': self.n,
             'origin': origin,
-            'brokerHostname': self.externalHostname,
-            'brokerPorts': (self.brokers[0].brokerPort,
-                            self.brokers[0].infoPort),
+            'brokerHostname': brokerHostname,
+            'brokerPorts': brokerPorts,
+            'brokerIPCPaths': brokerIPCPaths,
             'debug': self.debug,
             'profiling': self.profile,
             'executable': self.executable,
             'verbose': self.verbose,
             'backend': self.backend,
+            'prefetch': self.prefetch,
+            'scheduler': self.scheduler,
+            'serializer': self.serializer,
+            'threadsPerWorker': self.threadsPerWorker,
+            'forkServer': self.forkServer,
             'args': self.args,
         }
         return args, kwargs
 
-    def setWorkerInfo(self, hostname, workerAmount, origin):
+    def getBrokerHostname(self, broker):
+        """Returns the hostname of a broker reachable by the workers. The
+        first broker is reached through the external hostname."""
+        if isinstance(broker, localBroker) or broker is self.brokers[0]:
+            return self.externalHostname
+        return broker.getHost()
+
+    def getHostBrokers(self, hostname, index):
+        """Returns the brokers serving the workers of a host: the brokers
+        launched on this host, or else a broker chosen in turn for every
+        host."""
+        brokers = [broker for broker in self.brokers
+                   if not isinstance(broker, localBroker) and
+                   broker.getHost() == hostname]
+        if not brokers and hostname in utils.localHostnames:
+            brokers = [broker for broker in self.brokers
+                       if isinstance(broker, localBroker)]
+        return brokers or [self.brokers[index % len(self.brokers)]]
+
+    def setWorkerInfo(self, hostname, workerAmount, origin, broker=None):
         """Sets the worker information for the current host."""
 
         scoop.logger.debug('Initialising {0}{1} worker {2} [{3}].'.format(
@@ -236,31 +292,196 @@ class ScoopApp(object):
             )
         )
 
-        add_args, add_kwargs = self._setWorker_args(origin)
+        add_args, add_kwargs = self._setWorker_args(origin, broker)
         self.workers[-1].setWorker(*add_args, **add_kwargs)
         self.workers[-1].setWorkerAmount(workerAmount)
 
+    def runLocal(self):
+        """Fork the workers of the local backend, which communicate through
+        queues without broker."""
+        # Python 3 only, as the local backend
+        from multiprocessing.connection import wait
+        from ._comm import scooplocal
+        if any(hostname not in utils.localHostnames
+               for hostname, _ in self.worker_hosts):
+            raise Exception("The local backend can only launch workers on the "
+                            "local host.")
+        if self.scheduler != 'fifo':
+            raise Exception("The {0} scheduler needs a broker, which the local "
+                            "backend doesn't use.".format(self.scheduler))
+
+        self.channels = scooplocal.LocalChannels(self.workersLeft)
+        context = multiprocessing.get_context("fork")
+        for rank in range(self.workersLeft):
+            host = self.LAUNCH_HOST_CLASS("127.0.0.1")
+            add_args, add_kwargs = self._setWorker_args(rank == 0)
+            host.setWorker(*add_args, **add_kwargs)
+            argv = host._WorkerCommand_options() + \
+                host._WorkerCommand_executable()
+            worker = context.Process(target=scooplocal.runWorker,
+                                     args=(self.channels, rank, argv))
+            worker.start()
+            self.localWorkers.append(worker)
+
+        # Wait for the root program, shutting the pool down if another worker
+        # dies meanwhile
+        origin = self.localWorkers[0]
+        running = self.localWorkers[1:]
+        try:
+            while origin.is_alive():
+                wait([origin.sentinel] + [w.sentinel for w in running])
+                for worker in [w for w in running if not w.is_alive()]:
+                    running.remove(worker)
+                    if worker.exitcode:
+                        self.channels.shutdown()
+        except KeyboardInterrupt:
+            pass
+        self.errors = origin.exitcode
+        scoop.logger.info('Root process is done.')
+        return self.errors
+
+    def startBroker(self, hostname):
+        """Launch a broker on the given host."""
+        if self.externalHostname in utils.localHostnames:
+            return localBroker(
+                debug=self.debug,
+                nice=self.nice,
+                backend=self.backend,
+                ioThread=self.brokerIOThread,
+            )
+        return remoteBroker(
+            hostname=hostname,
+            pythonExecutable=self.python_executable,
+            debug=self.debug,
+            nice=self.nice,
+            backend=self.backend,
+            rsh=self.rsh,
+            ssh_executable=self.ssh_executable,
+            ioThread=self.brokerIOThread,
+        )
+
+    def startBrokers(self, hostnames):
+        """Start a broker on every given host, at most launchFanout at once.
+        Returns the (broker, exception) tuple of every host, in order."""
+        launches = [(None, None)] * len(hostnames)
+
+        def start(index, hostname):
+            try:
+                launches[index] = (self.startBroker(hostname), None)
+            except Exception:
+                launches[index] = (None, sys.exc_info()[1])
+
+        limit = self.launchFanout or max(1, len(hostnames))
+        threads = []
+        for index, hostname in enumerate(hostnames):
+            while sum(thread.is_alive() for thread in threads) >= limit:
+                time.sleep(0.01)
+            thread = Thread(target=start, args=(index, hostname))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return launches
+
+    def launchHosts(self, brokers):
+        """Launch the workers of every host, served by the given brokers. At
+        most launchFanout remote hosts are launched at once. In tree mode, the
+        remote hosts but the origin one are launched in turn by the first
+        ones."""
+        self.launchStart = time.time()
+        for host in self.workers:
+            host.reportLaunch = self.hostLaunched
+        direct = self.workers
+        tree = []
+        if self.launchTree:
+            direct = [host for index, host in enumerate(self.workers)
+                      if index == 0 or host.isLocal()]
+            tree = [host for host in self.workers if host not in direct]
+
+        for host, broker in zip(self.workers, brokers):
+            if host not in direct:
+                continue
+            if self.launchFanout and not host.isLocal():
+                self.waitLaunches(self.launchFanout)
+            scoop.logger.debug(
+                "{0}: Launching '{1}'".format(
+                    host.hostname,
+                    host.getCommand(),
+                )
+            )
+            host.launch(
+                (broker.brokerPort,
+                 broker.infoPort)
+                    if self.tunnel else None,
+            )
+
+        fanout = self.launchFanout or scoop.LAUNCH_TREE_FANOUT
+        for root, descendants in splitTree(tree, fanout):
+            scoop.logger.debug(
+                "{0}: Launching '{1}', then {2} host(s) from it".format(
+                    root.hostname,
+                    root.getCommand(),
+                    len(descendants),
+                )
+            )
+            root.launch(descendants=[host.getTreeEntry()
+                                     for host in descendants],
+                        fanout=fanout)
+            # Its descendants are launched by the remote hosts
+            for host in descendants:
+                host.launched.set()
+
+    def waitLaunches(self, limit):
+        """Block until less than limit remote hosts are being launched."""
+        while True:
+            pending = [host for host in self.workers
+                       if host.subprocesses and not host.launched.is_set()]
+            if len(pending) < limit:
+                return
+            pending[0].launched.wait(0.1)
+
+    def hostLaunched(self, hostname):
+        """Report the launch latency of a host, and the slowest hosts once
+        every host is launched."""
+        latency = time.time() - self.launchStart
+        scoop.logger.debug("{0}: workers started after {1:.2f} s.".format(
+            hostname, latency,
+        ))
+        with self.launchLock:
+            self.launchLatencies[hostname] = latency
+            if len(self.launchLatencies) != len(set(
+                    host.hostname for host in self.workers)):
+                return
+            slowest = sorted(self.launchLatencies.items(),
+                             key=lambda item: item[1], reverse=True)
+        scoop.logger.info(
+            "Launched {0} host(s) in {1:.2f} s. Slowest: {2}.".format(
+                len(slowest),
+                slowest[0][1],
+                ", ".join("{0} ({1:.2f} s)".format(*item)
+                          for item in slowest[:3]),
+            )
+        )
+
     def run(self):
         """Launch the broker(s) and worker(s) assigned on every hosts."""
-        # Launch the broker(s)
-        for hostname, nb_brokers in self.broker_hosts:
-            for ind in range(nb_brokers):
-                if self.externalHostname in utils.localHostnames:
-                    self.brokers.append(localBroker(
-                        debug=self.debug,
-                        nice=self.nice,
-                        backend=self.backend,
-                    ))
-                else:
-                    self.brokers.append(remoteBroker(
-                        hostname=hostname,
-                        pythonExecutable=self.python_executable,
-                        debug=self.debug,
-                        nice=self.nice,
-                        backend=self.backend,
-                        rsh=self.rsh,
-                        ssh_executable=self.ssh_executable,
-                    ))
+        # Files of the local broker and workers, see utils.runDirectory
+        self.runDirectory = utils.createRunDirectory()
+        os.environ[utils.RUN_DIRECTORY_ENV] = self.runDirectory
+
+        if self.backend == 'local':
+            return self.runLocal()
+
+        # Launch the broker(s), at most launchFanout at once
+        brokerHosts = [hostname for hostname, nb_brokers in self.broker_hosts
+                       for _ in range(nb_brokers)]
+        launches = self.startBrokers(brokerHosts)
+        for broker, error in launches:
+            if error is None:
+                self.brokers.append(broker)
+        for broker, error in launches:
+            if error is not None:
+                raise error
 
         # Share connection information between brokers
         if self.b > 1:
@@ -270,48 +491,49 @@ class ScoopApp(object):
                     BrokerInfo(
                         x.getHost(),
                         *x.getPorts(),
-                        externalHostname=x.getHost()
+                        externalHostname=x.getHost(),
+                        task_ipc=x.getIPCPaths()[0],
+                        info_ipc=x.getIPCPaths()[1]
                     )
                     for x in self.brokers
                     if x is not broker
                 ]
-                broker.sendConnect(connect_data)
-
-        # Launch the workers
-        shells = []
+                broker.sendConnect(connect_data, BrokerInfo(
+                    broker.getHost(),
+                    *broker.getPorts(),
+                    externalHostname=broker.getHost()
+                ))
+
+        # Assign the workers, dividing the workers of every host among the
+        # brokers serving it
+        hostBrokers = []
         origin_launched = False
-        for hostname, nb_workers in self.worker_hosts:
-            self.workers.append(self.LAUNCH_HOST_CLASS(hostname, self.rsh,
-                                                       self.ssh_executable))
+        for index, (hostname, nb_workers) in enumerate(self.worker_hosts):
             total_workers_host = min(nb_workers, self.workersLeft)
-
-            self.setWorkerInfo(hostname, total_workers_host, not origin_launched)
-            origin_launched = True
+            brokers = self.getHostBrokers(hostname, index)
+            for rank, broker in enumerate(brokers):
+                workerAmount = total_workers_host // len(brokers)
+                if rank < total_workers_host % len(brokers):
+                    workerAmount += 1
+                if not workerAmount:
+                    continue
+                self.workers.append(self.LAUNCH_HOST_CLASS(hostname, self.rsh,
+                                                           self.ssh_executable))
+                self.setWorkerInfo(hostname, workerAmount, not origin_launched,
+                                   broker)
+                hostBrokers.append(broker)
+                origin_launched = True
             self.workersLeft -= total_workers_host
-
-            # Launch every workers at the same time
-            scoop.logger.debug(
-                "{0}: Launching '{1}'".format(
-                    hostname,
-                    self.workers[-1].getCommand(),
-                )
-            )
-            shells.append(self.workers[-1].launch(
-                (self.brokers[0].brokerPort,
-                 self.brokers[0].infoPort)
-                    if self.tunnel else None,
-            ))
             if self.workersLeft <= 0:
-                # We've launched every worker we needed, so let's exit the loop
+                # We've assigned every worker we needed, so let's exit the loop
                 break
-        rootProcess = shells[0][0]
+
+        self.launchHosts(hostBrokers)
+        rootProcess = self.workers[0].subprocesses[0]
 
         # Wait for the root program
         try:
-            if self.workers[0].isLocal():
-                self.errors = self.workers[0].subprocesses[0].wait()
-            else:
-                self.errors = rootProcess.wait()
+            self.errors = rootProcess.wait()
         except KeyboardInterrupt:
             pass
         scoop.logger.info('Root process is done.')
@@ -327,6 +549,16 @@ class ScoopApp(object):
         for host in self.workers:
             host.close()
 
+        # Terminate the forked workers of the local backend
+        if self.channels:
+            self.channels.shutdown(exclude=0)
+        for worker in self.localWorkers:
+            worker.join(1)
+            if worker.is_alive():
+                worker.terminate()
+        if self.runDirectory is not None:
+            utils.removeRunDirectory(self.runDirectory)
+
         # Terminate the brokers
         for broker in self.brokers:
             try:
@@ -433,9 +665,74 @@ def makeParser():
                         "workerX where X is the number of the worker."),
                         action='store_true')
     parser.add_argument('--backend',
-                        help="Choice of communication backend",
-                        choices=['ZMQ', 'TCP'],
+                        help="Choice of communication backend. 'local' forks "
+                             "the workers on this host and passes the tasks "
+                             "through queues, without broker. (default: ZMQ)",
+                        choices=['ZMQ', 'TCP', 'local'],
                         default='ZMQ')
+    parser.add_argument('--prefetch',
+                        help="Number of tasks every worker keeps queued "
+                             "locally. Higher values overlap communications "
+                             "with computation at the cost of load balancing. "
+                             "(default: 1)",
+                        type=int,
+                        default=1,
+                        metavar="NumberOfTasks")
+    parser.add_argument('--scheduler',
+                        help="Task scheduling policy. 'fifo' distributes "
+                             "every task through the broker in order of "
+                             "arrival; 'steal' keeps spawned tasks on their "
+                             "worker and lets idle workers steal them from "
+                             "busy peers; 'locality' sends every task to an "
+                             "idle worker on the host of the worker which "
+                             "submitted it when there is one. (default: fifo)",
+                        choices=['fifo', 'steal', 'locality'],
+                        default='fifo')
+    parser.add_argument('--serializer',
+                        help="Serializer of the messages between workers. "
+                             "'marshal' and 'msgpack' serialize the builtin "
+                             "types faster and fall back on pickle; "
+                             "'cloudpickle' also handles lambdas and closures. "
+                             "(default: pickle)",
+                        choices=['pickle', 'cloudpickle', 'marshal', 'msgpack'],
+                        default='pickle')
+    parser.add_argument('--threads-per-worker',
+                        help="Number of threads of every worker executing "
+                             "the Futures submitted with threaded=True, such "
+                             "as I/O-bound tasks or calls releasing the GIL. "
+                             "(default: 0, executing them like any other "
+                             "Future)",
+                        type=int,
+                        default=0,
+                        metavar="NumberOfThreads")
+    parser.add_argument('--fork-server',
+                        help="Start the workers of every host by forking a "
+                             "process which imported SCOOP ('scoop') or SCOOP "
+                             "and the program ('module', which must then "
+                             "support being forked) once, instead of starting "
+                             "an interpreter for each.",
+                        choices=['scoop', 'module'],
+                        metavar="scoop|module")
+    parser.add_argument('--launch-fanout',
+                        help="Maximum number of remote hosts (and brokers) "
+                             "being launched at once, or launched by every "
+                             "host in tree mode. (default: 0, every host at "
+                             "once, or {0} in tree mode)".format(
+                                 scoop.LAUNCH_TREE_FANOUT),
+                        type=int,
+                        default=0,
+                        metavar="NumberOfHosts")
+    parser.add_argument('--launch-tree',
+                        help="Launch the remote hosts through a tree: every "
+                             "launched host launches in turn part of the "
+                             "remaining hosts. The hosts must reach each "
+                             "other with ssh. Not compatible with --tunnel.",
+                        action='store_true')
+    parser.add_argument('--broker-io-thread',
+                        help="Relay the replies and shared variables in a "
+                             "broker thread separate from the scheduling of "
+                             "the tasks.",
+                        action='store_true')
     parser.add_argument('executable',
                         nargs='?',
                         help='The executable to start with SCOOP')
@@ -478,7 +775,13 @@ def main():
                             args.path, args.debug, args.nice,
                             utils.getEnv(), args.profile, args.pythonpath[0],
                             args.prolog[0], args.backend, args.rsh,
-                            args.ssh_executable)
+                            args.ssh_executable, args.prefetch,
+                            args.scheduler, args.serializer,
+                            args.broker_io_thread,
+                            args.threads_per_worker,
+                            args.fork_server,
+                            args.launch_fanout,
+                            args.launch_tree)
 
     rootTaskExitCode = False
     interruptPreventer = Thread(target=thisScoopApp.close)
@@ -17,9 +17,14 @@
 #
 
 import itertools
+import hashlib
 from inspect import ismethod
-from functools import reduce
 import time
+from collections import OrderedDict
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 from . import encapsulation, utils
 import scoop
@@ -27,6 +32,30 @@ from .fallbacks import ensureScoopStartedProperly, NotStartedProperly
 
 
 elements = None
+# Flat index of the shared constants by name, kept in sync with elements
+constants = {}
+# Callables resolved by SharedElementEncapsulation on this worker, the least
+# recently used first
+_resolvedCallables = OrderedDict()
+
+
+def _setElements(newElements):
+    """Replace every shared element by newElements, a dictionary of the
+    constants set by every worker, and rebuild the index of constants."""
+    global elements
+    elements = newElements
+    constants.clear()
+    for values in elements.values():
+        constants.update(values)
+    _resolvedCallables.clear()
+
+
+def _updateElement(key, name, value):
+    """Record the constant name set by the worker key."""
+    elements.setdefault(key, {})[name] = value
+    constants[name] = value
+    for callableKey in [k for k in _resolvedCallables if k[0] == name]:
+        del _resolvedCallables[callableKey]
 
 
 def _ensureAtomicity(fn):
@@ -35,8 +64,8 @@ def _ensureAtomicity(fn):
     def wrapper(*args, **kwargs):
         """setConst(**kwargs)
         Set a constant that will be shared to every workers.
-        This call blocks until the constant has propagated to at least one
-        worker.
+        This call blocks until the broker acknowledged the constant, which is
+        then available to every worker.
 
         :param \*\*kwargs: One or more combination(s) key=value. Key being the
             variable name and value the object to share.
@@ -50,27 +79,37 @@ def _ensureAtomicity(fn):
 
         from . import _control
 
+        socket = _control.execQueue.socket
+
         # Enforce retrieval of currently awaiting constants
-        _control.execQueue.socket.pumpInfoSocket()
+        socket.pumpInfoSocket()
 
         for key, value in kwargs.items():
             # Object name existence check
-            if key in itertools.chain(*(elem.keys() for elem in elements.values())):
+            if key in constants:
                 raise TypeError("This constant already exists: {0}.".format(key))
 
-        # Retry element propagation until it is returned
-        while all(key in elements.get(scoop.worker, []) for key in kwargs.keys()) is not True:
-            scoop.logger.debug("Sending global variables {0}...".format(
-                list(kwargs.keys())
-            ))
-            # Call the function
-            fn(*args, **kwargs)
+        # Wait for the broker to acknowledge every element, resending them if
+        # no acknowledgement came in time
+        sendTime = None
+        while not all(socket.isVariableAcknowledged(key) for key in kwargs):
+            remaining = (sendTime or 0) + scoop.TIME_BEFORE_RESENDING_VARIABLE \
+                        - time.time()
+            if remaining <= 0:
+                scoop.logger.debug("Sending global variables {0}...".format(
+                    list(kwargs.keys())
+                ))
+                # Call the function
+                fn(*args, **kwargs)
+                sendTime = time.time()
+                remaining = scoop.TIME_BEFORE_RESENDING_VARIABLE
+            # Block until a message arrives, the acknowledgement may follow
+            # Futures which are queued meanwhile
+            socket._poll(int(remaining * 1000))
+            _control.execQueue.updateQueue()
 
-            # Enforce retrieval of currently awaiting constants
-            _control.execQueue.socket.pumpInfoSocket()
-
-            # TODO: Make previous blocking instead of sleep
-            time.sleep(0.1)
+        for key, value in kwargs.items():
+            _updateElement(scoop.worker, key, value)
 
         # Atomicity check
         elementNames = list(itertools.chain(*(elem.keys() for elem in elements.values())))
@@ -94,7 +133,8 @@ def setConst(**kwargs):
     """
     from . import _control
     
-    sendVariable = _control.execQueue.socket.sendVariable
+    socket = _control.execQueue.socket
+    sendVariable = socket.sendVariable
 
     for key, value in kwargs.items():
         # Propagate the constant
@@ -103,9 +143,23 @@ def setConst(**kwargs):
         if callable(value):
             sendVariable(key, encapsulation.FunctionEncapsulation(value, key))
         else:
+            # Large constants are mapped in memory by the workers of a host,
+            # the broker serves their content to the other hosts
+            value = encapsulation.mapIfLarge(value)
+            if isinstance(value, encapsulation.MappedEncapsulation):
+                socket.sendSegment(value.digest, value.getSegment())
             sendVariable(key, value)
 
 
+def _getConstant(name):
+    """Returns the constant name, mapping it in memory on first access if it is
+    a large constant."""
+    value = constants.get(name)
+    if isinstance(value, encapsulation.MappedEncapsulation):
+        value = constants[name] = value.getObject()
+    return value
+
+
 def getConst(name, timeout=0.1):
     """Get a shared constant.
 
@@ -118,23 +172,57 @@ def getConst(name, timeout=0.1):
     Usage: value = getConst('name')
     """
     from . import _control
-    import time
+
+    # Constants can't be redefined, a known one is returned right away
+    value = _getConstant(name)
+    if value is not None:
+        return value
 
     timeStamp = time.time()
     while True:
         # Enforce retrieval of currently awaiting constants
         _control.execQueue.socket.pumpInfoSocket()
 
-        # Constants concatenation
-        constants = dict(reduce(
-            lambda x, y: x + list(y.items()),
-            elements.values(),
-            []
-        ))
-        timeoutHappened = time.time() - timeStamp > timeout
-        if constants.get(name) is not None or timeoutHappened:
-            return constants.get(name)
-        time.sleep(0.01)
+        value = _getConstant(name)
+        remaining = timeout - (time.time() - timeStamp)
+        if value is not None or remaining < 0:
+            return value
+        # Block until the next constant is published
+        _control.execQueue.socket.waitInfoSocket(remaining)
+
+
+def _shareSerializedCallable(data):
+    """Shares the serialized callable data with every worker, once, as a
+    constant named by its digest. Returns a reference to this constant.
+
+    Unlike setConst, this call doesn't wait for the broker: the constant is
+    published before the Futures referencing it are forwarded."""
+    from . import _control
+
+    name = "callable:" + hashlib.sha1(data).hexdigest()
+    if name not in constants:
+        value = encapsulation.CallableEncapsulation(data)
+        _control.execQueue.socket.sendVariable(name, value)
+        _updateElement(scoop.worker, name, value)
+    return SharedElementEncapsulation(name)
+
+
+def _shareLargeCallable(callable_):
+    """Returns a reference to callable_ shared by its digest if its
+    serialization exceeds scoop.CALLABLE_SHARING_THRESHOLD, callable_
+    otherwise."""
+    from ._comm import serializers
+
+    if isinstance(callable_, SharedElementEncapsulation):
+        return callable_
+    try:
+        data = serializers.dumps(callable_)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        # Sent by name, see encodeCallable
+        return callable_
+    if len(data) < scoop.CALLABLE_SHARING_THRESHOLD:
+        return callable_
+    return _shareSerializedCallable(data)
 
 
 class SharedElementEncapsulation(object):
@@ -169,16 +257,26 @@ class SharedElementEncapsulation(object):
     def __repr__(self):
         return self.uniqueID
 
+    def _resolve(self):
+        """Returns the shared callable, cached for the next calls. The least
+        recently used callables are evicted from the cache beyond
+        scoop.CALLABLE_CACHE_SIZE."""
+        key = (self.uniqueID, self.methodName if self.isMethod else None)
+        try:
+            element = _resolvedCallables.pop(key)
+        except KeyError:
+            element = getConst(self.uniqueID, timeout=float("inf"))
+            if isinstance(element, encapsulation.CallableEncapsulation):
+                element = element.getCallable()
+            if self.isMethod:
+                element = getattr(element, self.methodName)
+            while len(_resolvedCallables) >= max(1, scoop.CALLABLE_CACHE_SIZE):
+                _resolvedCallables.popitem(last=False)
+        _resolvedCallables[key] = element
+        return element
+
     def __call__(self, *args, **kwargs):
-        if self.isMethod:
-            wholeObj = getConst(
-                self.__repr__(),
-                timeout=float("inf"),
-            )
-            return getattr(wholeObj, self.methodName)(*args, **kwargs)
-        else:
-            return getConst(self.__repr__(),
-                            timeout=float("inf"))(*args, **kwargs)
+        return self._resolve()(*args, **kwargs)
 
     def __name__(self):
         return self.__repr__()
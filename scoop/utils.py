@@ -17,11 +17,15 @@
 #
 from multiprocessing import cpu_count
 from itertools import groupby
+import atexit
 import os
 import re
+import shutil
+import stat
 import sys
 import socket
 import logging
+import tempfile
 
 if sys.version_info < (2, 7):
     from scoop.backports.dictconfig import dictConfig
@@ -109,6 +113,88 @@ def externalHostname(hosts):
     return hostname
 
 
+# Environment variable giving the processes of a pool the directory of their
+# host, created and removed by the launcher. It holds the IPC endpoints of the
+# workers and the segments of the memory-mapped constants.
+RUN_DIRECTORY_ENV = "SCOOP_RUN_DIRECTORY"
+# Directory of this process, see runDirectory
+_runDirectory = None
+
+
+def createRunDirectory():
+    """Creates a directory for the files of a pool, in memory when the system
+    provides it. The directory has a unique name and only its owner can access
+    it, so its files can only be created by the processes of the pool."""
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return tempfile.mkdtemp(prefix="scoop-", dir=base)
+
+
+def removeRunDirectory(path):
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def runDirectory():
+    """Returns the directory of the pool on this host, given by the launcher.
+    A process not started by the launcher creates its own directory, removed
+    when it exits."""
+    global _runDirectory
+    if _runDirectory is not None:
+        return _runDirectory
+    path = os.environ.get(RUN_DIRECTORY_ENV)
+    if path is None:
+        path = createRunDirectory()
+        os.environ[RUN_DIRECTORY_ENV] = path
+        atexit.register(removeRunDirectory, path)
+    status = os.lstat(path)
+    if (not stat.S_ISDIR(status.st_mode) or status.st_uid != os.getuid()
+            or status.st_mode & 0o077):
+        raise OSError("The directory {0} must be a directory only accessible "
+                      "by its owner.".format(path))
+    _runDirectory = path
+    return path
+
+
+def ipcPath(port):
+    """Returns the path of the IPC endpoint bound along the TCP port of a
+    socket of this host by a process of the pool, None if there isn't."""
+    path = os.path.join(runDirectory(), "ipc-{0}".format(port))
+    return path if os.path.exists(path) else None
+
+
+def bindIPC(sock, port):
+    """Also bind the zmq socket listening on the TCP port to an IPC endpoint in
+    the directory of the pool, through which the processes of this host reach
+    it. Returns the path of the endpoint, or None if the IPC transport isn't
+    available."""
+    import zmq
+    if not zmq.has("ipc"):
+        return None
+    path = os.path.join(runDirectory(), "ipc-{0}".format(port))
+    try:
+        sock.bind("ipc://{0}".format(path))
+    except zmq.ZMQError:
+        return None
+    return path
+
+
+def unlinkIPC(path):
+    """Remove the file of an IPC endpoint returned by bindIPC."""
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def endpoint(hostname, port, path=None, local=False):
+    """Returns the address of the SCOOP socket listening on hostname:port. The
+    sockets of this host are reached through the IPC endpoint path of the
+    process which bound it, falling back on TCP."""
+    if path and (local or hostname in localHostnames):
+        return "ipc://{0}".format(path)
+    return "tcp://{0}:{1}".format(hostname, port)
+
+
 def groupTogether(in_list):
     # TODO: This algorithm is not efficient, use itertools.groupby()
     return_value = []
@@ -27,13 +27,23 @@ import sys
 import operator
 import signal
 import math
+import pickle
+import multiprocessing
 from tests_parser import TestUtils
-from tests_stat import TestStat
+from tests_stat import TestStat, TestGranularity
 from tests_stopwatch import TestStopWatch
+from tests_taskqueue import TestTaskQueue, TestFuture, TestMovableQueue
+from tests_serializers import TestSerializers
+from tests_shared import TestSharedIndex
+from tests_broker import TestBrokerBatch
+from tests_launch import TestLaunchTree
+from tests_broker import TestBrokerFederation as TestBrokerFederationUnit
 
 from scoop import futures, _control, utils, shared
-from scoop._types import FutureQueue
+from scoop._types import Future, FutureQueue
 from scoop.broker.structs import BrokerInfo
+from scoop._comm.scoopmessages import CONNECT
+from scoop._comm import scooplocal
 
 
 subprocesses = []
@@ -146,6 +156,33 @@ def funcWait(timeout):
     return done, not_done
 
 
+def funcLocalQueue():
+    f = futures.submit(func4, 5)
+    isLocal = f in _control.execQueue.movable
+    return isLocal, f.result()
+
+
+def funcPriority():
+    order = []
+    fs = [futures.submit(order.append, 'low', priority=-1),
+          futures.submit(order.append, 'normal'),
+          futures.submit(order.append, 'late', priority=1, deadline=20),
+          futures.submit(order.append, 'urgent', priority=1, deadline=10)]
+    futures.wait(fs)
+    return order
+
+
+def funcBufferLen(data):
+    return len(memoryview(data))
+
+
+def funcBuffers(n):
+    # Large buffers are sent as out-of-band frames with pickle protocol 5
+    data = pickle.PickleBuffer(bytearray(b"x" * (1 << 20)))
+    fs = [futures.submit(funcBufferLen, data) for _ in range(n)]
+    return sum(f.result() for f in fs)
+
+
 def funcExcept(n):
     f = futures.submit(funcRaise, n)
     try:
@@ -223,6 +260,69 @@ def funcSharedConstant():
     return result
 
 
+def funcSharedConstantLatency(n):
+    # Every constant is acknowledged by the broker without being resent
+    socket = _control.execQueue.socket
+    sent = []
+    sendVariable = socket.sendVariable
+
+    def countedSendVariable(key, value):
+        sent.append(key)
+        sendVariable(key, value)
+
+    socket.sendVariable = countedSendVariable
+    # Only a lost acknowledgement causes a resend, not a slow broker
+    resendTime = scoop.TIME_BEFORE_RESENDING_VARIABLE
+    scoop.TIME_BEFORE_RESENDING_VARIABLE = 60
+    try:
+        for i in range(n):
+            shared.setConst(**{"latencyVar{0}".format(i): i})
+    finally:
+        del socket.sendVariable
+        scoop.TIME_BEFORE_RESENDING_VARIABLE = resendTime
+    values = list(futures.map(shared.getConst,
+                              ["latencyVar{0}".format(i) for i in range(n)]))
+    return (values == list(range(n))
+            and sent == ["latencyVar{0}".format(i) for i in range(n)])
+
+
+def funcLargeConstantLength(name):
+    return len(shared.getConst(name))
+
+
+def funcSharedMappedConstant():
+    shared.setConst(largeVar=b"x" * scoop.SHARED_MEMORY_THRESHOLD)
+    lengths = futures.map(funcLargeConstantLength, ['largeVar'] * 10)
+    return set(lengths) == set([scoop.SHARED_MEMORY_THRESHOLD])
+
+
+def funcExecutingWorker(n):
+    time.sleep(0.05)
+    return scoop.worker
+
+
+def funcFederation(n):
+    # The origin and the worker of the fellow broker both execute tasks
+    return len(set(futures.map(funcExecutingWorker, range(n)))) == 2
+
+
+class HeavyCallable(object):
+    def __init__(self, size):
+        self.table = list(range(size))
+
+    def __call__(self, index):
+        return self.table[index]
+
+
+def funcHeavyCallable(n):
+    heavy = HeavyCallable(10000)
+    constantsBefore = len(shared.constants)
+    result = list(futures.map(heavy, range(n)))
+    # The callable was shared once for every Future
+    return result == list(range(n)) and \
+        len(shared.constants) == constantsBefore + 1
+
+
 def funcSharedFunction():
     shared.setConst(myRemoteFunc=func4)
     result = True
@@ -239,6 +339,106 @@ def funcMapAsCompleted(n):
     return sum(result)
 
 
+def funcMapChunked(n, chunksize):
+    result = list(futures.map(func4, [i+1 for i in range(n)],
+                              chunksize=chunksize))
+    return sum(result)
+
+
+def funcMapInlined(n):
+    # The first map measures the execution time of func4
+    result = sum(futures.map(func4, range(n), chunksize=None))
+    rank = next(Future.rank)
+    result += sum(futures.map(func4, range(n), chunksize=None))
+    # Too short to be distributed, the second map spawned no Future
+    return result, next(Future.rank) == rank + 1
+
+
+def funcOverheadUnderLoad(n):
+    # The futures wait in the broker queue, the pings don't
+    list(futures.map(funcExecutingWorker, range(n)))
+    return (len(_control.overheadStats) > 3
+            and _control.messagingOverhead() < 0.1)
+
+
+def funcMapAsCompletedChunked(n):
+    result = list(futures.map_as_completed(func4, [i+1 for i in range(n)],
+                                           chunksize=4))
+    return sum(result)
+
+
+def funcMapWindow(n, window, chunksize=1, ordered=True):
+    pulled = []
+
+    def source():
+        for i in range(n):
+            pulled.append(i)
+            yield i + 1
+
+    mapFunc = futures.map if ordered else futures.map_as_completed
+    results = mapFunc(func4, source(), window=window, chunksize=chunksize)
+    first = next(results)
+    lazy = len(pulled) <= (window + 1) * chunksize
+    if ordered and first != 1:
+        return None
+    return lazy, first + sum(results), len(_control.futureDict)
+
+
+def funcMapReduceChunked(l, chunksize):
+    return futures.mapReduce(func4, operator.add, l, chunksize=chunksize)
+
+
+def funcAio(n):
+    import asyncio
+    from scoop import aio
+
+    async def main():
+        first = await aio.submit(func4, 3)
+        results = await aio.map(func4, range(n))
+        try:
+            await aio.submit(funcRaise, 0)
+        except Exception:
+            return first, sum(results)
+
+    return asyncio.run(main())
+
+
+def funcAioRequested(n):
+    import asyncio
+    from scoop import aio, _control
+
+    async def main():
+        # Futures requested by the origin are sent back to the broker
+        _control.execQueue.socket.sendRequest(n)
+        return sum(await aio.map(func4, range(n)))
+
+    return asyncio.run(main())
+
+
+def funcSleep(duration):
+    time.sleep(duration)
+    return duration
+
+
+def funcSpan(duration):
+    start = time.time()
+    time.sleep(duration)
+    return start, time.time()
+
+
+def funcThreaded(n):
+    spans = list(futures.map(funcSpan, [0.2] * n, threaded=True))
+    # Some threaded Futures ran at the same time
+    overlapped = any(start < otherEnd and otherStart < end
+                     for i, (start, end) in enumerate(spans)
+                     for otherStart, otherEnd in spans[i + 1:])
+    # A threaded Future and a regular one waited together
+    mixed = [futures.submit(funcSleep, 0.1, threaded=True),
+             futures.submit(func4, 3)]
+    results = [f.result() for f in futures.as_completed(mixed)]
+    return len(spans) == n, overlapped, sorted(results)
+
+
 def funcIter(n):
     result = list(futures.map(func4, (i+1 for i in range(n))))
     return sum(result)
@@ -299,15 +499,18 @@ def port_ready(port, socket):
 
 
 class TestScoopCommon(unittest.TestCase):
+    # Additional arguments of the broker
+    brokerArgs = []
+
     def __init__(self, *args, **kwargs):
         # Parent initialization
         super(TestScoopCommon, self).__init__(*args, **kwargs)
 
-    def multiworker_set(self):
+    def multiworker_set(self, *args):
         global subprocesses
         worker = subprocess.Popen([sys.executable, "-m", "scoop.bootstrap.__main__",
         "--brokerHostname", "127.0.0.1", "--taskPort", "5555",
-        "--metaPort", "5556", "tests.py"])
+        "--metaPort", "5556"] + list(args) + ["tests.py"])
         subprocesses.append(worker)
         return worker
 
@@ -317,7 +520,7 @@ class TestScoopCommon(unittest.TestCase):
 
         # Start the server
         self.server = subprocess.Popen([sys.executable, "-m", "scoop.broker.__main__",
-        "--tPort", "5555", "--mPort", "5556"])
+        "--tPort", "5555", "--mPort", "5556"] + self.brokerArgs)
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         begin = datetime.datetime.now()
         while not port_ready(5555, s):
@@ -573,6 +776,20 @@ class TestApi(TestScoopCommon):
     def test_cancel(self):
         self.assertTrue(futures._startup(funcCancel))
 
+    def test_local_queue(self):
+        _control.execQueue.highwatermark = float("inf")
+        self.assertEqual(futures._startup(funcLocalQueue), (True, 25))
+
+    def test_local_queue_overflow(self):
+        _control.execQueue.lowwatermark = -1
+        _control.execQueue.highwatermark = -1
+        self.assertEqual(futures._startup(funcLocalQueue), (False, 25))
+
+    def test_priority(self):
+        _control.execQueue.highwatermark = float("inf")
+        self.assertEqual(futures._startup(funcPriority),
+                         ['urgent', 'late', 'normal', 'low'])
+
     def test_callback(self):
         self.assertTrue(futures._startup(funcCallback))
 
@@ -598,6 +815,97 @@ class TestApi(TestScoopCommon):
         result = futures._startup(funcMapAsCompleted, 30)
         self.assertEqual(result, 9455)
 
+    def test_map_chunksize_single(self):
+        result = futures._startup(funcMapChunked, 30, 7)
+        self.assertEqual(result, 9455)
+
+    def test_map_chunksize_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcMapChunked, 30, 7)
+        self.assertEqual(result, 9455)
+
+    def test_map_chunksize_auto(self):
+        result = futures._startup(funcMapChunked, 30, None)
+        self.assertEqual(result, 9455)
+
+    def test_map_chunksize_inlined(self):
+        result = futures._startup(funcMapInlined, 30)
+        self.assertEqual(result, (17110, True))
+
+    def test_overhead_under_load(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcOverheadUnderLoad, 40)
+        self.assertEqual(result, True)
+
+    def test_aio_single(self):
+        scoop.SIZE = 1
+        result = futures._startup(funcAio, 30)
+        self.assertEqual(result, (9, 8555))
+
+    def test_aio_multi(self):
+        # The origin only orchestrates, the worker executes the Futures
+        self.w = self.multiworker_set("--workingDirectory", os.getcwd())
+        result = futures._startup(funcAio, 30)
+        self.assertEqual(result, (9, 8555))
+
+    def test_aio_requested(self):
+        self.w = self.multiworker_set("--workingDirectory", os.getcwd())
+        result = futures._startup(funcAioRequested, 30)
+        self.assertEqual(result, 8555)
+
+    def test_map_as_completed_chunksize(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcMapAsCompletedChunked, 30)
+        self.assertEqual(result, 9455)
+
+    def test_map_window_single(self):
+        result = futures._startup(funcMapWindow, 30, 4)
+        self.assertEqual(result, (True, 9455, 1))
+
+    def test_map_window_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcMapWindow, 30, 4)
+        self.assertEqual(result, (True, 9455, 1))
+
+    def test_map_window_as_completed(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcMapWindow, 30, 3, 4, False)
+        self.assertEqual(result, (True, 9455, 1))
+
+    def test_map_prefetch_single(self):
+        _control.execQueue.prefetch = 4
+        result = futures._startup(func3, 30)
+        self.assertEqual(result, 9455)
+
+    def test_map_prefetch_multi(self):
+        self.w = self.multiworker_set("--prefetch", "4")
+        _control.execQueue.prefetch = 4
+        result = futures._startup(func3, 30)
+        self.assertEqual(result, 9455)
+
+    def test_work_stealing_single(self):
+        _control.execQueue.workStealing = True
+        result = futures._startup(main, 4)
+        self.assertEqual(result, 77)
+
+    def test_work_stealing_multi(self):
+        self.w = self.multiworker_set("--scheduler", "steal")
+        _control.execQueue.workStealing = True
+        result = futures._startup(main, 20)
+        self.assertEqual(result, 76153)
+
+    def test_threaded_single(self):
+        _control.execQueue.startThreads(4)
+        result = futures._startup(funcThreaded, 8)
+        self.assertEqual(result, (True, True, [0.1, 9]))
+
+    def test_threaded_multi(self):
+        self.w = self.multiworker_set("--threadsPerWorker", "4")
+        _control.execQueue.startThreads(4)
+        result = futures._startup(funcThreaded, 8)
+        self.assertTrue(result[0])
+        self.assertEqual(result[2], [0.1, 9])
+
     def test_from_generator_single(self):
         result = futures._startup(funcIter, 30)
         self.assertEqual(result, 9455)
@@ -607,6 +915,24 @@ class TestApi(TestScoopCommon):
         result = futures._startup(funcIter, 30)
         self.assertEqual(result, 9455)
 
+    def test_serializer_multi(self):
+        # Messages of any serializer are read by the pickle-based origin
+        self.w = self.multiworker_set("--serializer", "marshal")
+        result = futures._startup(main, 20)
+        self.assertEqual(result, 76153)
+
+    @unittest.skipIf(sys.version_info < (3, 8), "requires pickle protocol 5")
+    def test_buffers_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcBuffers, 8)
+        self.assertEqual(result, 8 * (1 << 20))
+
+    def test_mapReduce_priority_multi(self):
+        # Reduction subtrees are sent to the broker with increasing priorities
+        self.w = self.multiworker_set()
+        result = futures._startup(funcMapReduce, list(range(100)))
+        self.assertEqual(result, 328350)
+
 
 class TestCoherent(TestScoopCommon):
     def __init(self, *args, **kwargs):
@@ -620,6 +946,14 @@ class TestCoherent(TestScoopCommon):
         result = futures._startup(funcDoubleMapReduce, [10, 20, 30])
         self.assertTrue(result)
 
+    def test_mapReduce_chunksize(self):
+        result = futures._startup(funcMapReduceChunked, list(range(30)), 4)
+        self.assertEqual(result, 8555)
+
+    def test_mapReduce_chunksize_auto(self):
+        result = futures._startup(funcMapReduceChunked, list(range(30)), None)
+        self.assertEqual(result, 8555)
+
     def test_mapScan(self):
         result = futures._startup(funcMapScan, [10, 20, 30])
         self.assertEqual(max(result), 1400)
@@ -637,6 +971,170 @@ class TestShared(TestScoopCommon):
         result = futures._startup(funcSharedConstant)
         self.assertEqual(result, True)
 
+    def test_shareConstant_mapped(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcSharedMappedConstant)
+        self.assertEqual(result, True)
+
+    def test_shareCallable(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcHeavyCallable, 50)
+        self.assertEqual(result, True)
+
+    def test_shareConstant_latency(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcSharedConstantLatency, 20)
+        self.assertEqual(result, True)
+
+
+class TestBrokerIOThread(TestScoopCommon):
+    brokerArgs = ["--io-thread"]
+
+    def test_map_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(func3, 30)
+        self.assertEqual(result, 9455)
+
+    def test_work_stealing_multi(self):
+        self.w = self.multiworker_set("--scheduler", "steal")
+        _control.execQueue.workStealing = True
+        result = futures._startup(main, 20)
+        self.assertEqual(result, 76153)
+
+    def test_shareConstant_latency(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcSharedConstantLatency, 20)
+        self.assertEqual(result, True)
+
+
+class TestBrokerFederation(TestScoopCommon):
+    def multiworker_set(self, *args):
+        # The worker is served by the fellow broker
+        global subprocesses
+        worker = subprocess.Popen([sys.executable, "-m", "scoop.bootstrap.__main__",
+        "--brokerHostname", "127.0.0.1", "--taskPort", "5557",
+        "--metaPort", "5558", "--workingDirectory", os.getcwd()]
+        + list(args) + ["tests.py"])
+        subprocesses.append(worker)
+        return worker
+
+    def setUp(self):
+        global subprocesses
+        import socket, datetime
+        import zmq
+        super(TestBrokerFederation, self).setUp()
+
+        self.fellow = subprocess.Popen([sys.executable, "-m", "scoop.broker.__main__",
+        "--tPort", "5557", "--mPort", "5558"])
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        begin = datetime.datetime.now()
+        while not port_ready(5557, s):
+            if (datetime.datetime.now() - begin > datetime.timedelta(seconds=3)):
+                raise Exception('Could not start server!')
+        subprocesses.append(self.fellow)
+
+        # Connect the brokers, as the launcher does
+        brokers = [BrokerInfo("127.0.0.1", 5555, 5556, "127.0.0.1"),
+                   BrokerInfo("127.0.0.1", 5557, 5558, "127.0.0.1")]
+        self.context = zmq.Context()
+        for broker in brokers:
+            launcher = self.context.socket(zmq.DEALER)
+            launcher.connect("tcp://127.0.0.1:{0}".format(broker.task_port))
+            launcher.send_multipart([
+                CONNECT,
+                pickle.dumps([b for b in brokers if b is not broker]),
+                pickle.dumps(broker),
+            ])
+
+    def tearDown(self):
+        super(TestBrokerFederation, self).tearDown()
+        if self.fellow.poll() == None:
+            self.fellow.terminate()
+            self.fellow.wait()
+        self.context.destroy(1000)
+
+    def test_federation(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcFederation, 60)
+        self.assertEqual(result, True)
+
+    def test_federation_shareConstant(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcSharedConstant)
+        self.assertEqual(result, True)
+
+
+
+class TestForkServer(TestScoopCommon):
+    def multiworker_set(self, *args):
+        # The workers are forked by the launch module after importing tests.py
+        global subprocesses
+        worker = subprocess.Popen([sys.executable, "-m", "scoop.launch.__main__",
+        "2", "0", "--forkServer=module", "--brokerHostname", "127.0.0.1",
+        "--taskPort", "5555", "--metaPort", "5556",
+        "--workingDirectory", os.getcwd()] + list(args) + ["tests.py"])
+        subprocesses.append(worker)
+        return worker
+
+    def test_map_multi(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(func3, 30)
+        self.assertEqual(result, 9455)
+
+    def test_shareConstant(self):
+        self.w = self.multiworker_set()
+        result = futures._startup(funcSharedConstant)
+        self.assertEqual(result, True)
+
+
+class TestLocalBackend(unittest.TestCase):
+    def setUp(self):
+        # Fork a worker communicating through queues, as the launcher does
+        _control.execQueue = None
+        self.channels = scooplocal.LocalChannels(2)
+        self.w = multiprocessing.get_context("fork").Process(
+            target=scooplocal.runWorker,
+            args=(self.channels, 1, ["--size", "2", "--backend", "local",
+                                     "--workingDirectory", os.getcwd(),
+                                     "tests.py"]),
+        )
+        self.w.start()
+
+        # Setup worker environment
+        scooplocal._channels, scooplocal._rank = self.channels, 0
+        self.configuration = scoop.CONFIGURATION
+        scoop.CONFIGURATION = {'backend': 'local'}
+        scoop.IS_RUNNING = True
+        scoop.IS_ORIGIN = True
+        scoop.MAIN_MODULE = "tests.py"
+        scoop.DEBUG = False
+        scoop.SIZE = 2
+        _control.execQueue = FutureQueue()
+
+    def tearDown(self):
+        _control.execQueue.shutdown()
+        del _control.execQueue
+        _control.futureDict.clear()
+        self.w.join(5)
+        if self.w.is_alive():
+            self.w.terminate()
+        scoop.CONFIGURATION = self.configuration
+        scooplocal._channels, scooplocal._rank = None, None
+
+    def test_map(self):
+        result = futures._startup(func3, 30)
+        self.assertEqual(result, 9455)
+        self.assertEqual(self.w.exitcode, None)
+
+    def test_shareConstant(self):
+        result = futures._startup(funcSharedConstant)
+        self.assertEqual(result, True)
+
+    def test_shutdown(self):
+        futures._startup(func3, 10)
+        _control.execQueue.shutdown()
+        self.w.join(5)
+        self.assertEqual(self.w.exitcode, 0)
 
 if __name__ == '__main__' and os.environ.get('IS_ORIGIN', "1") == "1":
     utSimple = unittest.TestLoader().loadTestsFromTestCase(TestSingleFunction)
@@ -0,0 +1,160 @@
+from scoop.broker.brokerzmq import Broker
+from scoop import utils
+from scoop.broker.structs import BrokerInfo
+from scoop._comm.scoopmessages import (TASK, TASKS, TASK_HEADER, FRAME_COUNT,
+                                       FLAG_SEND_RESULT_BACK, BROKER_LOAD,
+                                       BROKER_TASKS, SEGMENT, FETCH)
+
+import os
+import pickle
+import unittest
+
+import zmq
+
+
+def makeTask(rank):
+    """Returns the pickled id and the frames of an empty Future."""
+    task_id = pickle.dumps((b"origin", rank), pickle.HIGHEST_PROTOCOL)
+    header = TASK_HEADER.pack(rank, 0, FLAG_SEND_RESULT_BACK, 0., 0.)
+    return task_id, [header, b"origin", b"func", b"args"]
+
+
+class TestBrokerBatch(unittest.TestCase):
+    def setUp(self):
+        self.broker = Broker("tcp://127.0.0.1:*", "tcp://127.0.0.1:*")
+        self.worker = self.broker.context.socket(zmq.DEALER)
+        self.worker.setsockopt(zmq.IDENTITY, b"worker")
+        self.worker.connect(
+            "tcp://127.0.0.1:{0}".format(self.broker.getPorts()[0])
+        )
+        # Wait for the broker to know the worker
+        self.worker.send_multipart([b"HB"])
+        self.broker.task_socket.recv_multipart()
+
+    def tearDown(self):
+        self.broker.context.destroy(0)
+
+    def test_single_task(self):
+        task_id, task = makeTask(0)
+        self.broker.addCredits(b"worker", 4)
+        self.broker.assignTask(task_id, task)
+        self.broker.flushTasks()
+        self.assertEqual(self.worker.recv_multipart(), [TASK] + task)
+        self.assertEqual(self.broker.assigned_tasks[b"worker"], {task_id})
+
+    def test_coalesced_tasks(self):
+        tasks = [makeTask(rank) for rank in range(3)]
+        for task_id, task in tasks:
+            self.broker.assignTask(task_id, task)
+        # The queued tasks are sent in a single message
+        self.broker.addCredits(b"worker", 4)
+        self.broker.flushTasks()
+        msg = self.worker.recv_multipart()
+        self.assertEqual(msg[0], TASKS)
+        self.assertEqual(msg[1], FRAME_COUNT.pack(4) * 3)
+        self.assertEqual(msg[2:], sum((task for _, task in tasks), []))
+        self.assertEqual(self.broker.assigned_tasks[b"worker"],
+                         set(task_id for task_id, _ in tasks))
+        self.assertEqual(self.broker.worker_credits[b"worker"], 1)
+
+    def test_undelivered_tasks(self):
+        for rank in range(2):
+            self.broker.safeTaskSend(b"lost", *makeTask(rank))
+        self.broker.flushTasks()
+        self.assertEqual(len(self.broker.unassigned_tasks), 2)
+        self.assertFalse(self.broker.assigned_tasks[b"lost"])
+
+    def test_locality(self):
+        self.broker.config['scheduler'] = 'locality'
+        for address in (b"10.0.0.1:5000", b"10.0.0.2:5000", b"10.0.0.2:5001"):
+            self.broker.addCredits(address, 1)
+        task_id, task = makeTask(0)
+        # Submitted by a worker of the host 10.0.0.2
+        task[1] = b"10.0.0.2:6000"
+        for _ in range(2):
+            self.broker.assignTask(task_id, task)
+        self.assertEqual(sorted(self.broker.outgoing_tasks),
+                         [b"10.0.0.2:5000", b"10.0.0.2:5001"])
+        # The remote worker receives a task once the local ones are busy
+        self.broker.assignTask(task_id, task)
+        self.assertEqual(len(self.broker.outgoing_tasks[b"10.0.0.1:5000"]), 1)
+        self.assertFalse(self.broker.available_workers)
+        self.assertFalse(self.broker.host_workers)
+
+    @unittest.skipUnless(zmq.has("ipc"), "IPC transport unavailable")
+    def test_segment(self):
+        # Requested by a worker of another host before it is received
+        self.broker.relay([b"worker", FETCH, b"digest"])
+        self.broker.relay([b"origin", SEGMENT, b"digest", b"content"])
+        self.assertEqual(self.worker.recv_multipart(),
+                         [SEGMENT, b"digest", b"content"])
+        self.assertFalse(self.broker.segment_requests)
+        # Kept for the next hosts
+        self.broker.relay([b"worker", FETCH, b"digest"])
+        self.assertEqual(self.worker.recv_multipart(),
+                         [SEGMENT, b"digest", b"content"])
+
+    def test_ipc_endpoint(self):
+        port = self.broker.getPorts()[0]
+        path = self.broker.getIPCPaths()[0]
+        self.assertEqual(os.path.dirname(path), utils.runDirectory())
+        address = utils.endpoint("127.0.0.1", port, path)
+        self.assertEqual(address, "ipc://{0}".format(path))
+        # Reached through TCP from the other hosts or without advertised path
+        self.assertEqual(utils.endpoint("192.0.2.1", port, path),
+                         "tcp://192.0.2.1:{0}".format(port))
+        self.assertTrue(utils.endpoint("127.0.0.1", port).startswith("tcp://"))
+        worker = self.broker.context.socket(zmq.DEALER)
+        worker.setsockopt(zmq.IDENTITY, b"ipcworker")
+        worker.connect(address)
+        worker.send_multipart([b"HB"])
+        self.assertEqual(self.broker.task_socket.recv_multipart(),
+                         [b"ipcworker", b"HB"])
+
+
+class TestBrokerFederation(unittest.TestCase):
+    def setUp(self):
+        self.brokers = [Broker("tcp://127.0.0.1:*", "tcp://127.0.0.1:*")
+                        for _ in range(2)]
+        infos = [BrokerInfo("127.0.0.1", broker.getPorts()[0],
+                            broker.getPorts()[1], "127.0.0.1")
+                 for broker in self.brokers]
+        for broker, info in zip(self.brokers, infos):
+            broker.federation_name = Broker.brokerName(info)
+        for broker, info in zip(self.brokers, infos):
+            broker.addBrokerList([other for other in infos if other != info])
+
+    def tearDown(self):
+        for broker in self.brokers:
+            broker.context.destroy(0)
+
+    def test_forward_tasks(self):
+        busy, idle = self.brokers
+        idle.addCredits(b"worker", 2)
+        idle.balanceLoad()
+        msg = busy.receive(busy.task_socket)
+        self.assertEqual(msg[:3], [idle.federation_name, BROKER_LOAD,
+                                   pickle.dumps(2, pickle.HIGHEST_PROTOCOL)])
+        busy.schedule(msg)
+
+        tasks = [makeTask(rank) for rank in range(3)]
+        for task_id, task in tasks:
+            busy.assignTask(task_id, task)
+        busy.balanceLoad()
+        # Only the tasks the idle workers can receive are forwarded
+        self.assertEqual(len(busy.unassigned_tasks), 1)
+        self.assertEqual(busy.peer_demand[idle.federation_name], 0)
+        msg = idle.receive(idle.task_socket)
+        self.assertEqual(msg[1], BROKER_TASKS)
+        idle.schedule(msg)
+        self.assertEqual(len(idle.outgoing_tasks[b"worker"]), 2)
+        self.assertEqual(
+            [task_id for task_id, _, _ in idle.outgoing_tasks[b"worker"]],
+            [task_id for task_id, _ in tasks[:2]],
+        )
+
+
+if __name__ == "__main__":
+    for testCase in (TestBrokerBatch, TestBrokerFederation):
+        t = unittest.TestLoader().loadTestsFromTestCase(testCase)
+        unittest.TextTestRunner(verbosity=2).run(t)
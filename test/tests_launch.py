@@ -0,0 +1,48 @@
+import unittest
+
+from scoop.launch.workerLaunch import (splitTree, encodeTree, decodeTree,
+                                       treeCommand)
+
+
+def makeEntry(index):
+    """Returns the tree entry of a host."""
+    hostname = "node{0}".format(index)
+    return [hostname,
+            ["python", "-m", "scoop.launch.__main__", "4", "1",
+             "--reportAs={0}".format(hostname)],
+            ["--size", "400", "program.py"]]
+
+
+class TestLaunchTree(unittest.TestCase):
+    def test_split(self):
+        hosts = list(range(10))
+        self.assertEqual(splitTree(hosts, 3),
+                         [(0, [1, 2, 3]), (4, [5, 6, 7]), (8, [9])])
+        self.assertEqual(splitTree(hosts[:2], 3), [(0, []), (1, [])])
+        self.assertEqual(splitTree([], 3), [])
+
+    def test_encode(self):
+        ssh = ["ssh", "-x"]
+        hosts = [makeEntry(index) for index in range(500)]
+        encoded = encodeTree(ssh, 16, hosts)
+        # Passed as a single shell word of a command line
+        self.assertTrue(len(encoded) < 2 ** 16)
+        self.assertTrue(all(c.isalnum() or c in "-_=" for c in encoded))
+        self.assertEqual(decodeTree(encoded), [ssh, 16, hosts])
+
+    def test_command(self):
+        entry = makeEntry(0)
+        self.assertEqual(treeCommand(entry, ["ssh"], 2, []),
+                         "python -m scoop.launch.__main__ 4 1 --reportAs=node0 "
+                         "--size 400 program.py")
+        command = treeCommand(entry, ["ssh"], 2, [makeEntry(1)]).split()
+        # The tree option is given to the launch module
+        self.assertTrue(command[6].startswith("--tree="))
+        self.assertEqual(command[7:], entry[2])
+        self.assertEqual(decodeTree(command[6][len("--tree="):]),
+                         [["ssh"], 2, [makeEntry(1)]])
+
+
+if __name__ == "__main__":
+    t = unittest.TestLoader().loadTestsFromTestCase(TestLaunchTree)
+    unittest.TextTestRunner(verbosity=2).run(t)
@@ -0,0 +1,89 @@
+import scoop
+from scoop._comm import serializers
+
+import pickle
+import unittest
+
+
+class TestSerializers(unittest.TestCase):
+    def __init__(self, *args, **kwargs):
+        super(TestSerializers, self).__init__(*args, **kwargs)
+
+    def tearDown(self):
+        serializers.setSerializer('pickle')
+
+    def roundTrip(self, name, values):
+        try:
+            serializers.setSerializer(name)
+        except ImportError:
+            self.skipTest("{0} is not installed".format(name))
+        for value in values:
+            data = serializers.dumps(value)
+            self.assertEqual(serializers.loads(data), value)
+            frames = serializers.dumpsFrames(value)
+            self.assertEqual(serializers.loadsFrames(frames), value)
+
+    def test_pickle(self):
+        self.roundTrip('pickle', [(b"127.0.0.1:5555", 3), {'a': [1, 2]}])
+
+    def test_marshal(self):
+        self.roundTrip('marshal', [(b"127.0.0.1:5555", 3), 1.5, None,
+                                   (1, ("a", [2])), {'a': [1, 2]}, set([1])])
+        self.assertEqual(serializers.dumps((b"id", 3))[:1],
+                         serializers.MARSHAL_TAG)
+        # Objects marshal doesn't handle fall back on pickle
+        self.assertEqual(serializers.dumps((1, set)),
+                         serializers.PickleSerializer().dumps((1, set)))
+
+    def test_msgpack(self):
+        self.roundTrip('msgpack', [(b"127.0.0.1:5555", 3), ("a", 1.5, None),
+                                   (1, [2]), {'a': 1}])
+
+    def test_msgpack_task(self):
+        # Arguments, keyword arguments and callbacks of a task
+        payload = ((3, "a", (1.5, None)), {'chunksize': 2, 'key': b"k"}, None)
+        self.assertTrue(serializers.isPrimitive(payload))
+        self.assertFalse(serializers.isPrimitive(({1: 2},)))
+        self.assertFalse(serializers.isPrimitive(({'a': [1]},)))
+        self.roundTrip('msgpack', [payload])
+        # Without the pickle fallback
+        frames = serializers.dumpsFrames(payload)
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0][:1], serializers.MSGPACK_TAG)
+
+    def test_msgpack_overflow(self):
+        # Integers out of the msgpack range fall back on pickle
+        self.roundTrip('msgpack', [2 ** 64, (b"id", -2 ** 70)])
+
+    def test_ids(self):
+        # Ids are serialized identically whatever the serializer
+        futureId = (b"127.0.0.1:5555", 2 ** 70)
+        data = serializers.dumpsId(futureId)
+        for name in serializers.SERIALIZERS:
+            try:
+                serializers.setSerializer(name)
+            except ImportError:
+                continue
+            self.assertEqual(serializers.dumpsId(futureId), data)
+        self.assertEqual(serializers.loads(data), futureId)
+
+    def test_cloudpickle(self):
+        self.roundTrip('cloudpickle', [(b"127.0.0.1:5555", 3), {'a': [1, 2]}])
+
+    @unittest.skipUnless(serializers.PICKLE_BUFFERS, "pickle protocol 5 only")
+    def test_writable_buffers(self):
+        value = pickle.PickleBuffer(bytearray(scoop.ZERO_COPY_THRESHOLD))
+        frames = serializers.dumpsFrames(value)
+        self.assertEqual(len(frames), 2)
+        # Received frames are read-only
+        result = serializers.loadsFrames([bytes(frame) for frame in frames])
+        self.assertFalse(memoryview(result).readonly)
+        self.assertEqual(memoryview(result).nbytes, scoop.ZERO_COPY_THRESHOLD)
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, serializers.setSerializer, 'unknown')
+
+
+if __name__ == "__main__":
+    t = unittest.TestLoader().loadTestsFromTestCase(TestSerializers)
+    unittest.TextTestRunner(verbosity=2).run(t)
@@ -0,0 +1,191 @@
+import scoop
+from scoop import shared, encapsulation, utils, _control
+
+import os
+import pickle
+import stat
+import tempfile
+import unittest
+
+
+class Multiplier(object):
+    def __init__(self, factor):
+        self.factor = factor
+
+    def apply(self, value):
+        return self.factor * value
+
+
+class VariableQueue(object):
+    """Execution queue recording the shared variables sent."""
+    def __init__(self):
+        self.socket = self
+        self.sent = []
+
+    def sendVariable(self, key, value):
+        self.sent.append(key)
+
+
+class SegmentQueue(object):
+    """Execution queue whose broker serves the given segments."""
+    def __init__(self, segments):
+        self.socket = self
+        self.served = segments
+        self.segments = {}
+        self.fetched = []
+
+    def sendFetch(self, digest):
+        self.fetched.append(digest)
+        self.segments[digest] = self.served[digest]
+
+    def _poll(self, timeout):
+        pass
+
+    def updateQueue(self):
+        pass
+
+
+class TestSharedIndex(unittest.TestCase):
+    def setUp(self):
+        shared._setElements({
+            'worker1': {'first': 1, 'square': lambda x: x * x},
+            'worker2': {'second': 2},
+        })
+
+    def tearDown(self):
+        shared._setElements({})
+
+    def test_index(self):
+        self.assertEqual(shared.getConst('first', timeout=0), 1)
+        self.assertEqual(shared.getConst('second', timeout=0), 2)
+        shared._updateElement('worker2', 'third', 3)
+        self.assertEqual(shared.getConst('third', timeout=0), 3)
+        self.assertEqual(shared.elements['worker2'],
+                         {'second': 2, 'third': 3})
+        shared._setElements({'worker3': {'fourth': 4}})
+        self.assertEqual(shared.constants, {'fourth': 4})
+
+    def test_resolved_callable(self):
+        square = shared.SharedElementEncapsulation('square')
+        self.assertEqual(square(4), 16)
+        self.assertIn(('square', None), shared._resolvedCallables)
+        shared._updateElement('worker1', 'square', lambda x: -x)
+        self.assertNotIn(('square', None), shared._resolvedCallables)
+        self.assertEqual(square(4), -4)
+
+    def test_resolved_method(self):
+        shared._updateElement('worker1', 'multiplier', Multiplier(3))
+        apply = shared.SharedElementEncapsulation('multiplier')
+        apply.isMethod = True
+        apply.methodName = 'apply'
+        self.assertEqual(apply(5), 15)
+        self.assertIn(('multiplier', 'apply'), shared._resolvedCallables)
+
+    def test_callable_cache_eviction(self):
+        cacheSize = scoop.CALLABLE_CACHE_SIZE
+        scoop.CALLABLE_CACHE_SIZE = 2
+        try:
+            for factor in range(4):
+                name = 'multiplier{0}'.format(factor)
+                shared._updateElement('worker1', name, Multiplier(factor))
+                method = shared.SharedElementEncapsulation(name)
+                method.isMethod = True
+                method.methodName = 'apply'
+                self.assertEqual(method(2), 2 * factor)
+            self.assertEqual(list(shared._resolvedCallables),
+                             [('multiplier2', 'apply'),
+                              ('multiplier3', 'apply')])
+        finally:
+            scoop.CALLABLE_CACHE_SIZE = cacheSize
+
+    def test_serialized_callable(self):
+        data = pickle.dumps(Multiplier(7), pickle.HIGHEST_PROTOCOL)
+        shared._updateElement('worker1', 'callable:1234',
+                              encapsulation.CallableEncapsulation(data))
+        reference = shared.SharedElementEncapsulation('callable:1234')
+        reference.isMethod = True
+        reference.methodName = 'apply'
+        self.assertEqual(reference(3), 21)
+        resolved = shared._resolvedCallables['callable:1234', 'apply']
+        self.assertIs(reference._resolve(), resolved)
+
+    def test_large_callable_content(self):
+        multiplier = Multiplier(3)
+        multiplier.table = bytes(scoop.CALLABLE_SHARING_THRESHOLD)
+        execQueue = VariableQueue()
+        previousQueue, _control.execQueue = _control.execQueue, execQueue
+        previousWorker = getattr(scoop, 'worker', None)
+        scoop.worker = 'worker1'
+        try:
+            reference = shared._shareLargeCallable(multiplier.apply)
+            # Shared once while unchanged
+            self.assertEqual(shared._shareLargeCallable(multiplier.apply)
+                             .uniqueID, reference.uniqueID)
+            self.assertEqual(len(execQueue.sent), 1)
+            # Shared again once changed
+            multiplier.factor = 4
+            changed = shared._shareLargeCallable(multiplier.apply)
+        finally:
+            _control.execQueue = previousQueue
+            scoop.worker = previousWorker
+        self.assertNotEqual(changed.uniqueID, reference.uniqueID)
+        self.assertEqual(len(execQueue.sent), 2)
+        self.assertEqual(changed(2), 8)
+
+    def test_function_rebuilt_once(self):
+        function = encapsulation.FunctionEncapsulation(lambda x: x + 1,
+                                                       'increment')
+        self.assertIs(function.getFunction(), function.getFunction())
+        self.assertEqual(function(1), 2)
+        received = pickle.loads(pickle.dumps(function))
+        self.assertNotIn('_function', received.__dict__)
+        self.assertEqual(received(2), 3)
+
+    def test_mapped_constant(self):
+        value = {'table': pickle.PickleBuffer(bytearray(1 << 20)),
+                 'name': 'lookup'}
+        mapped = encapsulation.mapIfLarge(value)
+        self.assertIsInstance(mapped, encapsulation.MappedEncapsulation)
+        self.assertIs(encapsulation.mapIfLarge(value['name']), value['name'])
+        directory = os.stat(encapsulation.segmentDirectory())
+        self.assertEqual(stat.S_IMODE(directory.st_mode), 0o700)
+        # Only the digest is sent to the workers
+        data = pickle.dumps(mapped, pickle.HIGHEST_PROTOCOL)
+        self.assertLess(len(data), 1024)
+        # Received by a worker of another host, which fetches the segment
+        execQueue = SegmentQueue({mapped.digest: bytes(mapped.getSegment())})
+        os.remove(mapped.path)
+        received = pickle.loads(data)
+        shared._updateElement('worker2', 'lookup', received)
+        previousQueue, _control.execQueue = _control.execQueue, execQueue
+        try:
+            result = shared.getConst('lookup', timeout=0)
+        finally:
+            _control.execQueue = previousQueue
+        self.assertEqual(execQueue.fetched, [mapped.digest])
+        self.assertTrue(os.path.exists(received.path))
+        self.assertEqual(result['name'], 'lookup')
+        table = memoryview(result['table'])
+        self.assertEqual(table.nbytes, 1 << 20)
+        # Used from the read-only mapping
+        self.assertTrue(table.readonly)
+        self.assertIs(shared.getConst('lookup', timeout=0), result)
+
+    def test_segment_directory(self):
+        previous = encapsulation.segmentDirectory()
+        path = tempfile.mkdtemp()
+        os.chmod(path, 0o755)
+        os.environ[utils.RUN_DIRECTORY_ENV] = path
+        utils._runDirectory = None
+        try:
+            # Other users could create the segments of the pool
+            self.assertRaises(OSError, encapsulation.segmentDirectory)
+        finally:
+            os.rmdir(path)
+            os.environ[utils.RUN_DIRECTORY_ENV] = previous
+            utils._runDirectory = previous
+
+
+if __name__ == "__main__":
+    t = unittest.TestLoader().loadTestsFromTestCase(TestSharedIndex)
+    unittest.TextTestRunner(verbosity=2).run(t)
@@ -1,4 +1,6 @@
 from scoop._control import _stat
+from scoop import _control, futures
+import scoop
 import unittest
 
 class TestStat(unittest.TestCase):
@@ -66,6 +68,56 @@ class TestStat(unittest.TestCase):
         stats.appendleft(1000)
         self.assertAlmostEqual(stats.median(), 9.03600168611)
 
+
+def mapped(n):
+    return n
+
+
+class TestGranularity(unittest.TestCase):
+    def setUp(self):
+        self.size = getattr(scoop, "SIZE", 1)
+        scoop.SIZE = 4
+        _control.overheadStats = _stat()
+
+    def tearDown(self):
+        scoop.SIZE = self.size
+        _control.execStats.pop(hash(mapped), None)
+        _control.overheadStats = _stat()
+
+    def setDuration(self, duration, stats):
+        for _ in range(stats.maxlen):
+            stats.appendleft(duration)
+
+    def test_overhead(self):
+        self.assertEqual(_control.messagingOverhead(),
+                         scoop.MESSAGING_OVERHEAD)
+        self.setDuration(0.005, _control.overheadStats)
+        self.assertAlmostEqual(_control.messagingOverhead(), 0.005)
+
+    def test_coalesce(self):
+        # Unknown duration: a few chunks per worker
+        self.assertEqual(futures._getChunksize(mapped, None, 1000), 63)
+        self.setDuration(1e-5, _control.execStats[hash(mapped)])
+        self.setDuration(0.001, _control.overheadStats)
+        # Chunks last GRANULARITY_FACTOR times the overhead
+        self.assertEqual(futures._getChunksize(mapped, None, 10000), 1000)
+        self.assertFalse(futures._isInlined(mapped, None, 10000))
+
+    def test_distribute(self):
+        self.setDuration(0.1, _control.execStats[hash(mapped)])
+        self.setDuration(0.001, _control.overheadStats)
+        self.assertEqual(futures._getChunksize(mapped, None, 1000), 1)
+        self.assertFalse(futures._isInlined(mapped, None, 1000))
+
+    def test_inline(self):
+        self.setDuration(1e-5, _control.execStats[hash(mapped)])
+        self.setDuration(0.001, _control.overheadStats)
+        self.assertTrue(futures._isInlined(mapped, None, 500))
+        # A requested chunk size is never overridden
+        self.assertFalse(futures._isInlined(mapped, 10, 500))
+
+
 if __name__ == "__main__":
-    t = unittest.TestLoader().loadTestsFromTestCase(TestStat)
-    unittest.TextTestRunner(verbosity=2).run(t)
+    for testCase in (TestStat, TestGranularity):
+        t = unittest.TestLoader().loadTestsFromTestCase(testCase)
+        unittest.TextTestRunner(verbosity=2).run(t)
@@ -0,0 +1,126 @@
+from scoop.broker.structs import TaskQueue
+from scoop._types import Future, MovableQueue
+from scoop import _control
+
+import unittest
+
+
+class TestTaskQueue(unittest.TestCase):
+    def __init__(self, *args, **kwargs):
+        super(TestTaskQueue, self).__init__(*args, **kwargs)
+
+    def test_fifo(self):
+        queue = TaskQueue()
+        for i in range(5):
+            queue.append((i, i))
+        self.assertEqual([queue.popleft()[0][0] for _ in range(5)],
+                         list(range(5)))
+        self.assertFalse(queue)
+
+    def test_priority(self):
+        queue = TaskQueue()
+        queue.append((0, 0))
+        queue.append((1, 1), (2, None))
+        queue.append((2, 2), (-1, None))
+        queue.append((3, 3), (2, None))
+        self.assertEqual(len(queue), 4)
+        self.assertEqual([queue.popleft()[0][0] for _ in range(4)],
+                         [1, 3, 0, 2])
+
+    def test_deadline(self):
+        queue = TaskQueue()
+        queue.append((0, 0))
+        queue.append((1, 1), (0, 20.))
+        queue.append((2, 2), (0, 10.))
+        queue.append((3, 3), (1, 30.))
+        self.assertEqual(queue.popleft(), ((3, 3), (1, 30.)))
+        self.assertEqual([queue.popleft()[0][0] for _ in range(3)],
+                         [2, 1, 0])
+
+
+class QueuedFuture(object):
+    def __init__(self, id, priority=0, deadline=None, callable=None):
+        self.id = id
+        self.priority = priority
+        self.deadline = deadline
+        self.callable = callable
+    _scheduleKey = Future._scheduleKey
+
+
+class TestFuture(unittest.TestCase):
+    def test_slots(self):
+        future = Future._rebuild((b"worker", 0), None, None, (), {})
+        # Every slot is initialised
+        for name in Future.__slots__:
+            getattr(future, name)
+        # Other attributes are still accepted
+        future.tag = "user"
+        self.assertEqual(future.__dict__, {'tag': "user"})
+
+
+class TestMovableQueue(unittest.TestCase):
+    def test_fifo(self):
+        queue = MovableQueue()
+        futures = [QueuedFuture(i) for i in range(4)]
+        for future in futures:
+            queue.append(future)
+        queue.remove(futures[1])
+        self.assertEqual([queue.popNext().id for _ in range(3)], [0, 2, 3])
+        self.assertRaises(ValueError, queue.remove, futures[1])
+
+    def test_priority(self):
+        queue = MovableQueue()
+        futures = [QueuedFuture(0), QueuedFuture(1, 2), QueuedFuture(2, -1),
+                   QueuedFuture(3, 0, 10.), QueuedFuture(4, 2)]
+        for future in futures:
+            queue.append(future)
+        # Removed futures are skipped
+        queue.remove(futures[4])
+        self.assertEqual(queue.popleft().id, 0)
+        self.assertEqual([queue.popNext().id for _ in range(3)], [1, 3, 2])
+        # The arrival order is restored once the queue drained
+        self.assertFalse(queue.prioritized)
+        self.assertFalse(queue.heap)
+
+    def test_lifo(self):
+        queue = MovableQueue(lifo=True)
+        for i in range(3):
+            queue.append(QueuedFuture(i))
+        self.assertEqual(queue.popNext().id, 2)
+        queue.append(QueuedFuture(3, 1))
+        queue.append(QueuedFuture(4))
+        self.assertEqual([queue.popNext().id for _ in range(4)], [3, 4, 1, 0])
+
+    def test_expected_time(self):
+        known = _control._stat()
+        for _ in range(5):
+            known.appendleft(2.)
+        stats = {hash(len): known}
+        original, _control.execStats = _control.execStats, stats
+        try:
+            queue = MovableQueue()
+            futures = [QueuedFuture(i, callable=len) for i in range(3)]
+            for future in futures:
+                queue.append(future)
+            self.assertAlmostEqual(queue.expectedTime(), 6.)
+            # Futures of unknown execution time last indefinitely
+            unknown = QueuedFuture(3, callable=abs)
+            queue.append(unknown)
+            self.assertEqual(queue.expectedTime(), float("inf"))
+            queue.remove(unknown)
+            queue.popNext()
+            self.assertAlmostEqual(queue.expectedTime(), 4.)
+            queue.popleft()
+            self.assertAlmostEqual(queue.expectedTime(), 2.)
+            queue.clear()
+            self.assertEqual(queue.expectedTime(), 0.)
+            # The statistics are left untouched
+            self.assertEqual(list(stats), [hash(len)])
+        finally:
+            _control.execStats = original
+
+
+if __name__ == "__main__":
+    for testCase in (TestTaskQueue, TestFuture, TestMovableQueue):
+        t = unittest.TestLoader().loadTestsFromTestCase(testCase)
+        unittest.TextTestRunner(verbosity=2).run(t)